@@ -0,0 +1,215 @@
+"""Bounded conversation history of the shopping agent
+
+Every household has one long-lived agent session. Only the last few turns
+(at most HISTORY_TURNS, within HISTORY_TOKEN_BUDGET) are replayed to the
+model; turns that leave that window are kept as one-line notes and, every
+HISTORY_SUMMARY_BATCH of them, folded into a short session memory that the
+agent receives in its system prompt. Sessions nobody used for
+AGENT_SESSION_MAX_AGE_DAYS are deleted and the SQLite file is vacuumed, so
+both the prompt and tmp/shopping_agent.db stay flat over months of use.
+
+Compact the storage by hand (the server also does it periodically):
+
+    python agent_history.py
+    python agent_history.py --max-age-days 7 --db tmp/shopping_agent.db
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from metrics import AGENT_STORAGE_COMPACTIONS_TOTAL
+from prompt_tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# agno SqliteStorage file and table of the agent sessions
+AGENT_STORAGE_FILE = os.getenv("AGENT_STORAGE_FILE", "tmp/shopping_agent.db")
+AGENT_SESSIONS_TABLE = "shopping_agent_sessions"
+
+# Earlier turns replayed to the model with each command: at most this many, within the token budget
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", "4"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+
+# Turns that leave the window are summarized into the session memory this many at a time
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "8"))
+HISTORY_SUMMARY_MAX_TOKENS = 200
+
+# Notes kept while summaries keep failing; the oldest are dropped beyond this
+MAX_PENDING_TURNS = 4 * HISTORY_SUMMARY_BATCH
+MAX_TURN_NOTE_CHARS = 200
+
+# Sessions untouched this long are deleted; the storage is compacted this often
+AGENT_SESSION_MAX_AGE_DAYS = float(os.getenv("AGENT_SESSION_MAX_AGE_DAYS", "30"))
+AGENT_STORAGE_COMPACT_INTERVAL_HOURS = float(os.getenv("AGENT_STORAGE_COMPACT_INTERVAL_HOURS", "24"))
+
+SUMMARY_INSTRUCTIONS = (
+    "אתה מסכם שיחות של עוזר רשימת קניות קולי של משפחה. "
+    "עדכן את הזיכרון הקודם לפי התורות החדשות וכתוב זיכרון קצר בעברית, עד 60 מילים: "
+    "העדפות המשפחה, מותגים וכמויות קבועות, מוצרים שחוזרים ובקשות מתמשכות. "
+    "אל תפרט מה יש כרגע ברשימה - המצב העדכני מגיע עם כל פקודה. "
+    "החזר רק את הזיכרון עצמו."
+)
+
+_session_locks: Dict[str, threading.Lock] = {}
+_session_locks_guard = threading.Lock()
+
+
+def agent_session_id(list_id: str) -> str:
+    """The long-lived agent session of a household"""
+    return f"voice-{list_id}"
+
+
+def session_lock(session_id: str) -> threading.Lock:
+    """Serializes the runs and summaries of one session in this process, so none overwrites another's turns"""
+    with _session_locks_guard:
+        lock = _session_locks.get(session_id)
+        if lock is None:
+            lock = _session_locks[session_id] = threading.Lock()
+        return lock
+
+
+def _run_messages(run) -> list:
+    """Messages a run adds to the conversation (not the system prompt or replayed history)"""
+    return [message for message in (getattr(run, "messages", None) or [])
+            if message.role != "system" and not getattr(message, "from_history", False)]
+
+
+def run_tokens(run) -> int:
+    """Tokens a run costs when it is replayed as history, tool calls included"""
+    tokens = 0
+    for message in _run_messages(run):
+        if message.content:
+            tokens += count_tokens(str(message.content))
+        if message.tool_calls:
+            tokens += count_tokens(json.dumps(message.tool_calls, ensure_ascii=False))
+    return tokens
+
+
+def history_window(runs: list, turns: int = HISTORY_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET) -> int:
+    """How many of the newest runs are replayed: at most turns, and together within token_budget"""
+    kept = used = 0
+    for run in reversed(runs[-turns:] if turns > 0 else []):
+        used += run_tokens(run)
+        if used > token_budget:
+            break
+        kept += 1
+    return kept
+
+
+def shorten_turn(run, user_text: str):
+    """Store the user's words instead of the whole prompt of the turn (instructions and list snapshot)
+
+    The snapshot is only true for the moment it was taken; replaying it
+    would show the model a stale list next to the current one.
+    """
+    for message in _run_messages(run):
+        if message.role == "user":
+            message.content = user_text
+            return
+
+
+def turn_note(run) -> str:
+    """One line per turn for the summarizer: what was asked and what the agent answered"""
+    asked = next((str(message.content) for message in _run_messages(run)
+                  if message.role == "user" and message.content), "")
+    answered = str(getattr(run, "content", "") or "")
+    return f"משתמש: {asked} | עוזר: {answered}"[:MAX_TURN_NOTE_CHARS]
+
+
+def clip_tokens(text: str, max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS) -> str:
+    """Drop trailing words until text fits max_tokens"""
+    words = text.split()
+    while words and count_tokens(" ".join(words)) > max_tokens:
+        words.pop()
+    return " ".join(words)
+
+
+def summarize_turns(model, summary: Optional[str], notes: List[str]) -> str:
+    """Fold the notes of older turns into the session memory with one model call"""
+    from agno.models.message import Message
+
+    response = model.response(messages=[
+        Message(role="system", content=SUMMARY_INSTRUCTIONS),
+        Message(role="user", content=f"זיכרון קודם:\n{summary or 'אין'}\n\nתורות חדשות:\n" + "\n".join(notes)),
+    ])
+    content = (response.content or "").strip()
+    if not content:
+        raise ValueError("Empty summary")
+    return clip_tokens(content)
+
+
+def storage_stats(db_file: str = AGENT_STORAGE_FILE) -> dict:
+    """Size of the agent storage and the number of sessions in it"""
+    if not os.path.exists(db_file):
+        return {"file": db_file, "bytes": 0, "sessions": 0}
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        sessions = conn.execute(f"SELECT COUNT(*) FROM {AGENT_SESSIONS_TABLE}").fetchone()[0]
+    except sqlite3.OperationalError:
+        sessions = 0  # Table not created yet
+    finally:
+        conn.close()
+    return {"file": db_file, "bytes": os.path.getsize(db_file), "sessions": sessions}
+
+
+def compact_storage(db_file: str = AGENT_STORAGE_FILE, max_age_days: float = AGENT_SESSION_MAX_AGE_DAYS) -> dict:
+    """Delete sessions untouched for max_age_days and vacuum the file to give their pages back
+
+    Before sessions were per household every command created its own
+    session row; those rows are removed here once they are old enough.
+    """
+    before = storage_stats(db_file)
+    if not before["bytes"]:
+        return dict(before, deleted=0, bytes_before=0)
+
+    cutoff = int(time.time() - max_age_days * 86400)
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        try:
+            deleted = conn.execute(
+                f"DELETE FROM {AGENT_SESSIONS_TABLE} WHERE COALESCE(updated_at, created_at) < ?", (cutoff,)
+            ).rowcount
+            conn.commit()
+        except sqlite3.OperationalError:
+            deleted = 0
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    after = storage_stats(db_file)
+    AGENT_STORAGE_COMPACTIONS_TOTAL.inc()
+    logger.info(f"Agent storage compacted: {deleted} old sessions deleted, "
+                f"{before['bytes']} -> {after['bytes']} bytes")
+    return dict(after, deleted=deleted, bytes_before=before["bytes"])
+
+
+async def compact_storage_periodically(db_file: str = AGENT_STORAGE_FILE,
+                                       interval_hours: float = AGENT_STORAGE_COMPACT_INTERVAL_HOURS):
+    """Compact the agent storage at startup and every interval_hours (runs for the server's lifetime)"""
+    while interval_hours > 0:
+        try:
+            await asyncio.to_thread(compact_storage, db_file)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not compact agent storage: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=AGENT_STORAGE_FILE, help="Agent storage file")
+    parser.add_argument("--max-age-days", type=float, default=AGENT_SESSION_MAX_AGE_DAYS,
+                        help="Delete sessions not used for this many days")
+    args = parser.parse_args()
+    print(json.dumps(compact_storage(args.db, args.max_age_days), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import array
+import asyncio
+import logging
+import math
+import os
+import shutil
+import sys
+import wave
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Trim silence and reject silent clips before transcription ("off" sends uploads to STT unchanged)
+AUDIO_PREPROCESSING = os.getenv("AUDIO_PREPROCESSING", "auto")  # auto | off
+
+# Whisper resamples everything to 16 kHz mono; anything above that is wasted upload
+STT_SAMPLE_RATE = 16000
+STT_OPUS_BITRATE = os.getenv("STT_OPUS_BITRATE", "24k")
+
+# Energy voice activity detection over fixed frames of decoded PCM
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DBFS = float(os.getenv("VAD_THRESHOLD_DBFS", "-45"))  # Quietest level counted as speech
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "10"))  # Speech must also be this far above the noise floor
+MIN_SPEECH_MS = int(os.getenv("MIN_SPEECH_MS", "250"))  # Less speech than this is treated as silence
+SPEECH_PADDING_MS = 200  # Kept around the detected speech so word onsets are not clipped
+END_OF_SPEECH_MS = int(os.getenv("END_OF_SPEECH_MS", "700"))  # Silence after speech that ends a streamed command
+
+FFMPEG = shutil.which("ffmpeg")
+FFMPEG_TIMEOUT_SECONDS = 15
+
+SILENCE_DBFS = -96.0
+
+
+class PreparedAudio:
+    """Outcome of preprocessing one uploaded clip
+
+    outcome is "trimmed" (path is a new, smaller file for STT), "silent" (no
+    speech found; skip STT) or "passthrough" (path is the upload unchanged,
+    e.g. the format could not be decoded).
+    """
+
+    def __init__(self, path: str, outcome: str, original_bytes: int, output_bytes: int,
+                 duration_ms: float = 0.0, speech_ms: float = 0.0):
+        self.path = path
+        self.outcome = outcome
+        self.original_bytes = original_bytes
+        self.output_bytes = output_bytes
+        self.duration_ms = duration_ms
+        self.speech_ms = speech_ms
+
+    @property
+    def silent(self) -> bool:
+        return self.outcome == "silent"
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(0, self.original_bytes - self.output_bytes)
+
+    def to_dict(self) -> dict:
+        return {
+            "outcome": self.outcome,
+            "original_bytes": self.original_bytes,
+            "output_bytes": self.output_bytes,
+            "bytes_saved": self.bytes_saved,
+            "duration_ms": round(self.duration_ms),
+            "speech_ms": round(self.speech_ms),
+        }
+
+
+def pcm_samples(pcm: bytes) -> array.array:
+    """Signed 16-bit little-endian PCM as an array of samples"""
+    samples = array.array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def frame_levels(pcm: bytes, sample_rate: int, frame_ms: int = VAD_FRAME_MS) -> List[float]:
+    """RMS level of every frame in dBFS"""
+    samples = pcm_samples(pcm)
+    frame_size = max(1, sample_rate * frame_ms // 1000)
+    levels = []
+    for start in range(0, len(samples) - frame_size + 1, frame_size):
+        frame = samples[start:start + frame_size]
+        energy = sum(sample * sample for sample in frame) / frame_size
+        levels.append(20 * math.log10(math.sqrt(energy) / 32768) if energy else SILENCE_DBFS)
+    return levels
+
+
+def speech_threshold(levels: List[float]) -> float:
+    """Level above which a frame counts as speech, adapted to the clip's noise floor"""
+    if not levels:
+        return VAD_THRESHOLD_DBFS
+    noise_floor = sorted(levels)[len(levels) // 10]
+    return max(VAD_THRESHOLD_DBFS, noise_floor + VAD_MARGIN_DB)
+
+
+def speech_bounds(levels: List[float], frame_ms: int = VAD_FRAME_MS) -> Optional[Tuple[int, int, int]]:
+    """First and last speech frame (exclusive end) and the number of speech frames, or None if silent"""
+    threshold = speech_threshold(levels)
+    speech = [n for n, level in enumerate(levels) if level >= threshold]
+    if len(speech) * frame_ms < MIN_SPEECH_MS:
+        return None
+    return speech[0], speech[-1] + 1, len(speech)
+
+
+def read_wav_pcm(path: str) -> Optional[Tuple[bytes, int]]:
+    """Decode a 16-bit PCM WAV file to mono at (at most) STT_SAMPLE_RATE without ffmpeg"""
+    try:
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            channels, rate = wav.getnchannels(), wav.getframerate()
+            samples = pcm_samples(wav.readframes(wav.getnframes()))
+    except (wave.Error, EOFError):
+        return None
+
+    if channels > 1:
+        samples = array.array("h", (sum(samples[n:n + channels]) // channels
+                                    for n in range(0, len(samples) - channels + 1, channels)))
+    # Downsample by averaging when the rate is a whole multiple of the STT rate (48k, 32k)
+    factor = rate // STT_SAMPLE_RATE
+    if factor > 1 and rate % STT_SAMPLE_RATE == 0:
+        samples = array.array("h", (sum(samples[n:n + factor]) // factor
+                                    for n in range(0, len(samples) - factor + 1, factor)))
+        rate = STT_SAMPLE_RATE
+
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes(), rate
+
+
+def write_wav(path: str, pcm: bytes, sample_rate: int):
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+
+
+async def run_ffmpeg(args: List[str], stdin: Optional[bytes] = None) -> Optional[bytes]:
+    """Run ffmpeg and return its stdout, or None if it failed"""
+    options = ["-hide_banner", "-loglevel", "error"] + (["-nostdin"] if stdin is None else [])
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG, *options, *args,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(stdin), FFMPEG_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.warning("ffmpeg timed out")
+        return None
+    if process.returncode != 0:
+        logger.debug(f"ffmpeg failed: {stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    return stdout
+
+
+async def decode_pcm(path: str) -> Optional[Tuple[bytes, int]]:
+    """Decode an upload to mono 16-bit PCM; None if this machine cannot decode its format"""
+    with open(path, "rb") as f:
+        header = f.read(12)
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        decoded = await asyncio.to_thread(read_wav_pcm, path)
+        if decoded:
+            return decoded
+
+    if not FFMPEG:
+        return None  # WebM/Opus from MediaRecorder needs ffmpeg
+    pcm = await run_ffmpeg(["-i", path, "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "-"])
+    return (pcm, STT_SAMPLE_RATE) if pcm else None
+
+
+async def encode_for_stt(pcm: bytes, sample_rate: int, base_path: str) -> str:
+    """Write trimmed speech in the smallest format available: Opus with ffmpeg, otherwise WAV"""
+    if FFMPEG:
+        encoded = await run_ffmpeg(["-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "-",
+                                    "-c:a", "libopus", "-b:a", STT_OPUS_BITRATE, "-application", "voip",
+                                    "-f", "ogg", "-"], stdin=pcm)
+        if encoded:
+            path = f"{base_path}.stt.ogg"
+            with open(path, "wb") as f:
+                f.write(encoded)
+            return path
+
+    path = f"{base_path}.stt.wav"
+    await asyncio.to_thread(write_wav, path, pcm, sample_rate)
+    return path
+
+
+async def prepare_pcm(path: str, pcm: bytes, sample_rate: int, levels: Optional[List[float]] = None) -> PreparedAudio:
+    """Trim the decoded PCM of the upload at path to its speech, or report it silent
+
+    levels are the frame levels of pcm if already known (see EndOfSpeechDetector).
+    """
+    original_bytes = os.path.getsize(path)
+    if levels is None:
+        levels = await asyncio.to_thread(frame_levels, pcm, sample_rate)
+    duration_ms = len(levels) * VAD_FRAME_MS
+    bounds = speech_bounds(levels)
+    if bounds is None:
+        return PreparedAudio(path, "silent", original_bytes, 0, duration_ms, 0.0)
+
+    first, last, speech_frames = bounds
+    padding = SPEECH_PADDING_MS // VAD_FRAME_MS
+    bytes_per_frame = sample_rate * VAD_FRAME_MS // 1000 * 2
+    start, end = max(0, first - padding) * bytes_per_frame, min(len(levels), last + padding) * bytes_per_frame
+
+    output_path = await encode_for_stt(pcm[start:end], sample_rate, os.path.splitext(path)[0])
+    output_bytes = os.path.getsize(output_path)
+    if output_bytes >= original_bytes:
+        os.unlink(output_path)
+        return PreparedAudio(path, "passthrough", original_bytes, original_bytes,
+                             duration_ms, speech_frames * VAD_FRAME_MS)
+    return PreparedAudio(output_path, "trimmed", original_bytes, output_bytes,
+                         duration_ms, speech_frames * VAD_FRAME_MS)
+
+
+async def prepare_for_transcription(path: str, pcm: Optional[bytes] = None,
+                                    levels: Optional[List[float]] = None) -> PreparedAudio:
+    """Trim silence from an uploaded clip and detect clips without speech before STT
+
+    pcm (with its levels) can be given when the upload was already decoded
+    while it streamed in. Never fails: anything that cannot be decoded or
+    processed is passed through unchanged, so preprocessing can only save work.
+    """
+    original_bytes = os.path.getsize(path)
+    passthrough = PreparedAudio(path, "passthrough", original_bytes, original_bytes)
+    if AUDIO_PREPROCESSING == "off":
+        return passthrough
+
+    try:
+        if pcm:
+            return await prepare_pcm(path, pcm, STT_SAMPLE_RATE, levels)
+
+        decoded = await decode_pcm(path)
+        if not decoded:
+            return passthrough
+        return await prepare_pcm(path, *decoded)
+
+    except Exception as e:
+        logger.warning(f"Audio preprocessing failed, sending the upload unchanged: {e}")
+        return passthrough
+
+
+class StreamingDecoder:
+    """Decodes a MediaRecorder WebM/Opus stream to 16 kHz mono PCM as its chunks arrive
+
+    One ffmpeg process per stream reads the chunks on stdin; decoded PCM is
+    available from read() within about 100ms of the audio it belongs to.
+    """
+
+    def __init__(self):
+        self._process: Optional[asyncio.subprocess.Process] = None
+
+    @staticmethod
+    def available() -> bool:
+        return bool(FFMPEG) and AUDIO_PREPROCESSING != "off"
+
+    async def start(self):
+        self._process = await asyncio.create_subprocess_exec(
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            # Start decoding from the first cluster instead of buffering input to probe the format
+            "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0",
+            "-f", "webm", "-i", "pipe:0", "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+
+    async def write(self, chunk: bytes):
+        self._process.stdin.write(chunk)
+        await self._process.stdin.drain()
+
+    async def read(self) -> bytes:
+        """Next decoded PCM; b"" once the stream is finished"""
+        return await self._process.stdout.read(65536)
+
+    def finish(self):
+        """Signal the end of the input; read() then returns the remaining PCM"""
+        if not self._process.stdin.is_closing():
+            self._process.stdin.close()
+
+    async def close(self):
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+
+
+class EndOfSpeechDetector:
+    """Incremental energy VAD over streamed PCM that notices when the speaker has stopped"""
+
+    def __init__(self, sample_rate: int = STT_SAMPLE_RATE, end_silence_ms: int = END_OF_SPEECH_MS):
+        self.sample_rate = sample_rate
+        self.end_silence_ms = end_silence_ms
+        self.pcm = bytearray()
+        self.levels: List[float] = []
+        self._frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+        self._analyzed = 0
+
+    def feed(self, pcm: bytes) -> bool:
+        """Add decoded audio; True once speech was heard and followed by end_silence_ms of silence"""
+        self.pcm.extend(pcm)
+        complete = (len(self.pcm) - self._analyzed) // self._frame_bytes * self._frame_bytes
+        if complete:
+            frames = bytes(self.pcm[self._analyzed:self._analyzed + complete])
+            self.levels.extend(frame_levels(frames, self.sample_rate))
+            self._analyzed += complete
+        return self.speech_ended()
+
+    def speech_ended(self) -> bool:
+        bounds = speech_bounds(self.levels)
+        if bounds is None:
+            return False
+        return (len(self.levels) - bounds[1]) * VAD_FRAME_MS >= self.end_silence_ms
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.levels) * VAD_FRAME_MS
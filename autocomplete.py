@@ -0,0 +1,246 @@
+import bisect
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from list_store import CATEGORY_KEYWORDS
+from product_catalog import name_key
+
+logger = logging.getLogger(__name__)
+
+# Households whose autocomplete indexes are kept in memory
+AUTOCOMPLETE_CACHE_LISTS = int(os.getenv("AUTOCOMPLETE_CACHE_LISTS", "64"))
+
+# How often a household's purchase history is checked for new purchases (they show up in suggestions after that)
+HISTORY_RECHECK_SECONDS = float(os.getenv("AUTOCOMPLETE_HISTORY_RECHECK_SECONDS", "5"))
+
+MAX_SUGGESTIONS = 20
+
+# The product catalog fills in suggestions for prefixes at least this long
+CATALOG_MIN_PREFIX = 2
+
+# Top suggestions are kept for prefixes this short, and for longer prefixes matching more than SCAN_LIMIT keys
+TOP_PREFIX_LENGTH = 2
+SCAN_LIMIT = 256
+
+# Sorts after every character a name key can hold, closing the range of keys that start with a prefix
+KEY_END = "\U0010ffff"
+
+
+def lexicon_candidates() -> Iterable[Tuple[str, str]]:
+    """(name, category) of the keyword categorizer's words, suggested when nothing the household bought matches"""
+    for category, keywords in CATEGORY_KEYWORDS:
+        for keyword in keywords:
+            yield keyword, category
+
+
+class PrefixIndex:
+    """Names ranked by how often they were bought, found by the beginning of any of their words
+
+    A sorted array of (word-start suffix, name) keys searched with bisect:
+    "תנ" finds "חלב תנובה". Ranges of short or very common prefixes have
+    their best names kept, so no query scans more than SCAN_LIMIT keys.
+    """
+
+    def __init__(self, candidates: List[Dict]):
+        """candidates: {"name", "tag", "count", "on_list"} dicts with distinct names"""
+        self.candidates = candidates
+        entries = []
+        for i, candidate in enumerate(candidates):
+            words = name_key(candidate["name"]).split()
+            for start in range(len(words)):
+                entries.append((" ".join(words[start:]), i))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ids = [i for _, i in entries]
+
+        self._top: Dict[str, List[int]] = {}
+        groups: Dict[str, set] = {}
+        for key, i in entries:
+            for length in range(1, min(TOP_PREFIX_LENGTH, len(key)) + 1):
+                groups.setdefault(key[:length], set()).add(i)
+        for prefix, ids in groups.items():
+            self._top[prefix] = self._best(ids, MAX_SUGGESTIONS)
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def _rank(self, i: int):
+        candidate = self.candidates[i]
+        return -(candidate["count"] + candidate["on_list"]), len(candidate["name"]), candidate["name"]
+
+    def _best(self, ids: Iterable[int], limit: int) -> List[int]:
+        return heapq.nsmallest(limit, set(ids), key=self._rank)
+
+    def search(self, prefix: str, limit: int = 8) -> List[Dict]:
+        """The best names with a word starting with prefix, most bought first"""
+        key = name_key(prefix)
+        if not key:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        top = self._top.get(key)
+        if top is None:
+            lo = bisect.bisect_left(self.keys, key)
+            hi = bisect.bisect_left(self.keys, key + KEY_END, lo)
+            top = self._best(self.ids[lo:hi], MAX_SUGGESTIONS)
+            if hi - lo > SCAN_LIMIT:
+                self._top[key] = top
+        return [self.candidates[i] for i in top[:limit]]
+
+
+def merge_suggestions(*results: List[Dict], limit: int = 8) -> List[Dict]:
+    """Combine suggestions for the same name from several indexes and rank them together"""
+    merged: Dict[str, Dict] = {}
+    for suggestions in results:
+        for suggestion in suggestions:
+            key = name_key(suggestion["name"])
+            if key in merged:
+                merged[key]["count"] += suggestion["count"]
+                merged[key]["on_list"] = merged[key]["on_list"] or suggestion["on_list"]
+            else:
+                merged[key] = dict(suggestion)
+    return sorted(merged.values(),
+                  key=lambda s: (-(s["count"] + s["on_list"]), len(s["name"]), s["name"]))[:limit]
+
+
+def build_index(items: Iterable[Dict] = (), history_counts: Iterable[Tuple[str, Optional[str], int]] = (),
+                lexicon: bool = False) -> PrefixIndex:
+    """Index list items, purchase history (name, tag, purchases) and, if asked, the category lexicon"""
+    candidates: Dict[str, Dict] = {}
+
+    def add(name: str, tag: Optional[str], count: int = 0, on_list: bool = False):
+        key = name_key(name)
+        if not key:
+            return
+        candidate = candidates.get(key)
+        if candidate is None:
+            candidates[key] = {"name": name.strip(), "tag": tag or "אחר", "count": count, "on_list": on_list}
+        else:
+            candidate["count"] += count
+            candidate["on_list"] = candidate["on_list"] or on_list
+
+    for name, tag, count in history_counts:
+        add(name, tag, count)
+    for item in items:
+        add(item.get("name", ""), item.get("tag"), on_list=not item.get("completed", False))
+    if lexicon:
+        for name, tag in lexicon_candidates():
+            add(name, tag)
+    return PrefixIndex(list(candidates.values()))
+
+
+class IndexCache:
+    """Prefix indexes by key (a household), each valid for one revision, least recently used dropped first
+
+    With background, an index whose revision moved on keeps being served
+    while its replacement is built in a thread, and a key never indexed
+    gets the fallback index meanwhile; otherwise get() builds inline. The
+    revision is looked up at most every recheck_seconds per key.
+    """
+
+    def __init__(self, max_entries: int = AUTOCOMPLETE_CACHE_LISTS, background: bool = False,
+                 recheck_seconds: float = 0.0):
+        self.max_entries = max(1, max_entries)
+        self.background = background
+        self.recheck_seconds = recheck_seconds
+        # key -> (revision, index, when the revision was last looked up)
+        self._indexes: "OrderedDict[str, Tuple[object, PrefixIndex, float]]" = OrderedDict()
+        self._building: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def get(self, key: str, revision: Callable[[], object], build: Callable[[], PrefixIndex],
+            fallback: Optional[Callable[[], PrefixIndex]] = None) -> PrefixIndex:
+        """The index of key at revision(), calling build() to make it if the cached one is older"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None:
+                self._indexes.move_to_end(key)
+                if now - entry[2] < self.recheck_seconds:
+                    return entry[1]
+
+        current = revision()
+        if entry is not None and entry[0] == current:
+            with self._lock:
+                if key in self._indexes:
+                    self._indexes[key] = (current, entry[1], now)
+            return entry[1]
+
+        if not self.background or (entry is None and fallback is None):
+            return self._store(key, current, build())
+
+        with self._lock:
+            if key not in self._building:
+                self._building.add(key)
+                threading.Thread(target=self._rebuild, args=(key, current, build), daemon=True).start()
+        return entry[1] if entry is not None else fallback()
+
+    def _rebuild(self, key: str, revision, build: Callable[[], PrefixIndex]):
+        try:
+            self._store(key, revision, build())
+        except Exception as e:
+            logger.error(f"Error building autocomplete index for {key}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def _store(self, key: str, revision, index: PrefixIndex) -> PrefixIndex:
+        with self._lock:
+            self._indexes[key] = (revision, index, time.monotonic())
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
+
+
+class Autocomplete:
+    """Name suggestions for a household's add-item box
+
+    Two indexes per household: its purchase history with the category
+    lexicon, rebuilt in the background after new purchases are recorded
+    (the previous one, or the lexicon alone, answers meanwhile), and its
+    list items, rebuilt with each list version (a few hundred names at
+    most). Each query searches both and merges the results; the product
+    catalog, if given, fills in when they are too few.
+    """
+
+    def __init__(self, store, history, catalog=None, max_lists: int = AUTOCOMPLETE_CACHE_LISTS):
+        self.store = store
+        self.history = history
+        self.catalog = catalog
+        self._history_indexes = IndexCache(max_lists, background=True,
+                                           recheck_seconds=HISTORY_RECHECK_SECONDS)
+        self._item_indexes = IndexCache(max_lists)
+        self._lexicon_index: Optional[PrefixIndex] = None
+
+    def lexicon_index(self) -> PrefixIndex:
+        """The category lexicon alone, for households whose history index is still being built"""
+        if self._lexicon_index is None:
+            self._lexicon_index = build_index(lexicon=True)
+        return self._lexicon_index
+
+    def suggest(self, list_id: str, prefix: str, limit: int = 8) -> List[Dict]:
+        items = self._item_indexes.get(list_id, lambda: self.store.version(list_id),
+                                       lambda: build_index(items=self.store.load(list_id)["items"]))
+        history = self._history_indexes.get(
+            list_id, lambda: self.history.last_recorded(list_id),
+            lambda: build_index(history_counts=self.history.item_counts(list_id), lexicon=True),
+            fallback=self.lexicon_index
+        )
+        suggestions = merge_suggestions(history.search(prefix, MAX_SUGGESTIONS),
+                                        items.search(prefix, MAX_SUGGESTIONS), limit=limit)
+
+        if self.catalog is not None and len(suggestions) < limit and len(name_key(prefix)) >= CATALOG_MIN_PREFIX:
+            known = {name_key(suggestion["name"]) for suggestion in suggestions}
+            for product in self.catalog.by_prefix(prefix, limit):
+                if len(suggestions) < limit and name_key(product["name"]) not in known:
+                    suggestions.append({"name": product["name"], "tag": product["category"], "count": 0,
+                                        "on_list": False})
+        return suggestions
@@ -0,0 +1,146 @@
+"""Model calls and tokens per voice command with and without the list snapshot in the prompt
+
+Without the snapshot (LIST_CONTEXT_MODE=off) a question such as "יש חלב?"
+costs two model calls: one that calls search_items / get_shopping_stats and
+one that reads the tool's emoji-decorated answer and replies. With it
+(auto) the list is in the first prompt and the model answers at once.
+
+Offline (default) the report compares, per list size, the tokens the
+snapshot adds to the single call with the tokens of the tool results the
+second call would have to read (on top of the whole system prompt and tool
+schemas it sends again, which only --live measures):
+
+    python benchmarks/bench_agent_context.py --sizes 5 20 50 100
+
+With --live every query runs through the real agent (OpenAI key and agno
+storage needed) in both modes, and model calls and input/output tokens are
+taken from the agent's run metrics:
+
+    python benchmarks/bench_agent_context.py --live --sizes 10 40 --json context.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+from bench_storage import REPO_DIR, generate_items, git_commit
+
+sys.path.insert(0, REPO_DIR)
+
+DEFAULT_SIZES = [5, 10, 20, 40, 80, 150]
+
+# Questions answered from the list, with the tool the agent reads it through without the snapshot
+QUERIES = [
+    ("מה יש לי ברשימה", "get_shopping_stats", ()),
+    ("יש חלב?", "search_items", ("חלב",)),
+    ("כמה עגבניות צריך לקנות", "search_items", ("עגבניות",)),
+    ("מה עוד לא קנינו", "get_shopping_stats", ()),
+]
+
+
+def make_store(data_dir: str, size: int):
+    from list_store import ShoppingListStore
+    store = ShoppingListStore(base_dir=os.path.join(data_dir, "lists"), legacy_file=None)
+    list_id = f"bench-{size}"
+    store.save(list_id, {"items": generate_items(size), "last_modified": ""})
+    return store, list_id
+
+
+def offline(data_dir: str, sizes: List[int], budget: int) -> List[Dict]:
+    """Snapshot tokens against the tool results a second model call would read"""
+    from prompt_tokens import count_tokens
+    from shopping_tool import AGENT_TOOL_OUTPUT, ShoppingListToolkit
+
+    results = []
+    for size in sizes:
+        store, list_id = make_store(data_dir, size)
+        toolkit = ShoppingListToolkit(list_id=list_id, store=store, output_format=AGENT_TOOL_OUTPUT)
+        snapshot = toolkit.get_list_snapshot(10 ** 9)
+        snapshot_tokens = count_tokens(snapshot)
+        fits = snapshot_tokens <= budget
+        for query, tool, arguments in QUERIES:
+            tool_tokens = count_tokens(getattr(toolkit, tool)(*arguments))
+            results.append({
+                "size": size,
+                "query": query,
+                "snapshot_tokens": snapshot_tokens,
+                "in_budget": fits,
+                "tool": tool,
+                "tool_result_tokens": tool_tokens,
+                "model_calls_before": 2,
+                "model_calls_after": 1 if fits else 2,
+            })
+        print(f"size={size:>4}  snapshot {snapshot_tokens:>5} tokens ({'in' if fits else 'over'} budget {budget})  "
+              f"tool results {', '.join(str(r['tool_result_tokens']) for r in results[-len(QUERIES):])} tokens  "
+              f"calls 2 -> {results[-1]['model_calls_after']}")
+    return results
+
+
+def live(data_dir: str, sizes: List[int]) -> List[Dict]:
+    """Run every query through the agent with the snapshot off and on"""
+    from shopping_agent import SmartShoppingAgent
+
+    results = []
+    for size in sizes:
+        store, list_id = make_store(data_dir, size)
+        for query, _, _ in QUERIES:
+            for mode in ("off", "auto"):
+                # Fresh session storage, so chat history does not carry earlier answers
+                agent = SmartShoppingAgent(list_id=list_id, store=store,
+                                           storage_file=os.path.join(data_dir, f"agent-{size}-{mode}-{len(results)}.db"))
+                reply = agent.process_voice_command(query, list_context=mode)
+                stats = dict(agent.last_run_stats, size=size, query=query, mode=mode, reply=reply)
+                results.append(stats)
+                print(f"size={size:>4}  {mode:<4} calls={stats.get('model_calls', 0)}  "
+                      f"input={stats.get('input_tokens', 0):>6}  output={stats.get('output_tokens', 0):>4}  "
+                      f"{stats['list_context']:<8} {query} -> {reply}", flush=True)
+
+    for mode in ("off", "auto"):
+        runs = [r for r in results if r["mode"] == mode]
+        if runs:
+            print(f"{mode:<4} mean calls {statistics.fmean(r['model_calls'] for r in runs):.2f}  "
+                  f"mean tokens {statistics.fmean(r['input_tokens'] + r['output_tokens'] for r in runs):.0f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="List sizes to generate")
+    parser.add_argument("--live", action="store_true", help="Run the queries through the real agent")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-agent-context-")
+    logging.disable(logging.INFO)
+
+    from prompt_tokens import tokenizer_name
+    from shopping_tool import LIST_CONTEXT_TOKEN_BUDGET
+
+    results = live(data_dir, args.sizes) if args.live else offline(data_dir, args.sizes, LIST_CONTEXT_TOKEN_BUDGET)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "live" if args.live else "offline",
+            "tokenizer": tokenizer_name(),
+            "token_budget": LIST_CONTEXT_TOKEN_BUDGET,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
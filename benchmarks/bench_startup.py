@@ -0,0 +1,194 @@
+"""Startup time of the server: module import, first /health answer and TLS material
+
+Measures, each in fresh processes so nothing is cached in memory:
+
+    import          python -c "import server"
+    first_health    spawning uvicorn until GET /health first answers 200
+    cert_cold       generating the self-signed certificate when none exists
+
+and lists the modules with the largest import cost (python -X importtime),
+so a new eager import shows up in the report:
+
+    python benchmarks/bench_startup.py --runs 10 --json before.json
+    python benchmarks/bench_startup.py --runs 10 --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from typing import Dict, List
+
+from bench_storage import git_commit
+from bench_workers import REPO_DIR
+
+
+def child_env(data_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "bench"),
+        "SHOPPING_LISTS_DIR": os.path.join(data_dir, "lists"),
+        "CHANGE_EVENTS_DB": os.path.join(data_dir, "change_events.db"),
+        "SSL_DIR": os.path.join(data_dir, "ssl_certs"),
+    })
+    return env
+
+
+def summarize(samples: List[float]) -> Dict:
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 1),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 1),
+        "min_ms": round(samples[0] * 1000, 1),
+        "max_ms": round(samples[-1] * 1000, 1),
+    }
+
+
+def time_python(code: str, env: Dict[str, str]) -> float:
+    """Wall time of a fresh interpreter running code in the repo directory"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def time_first_health(port: int, env: Dict[str, str], timeout: float = 60.0) -> float:
+    """Time from spawning uvicorn until /health first answers"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                # Poll finely; the coarse wait_for_health() interval would dominate the result
+                time.sleep(0.005)
+        raise RuntimeError(f"Server on port {port} did not become healthy")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def time_cert_generation(env: Dict[str, str]) -> float:
+    """Time generate_ssl_certificate() without an existing certificate, inside a fresh interpreter"""
+    code = ("import time, local_network; start = time.perf_counter(); "
+            "assert local_network.generate_ssl_certificate(); print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return float(result.stdout.strip())
+
+
+def import_profile(env: Dict[str, str], top: int) -> List[Dict]:
+    """Direct imports of server by cumulative import time"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=REPO_DIR, env=env,
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | package" with nested imports indented two spaces per
+        # level and listed before the module that imported them
+        fields = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 0:
+            if name == "server":
+                break
+            modules = []  # Children of an interpreter startup module such as site
+        elif depth == 1:
+            modules.append({"module": name.strip(), "cumulative_ms": round(int(fields[1]) / 1000, 1)})
+    modules.sort(key=lambda module: module["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def compare(results: Dict, baseline_file: str, threshold: float) -> int:
+    """Print the change against a previous report; return the number of regressions"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    regressions = 0
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if not old or not old["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / old["p50_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{name:<13} p50 {old['p50_ms']:>8.1f}ms -> {result['p50_ms']:>8.1f}ms  ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Previous report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Relative slowdown reported as a regression (default 15%%)")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = child_env(data_dir)
+
+    samples = {"import": [], "first_health": [], "cert_cold": []}
+    for run in range(args.runs):
+        samples["import"].append(time_python("import server", env))
+        samples["first_health"].append(time_first_health(args.port, env))
+
+        # A fresh directory each run so the certificate is really generated
+        cert_env = dict(env, SSL_DIR=os.path.join(data_dir, f"ssl_certs-{run}"))
+        samples["cert_cold"].append(time_cert_generation(cert_env))
+
+    results = {name: summarize(values) for name, values in samples.items()}
+    imports = import_profile(env, args.top)
+
+    for name, result in results.items():
+        print(f"{name:<13} p50={result['p50_ms']:>8.1f}ms  mean={result['mean_ms']:>8.1f}ms  "
+              f"min={result['min_ms']:>8.1f}ms  max={result['max_ms']:>8.1f}ms  ({result['runs']} runs)")
+    print("\nSlowest imports of server.py (cumulative):")
+    for module in imports:
+        print(f"  {module['module']:<24} {module['cumulative_ms']:>8.1f}ms")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runs": args.runs,
+        },
+        "results": results,
+        "imports": imports,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
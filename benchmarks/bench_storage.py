@@ -0,0 +1,268 @@
+"""Micro-benchmarks for list storage, toolkit operations and categorization
+
+Generates synthetic Hebrew shopping lists of several sizes and measures the
+latency of the operations every request or agent tool call is built from:
+
+    load_cold       load_shopping_list() reading the shard from disk
+    load_warm       load_shopping_list() served from the resident copy
+    save            save_shopping_list() of the whole list
+    add             ShoppingListToolkit.add_item_with_smart_category()
+    toggle          /api/toggle-item sequence: lock, load, flip, save
+    remove          ShoppingListToolkit.remove_item_by_name()
+    search          ShoppingListToolkit.search_items()
+    stats           ShoppingListToolkit.get_shopping_stats()
+    categorize      categorize_item_simple() per item name
+
+The report is JSON so runs on two commits can be compared:
+
+    python benchmarks/bench_storage.py --sizes 10 1000 100000 --json before.json
+    git checkout my-branch
+    python benchmarks/bench_storage.py --sizes 10 1000 100000 --json after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+OPERATIONS = ["load_cold", "load_warm", "save", "add", "toggle", "remove", "search", "stats", "categorize"]
+
+# Synthetic product vocabulary: (product, category) pairs plus descriptors to make names unique
+PRODUCTS = [
+    ("חלב", "חלב ומוצרי חלב"), ("גבינה צהובה", "חלב ומוצרי חלב"), ("יוגורט", "חלב ומוצרי חלב"),
+    ("קוטג'", "חלב ומוצרי חלב"), ("חמאה", "חלב ומוצרי חלב"), ("שמנת מתוקה", "חלב ומוצרי חלב"),
+    ("חזה עוף", "בשר ודגים"), ("בשר טחון", "בשר ודגים"), ("סלמון", "בשר ודגים"), ("טונה", "בשר ודגים"),
+    ("עגבניות", "ירקות"), ("מלפפונים", "ירקות"), ("חסה", "ירקות"), ("גזר", "ירקות"), ("בצל", "ירקות"),
+    ("פלפל אדום", "ירקות"), ("ברוקולי", "ירקות"), ("בננות", "פירות"), ("תפוחים", "פירות"),
+    ("תפוזים", "פירות"), ("ענבים", "פירות"), ("אבטיח", "פירות"), ("מנגו", "פירות"),
+    ("לחם", "לחם ומאפים"), ("פיתות", "לחם ומאפים"), ("חלה", "לחם ומאפים"), ("בגט", "לחם ומאפים"),
+    ("מים מינרליים", "משקאות"), ("מיץ תפוזים", "משקאות"), ("קפה", "משקאות"), ("תה ירוק", "משקאות"),
+    ("במבה", "חטיפים וממתקים"), ("שוקולד", "חטיפים וממתקים"), ("ביסלי", "חטיפים וממתקים"),
+    ("נייר טואלט", "מוצרי בית"), ("סבון כלים", "מוצרי בית"), ("אקונומיקה", "מוצרי בית"),
+    ("אפונה קפואה", "קפואים"), ("פיצה קפואה", "קפואים"), ("מלח", "תבלינים ורטבים"),
+    ("קטשופ", "תבלינים ורטבים"), ("מיונז", "תבלינים ורטבים"), ("אורז", "דגנים וקטניות"),
+    ("עדשים", "דגנים וקטניות"), ("פסטה", "דגנים וקטניות"), ("חומוס", "דגנים וקטניות"),
+]
+DESCRIPTORS = ["", "אורגני", "דל שומן", "מארז", "גדול", "קטן", "טרי", "של תנובה", "של שטראוס", "ללא גלוטן"]
+
+
+def generate_items(size: int, seed: int = 42) -> List[Dict]:
+    """Generate a deterministic synthetic Hebrew list with unique item names"""
+    rng = random.Random(seed)
+    items = []
+    used = set()
+    for n in range(size):
+        product, category = rng.choice(PRODUCTS)
+        name = f"{product} {rng.choice(DESCRIPTORS)}".strip()
+        if name in used:
+            name = f"{name} {n}"
+        used.add(name)
+        items.append({
+            "id": f"item-{n}",
+            "name": name,
+            "quantity": str(rng.randint(1, 6)),
+            "completed": rng.random() < 0.3,
+            "created_at": datetime(2025, 1, 1).isoformat(),
+            "tag": category if rng.random() < 0.8 else "אחר",
+        })
+    return items
+
+
+def measure(fn: Callable[[], object], setup: Optional[Callable[[], None]] = None,
+            min_time: float = 1.0, min_iterations: int = 3, max_iterations: int = 1000) -> Dict:
+    """Time fn until min_time has passed (and at least min_iterations ran); setup is not timed"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_iterations:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if len(samples) >= min_iterations and time.perf_counter() - started >= min_time:
+            break
+
+    samples.sort()
+    mean = statistics.fmean(samples)
+    return {
+        "iterations": len(samples),
+        "mean_ms": round(mean * 1000, 4),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        "min_ms": round(samples[0] * 1000, 4),
+        "ops_per_sec": round(1 / mean, 1) if mean else None,
+    }
+
+
+def bench_size(server, size: int, operations: List[str], min_time: float) -> List[Dict]:
+    """Run every selected operation against one list of the given size"""
+    from shopping_tool import ShoppingListToolkit
+
+    store = server.list_store
+    list_id = f"bench-{size}"
+    base_items = generate_items(size)
+    names = [item["name"] for item in base_items]
+    rng = random.Random(size)
+
+    def reseed():
+        store.save(list_id, {"items": [dict(item) for item in base_items], "last_modified": ""})
+
+    reseed()
+    toolkit = ShoppingListToolkit(list_id=list_id, store=store)
+    shard_bytes = os.path.getsize(store.shard_path(list_id))
+
+    # Names still on the list for remove(); refilled by reseeding when used up
+    removable: List[str] = []
+
+    def next_removable():
+        if not removable:
+            reseed()
+            removable.extend(rng.sample(names, len(names)))
+        return removable.pop()
+
+    def toggle():
+        with store.lock(list_id):
+            data = server.load_shopping_list(list_id)
+            item = server.find_item(data, rng.choice(base_items)["id"])
+            item["completed"] = not item["completed"]
+            server.save_shopping_list(data, list_id)
+
+    added = [0]
+
+    def add():
+        added[0] += 1
+        return toolkit.add_item_with_smart_category(f"מוצר חדש {added[0]}", "1", "אחר")
+
+    pending_remove = [None]
+
+    def remove_setup():
+        pending_remove[0] = next_removable()
+
+    loaded = [None]
+
+    def save_setup():
+        loaded[0] = server.load_shopping_list(list_id)
+
+    cases = {
+        "load_cold": (lambda: server.load_shopping_list(list_id), lambda: store.evict(list_id)),
+        "load_warm": (lambda: server.load_shopping_list(list_id), None),
+        "save": (lambda: server.save_shopping_list(loaded[0], list_id), save_setup),
+        "add": (add, None),
+        "toggle": (toggle, None),
+        "remove": (lambda: toolkit.remove_item_by_name(pending_remove[0]), remove_setup),
+        "search": (lambda: toolkit.search_items(rng.choice(PRODUCTS)[0]), None),
+        "stats": (toolkit.get_shopping_stats, None),
+        "categorize": (lambda: [server.categorize_item_simple(name) for name in names], None),
+    }
+
+    results = []
+    for operation in operations:
+        # Every operation starts from the same generated list
+        reseed()
+        removable.clear()
+        fn, setup = cases[operation]
+        result = measure(fn, setup, min_time=min_time)
+
+        if operation == "categorize":
+            # Report categorization per item name rather than per list
+            result["per_item_us"] = round(result["mean_ms"] * 1000 / max(1, size), 3)
+            result["items_per_sec"] = round(size * result["ops_per_sec"], 1) if result["ops_per_sec"] else None
+
+        results.append({"operation": operation, "size": size, "shard_bytes": shard_bytes, **result})
+        print(f"{operation:<11} size={size:>7}  mean={result['mean_ms']:>10.3f}ms  p95={result['p95_ms']:>10.3f}ms  "
+              f"{result['ops_per_sec']:>10} ops/s  ({result['iterations']} runs)", flush=True)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results: List[Dict], baseline_file: str, threshold: float) -> int:
+    """Print the change against a previous report; return the number of regressions"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    before = {(r["operation"], r["size"]): r for r in baseline["results"]}
+
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    regressions = 0
+    for result in results:
+        old = before.get((result["operation"], result["size"]))
+        if not old or not old["p50_ms"]:
+            continue
+        # Medians are less sensitive to the occasional GC pause or fsync stall than means
+        ratio = result["p50_ms"] / old["p50_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{result['operation']:<11} size={result['size']:>7}  p50 {old['p50_ms']:>10.3f}ms -> "
+              f"{result['p50_ms']:>10.3f}ms  ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="List sizes to generate")
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to spend on each operation and size")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Previous report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Relative slowdown reported as a regression (default 15%%)")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-storage-")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["SHOPPING_LISTS_DIR"] = os.path.join(data_dir, "lists")
+    os.environ["CHANGE_EVENTS_DB"] = os.path.join(data_dir, "change_events.db")
+    import server
+
+    # Per-save INFO lines would dominate the smaller timings
+    logging.disable(logging.INFO)
+
+    results = []
+    for size in args.sizes:
+        results.extend(bench_size(server, size, args.operations, args.min_time))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
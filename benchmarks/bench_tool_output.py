@@ -0,0 +1,91 @@
+"""Tokens of the list-reading tools' answers in the human and the compact output format
+
+Every tool answer the agent reads is sent to the model again on the next
+round-trip, so its size is paid in prompt tokens and latency. For each list
+size, the report counts tokens (tiktoken's o200k_base when installed,
+otherwise an estimate) and characters of both formats:
+
+    python benchmarks/bench_tool_output.py --sizes 100
+    python benchmarks/bench_tool_output.py --sizes 10 100 1000 --json tool_output.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+from bench_storage import generate_items, git_commit
+
+# Tool calls the agent makes to read the list
+CALLS = [
+    ("get_shopping_list", ()),
+    ("get_items_by_category", ("ירקות",)),
+    ("search_items", ("חלב",)),
+    ("get_shopping_stats", ()),
+    ("get_category_statistics", ()),
+]
+
+
+def bench_size(data_dir: str, size: int) -> List[Dict]:
+    from list_store import ShoppingListStore
+    from prompt_tokens import count_tokens
+    from shopping_tool import ShoppingListToolkit
+
+    store = ShoppingListStore(base_dir=os.path.join(data_dir, "lists"), legacy_file=None)
+    list_id = f"bench-{size}"
+    store.save(list_id, {"items": generate_items(size), "last_modified": ""})
+    toolkits = {output_format: ShoppingListToolkit(list_id=list_id, store=store, output_format=output_format)
+                for output_format in ("human", "compact")}
+
+    results = []
+    for tool, arguments in CALLS:
+        answers = {output_format: getattr(toolkit, tool)(*arguments) for output_format, toolkit in toolkits.items()}
+        result = {"size": size, "tool": tool}
+        for output_format, answer in answers.items():
+            result[f"{output_format}_tokens"] = count_tokens(answer)
+            result[f"{output_format}_chars"] = len(answer)
+        result["ratio"] = round(result["compact_tokens"] / result["human_tokens"], 3)
+        results.append(result)
+        print(f"size={size:>6}  {tool:<24} human {result['human_tokens']:>6} tokens  "
+              f"compact {result['compact_tokens']:>6} tokens  ({result['ratio']:.2f}x)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100], help="List sizes to generate")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bench-tool-output-")
+    logging.disable(logging.INFO)
+
+    from prompt_tokens import tokenizer_name
+    from shopping_tool import COMPACT_MAX_ITEMS
+
+    results = []
+    for size in args.sizes:
+        results.extend(bench_size(data_dir, size))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tokenizer": tokenizer_name(),
+            "compact_max_items": COMPACT_MAX_ITEMS,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
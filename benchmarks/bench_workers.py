@@ -0,0 +1,152 @@
+"""Polling throughput of the server with 1 vs N uvicorn workers
+
+Starts the server over plain HTTP once per worker count, seeds a list and
+then has many simulated fridges poll GET /api/shopping-list as fast as they
+can. Client load is generated from several processes so the benchmark
+itself is not limited by one core.
+
+    python benchmarks/bench_workers.py --workers 1 4 --items 200 --duration 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIST_ID = "bench"
+
+
+def wait_for_health(port: int, timeout: float = 30.0):
+    """Block until the server answers /health"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not become healthy")
+
+
+def seed_list(port: int, items: int):
+    """Fill the benchmark list with items"""
+    for n in range(items):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/api/add-item?list_id={LIST_ID}",
+            data=json.dumps({"name": f"פריט {n}", "quantity": "1"}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        urllib.request.urlopen(request).close()
+
+
+def poll_worker(args):
+    """Client process: poll with keep-alive connections from several threads"""
+    port, threads, duration = args
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def run():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        local = []
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", f"/api/shopping-list?list_id={LIST_ID}")
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise RuntimeError(response.status)
+                local.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies, errors[0]
+
+
+def bench(workers: int, port: int, items: int, duration: float, clients: int, threads: int) -> dict:
+    """Run one server configuration and measure polling throughput"""
+    data_dir = tempfile.mkdtemp(prefix="bench-workers-")
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "bench"),
+        "SHOPPING_LISTS_DIR": os.path.join(data_dir, "lists"),
+        "CHANGE_EVENTS_DB": os.path.join(data_dir, "change_events.db"),
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_DIR, env=env
+    )
+    try:
+        wait_for_health(port)
+        seed_list(port, items)
+
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(poll_worker, [(port, threads, duration)] * clients)
+
+        latencies = sorted(latency for result in results for latency in result[0])
+        errors = sum(result[1] for result in results)
+        return {
+            "workers": workers,
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 2])
+    parser.add_argument("--items", type=int, default=100, help="Items on the polled list")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of polling per configuration")
+    parser.add_argument("--clients", type=int, default=max(2, (os.cpu_count() or 2) // 2),
+                        help="Client processes")
+    parser.add_argument("--threads", type=int, default=16, help="Polling threads per client process")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        result = bench(workers, args.port, args.items, args.duration, args.clients, args.threads)
+        results.append(result)
+        print(f"workers={result['workers']:>2}  {result['throughput_rps']:>8} req/s  "
+              f"p50={result['p50_ms']}ms  p99={result['p99_ms']}ms  errors={result['errors']}")
+
+    if len(results) > 1 and results[0]["throughput_rps"]:
+        print(f"speedup {results[-1]['workers']} vs {results[0]['workers']} workers: "
+              f"{results[-1]['throughput_rps'] / results[0]['throughput_rps']:.2f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
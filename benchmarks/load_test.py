@@ -0,0 +1,299 @@
+"""Offline load test of the fridge traffic mix: list polling plus voice commands
+
+Simulates N fridges that each poll GET /api/shopping-list every 2 seconds
+while voice commands arrive at a given total rate (Poisson arrivals). By
+default a local server is started with the stub STT, agent and TTS backends
+(see voice_backends.py), so no OpenAI or edge-tts calls are made:
+
+    python benchmarks/load_test.py --fridges 200 --voice-rate 2 --duration 60
+    python benchmarks/load_test.py --stt-latency 800 --agent-latency 1200 --tts-latency 500 --workers 4
+
+    # Against a running server (start it with STT_BACKEND=stub AGENT_BACKEND=stub TTS_BACKEND=stub)
+    python benchmarks/load_test.py --url https://localhost:8000 --insecure
+
+Reports throughput, latency percentiles and error rates per request type.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from bench_workers import REPO_DIR, wait_for_health
+
+VOICE_COMMANDS = [
+    "הוסף חלב",
+    "תוסיף לחם",
+    "הוסף עגבניות",
+    "תראה לי את הרשימה",
+    "הוסף בננות",
+    "מה יש ברשימה",
+    "הוסף גבינה צהובה",
+    "תוסיף מים מינרליים",
+]
+
+
+class Recorder:
+    """Thread-safe collection of request outcomes per request type"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+
+    def success(self, kind: str, latency: float):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(latency)
+
+    def failure(self, kind: str, reason: str):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f"{kind}: {reason}")
+
+    def summary(self, duration: float) -> Dict[str, Dict]:
+        summary = {}
+        for kind in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(kind, []))
+            errors = self.errors.get(kind, 0)
+            total = len(latencies) + errors
+
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) \
+                    if latencies else None
+
+            summary[kind] = {
+                "requests": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "throughput_rps": round(total / duration, 2),
+                "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "p99_ms": percentile(0.99),
+                "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+            }
+        return summary
+
+
+class Target:
+    """Where requests go, with a connection factory for keep-alive clients"""
+
+    def __init__(self, base_url: str, insecure: bool):
+        parsed = urllib.parse.urlparse(base_url)
+        self.base_url = base_url.rstrip("/")
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.context = ssl._create_unverified_context() if insecure else None
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=60, context=self.context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+
+def fridge(target: Target, list_id: str, poll_interval: float, deadline: float, recorder: Recorder,
+           rng: random.Random):
+    """One fridge: poll its household list on a fixed schedule"""
+    conn = target.connect()
+    # Fridges were switched on at different times; spread them over one interval
+    next_poll = time.monotonic() + rng.uniform(0, poll_interval)
+    while True:
+        delay = next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if time.monotonic() >= deadline:
+            break
+
+        start = time.perf_counter()
+        try:
+            conn.request("GET", f"/api/shopping-list?list_id={list_id}")
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                recorder.success("poll", time.perf_counter() - start)
+            else:
+                recorder.failure("poll", f"HTTP {response.status}")
+        except Exception as e:
+            recorder.failure("poll", repr(e))
+            conn.close()
+            conn = target.connect()
+        next_poll += poll_interval
+    conn.close()
+
+
+def voice_command(target: Target, list_id: str, command: str, recorder: Recorder):
+    """Upload one voice command; the stub transcriber reads the command text from the audio bytes"""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"voice_command.webm\"\r\n"
+        f"Content-Type: audio/webm\r\n\r\n"
+    ).encode("utf-8") + command.encode("utf-8") + f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    conn = target.connect()
+    start = time.perf_counter()
+    try:
+        conn.request("POST", f"/api/voice-command?list_id={list_id}", body=body, headers={
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Idempotency-Key": uuid.uuid4().hex,
+        })
+        response = conn.getresponse()
+        payload = response.read()
+        if response.status != 200:
+            recorder.failure("voice", f"HTTP {response.status}")
+        elif not json.loads(payload).get("success"):
+            recorder.failure("voice", json.loads(payload).get("error", "success=false"))
+        else:
+            recorder.success("voice", time.perf_counter() - start)
+    except Exception as e:
+        recorder.failure("voice", repr(e))
+    finally:
+        conn.close()
+
+
+def run_load(target: Target, fridges: int, lists: int, poll_interval: float, voice_rate: float,
+             duration: float, seed: int) -> Dict:
+    """Run the traffic mix for duration seconds and summarize it"""
+    rng = random.Random(seed)
+    recorder = Recorder()
+    list_ids = [f"load-{n}" for n in range(max(1, lists))]
+    deadline = time.monotonic() + duration
+
+    pollers = [
+        threading.Thread(target=fridge, daemon=True, args=(
+            target, list_ids[n % len(list_ids)], poll_interval, deadline, recorder, random.Random(seed + n)))
+        for n in range(fridges)
+    ]
+    for thread in pollers:
+        thread.start()
+
+    # Voice commands arrive independently of how fast earlier ones finish
+    with ThreadPoolExecutor(max_workers=256) as pool:
+        next_command = time.monotonic()
+        while voice_rate > 0:
+            next_command += rng.expovariate(voice_rate)
+            delay = next_command - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if time.monotonic() >= deadline:
+                break
+            pool.submit(voice_command, target, rng.choice(list_ids), rng.choice(VOICE_COMMANDS), recorder)
+
+        for thread in pollers:
+            thread.join()
+
+    return {"summary": recorder.summary(duration), "error_samples": recorder.error_samples}
+
+
+def voice_stage_means(target: Target) -> Dict[str, float]:
+    """Read the mean duration of each voice-command stage from the server's /metrics"""
+    try:
+        with urllib.request.urlopen(f"{target.base_url}/metrics", context=target.context, timeout=10) as response:
+            text = response.read().decode("utf-8")
+    except Exception:
+        return {}
+
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if not line.startswith("voice_stage_duration_seconds_") or 'endpoint="voice-command"' not in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        if name.startswith("voice_stage_duration_seconds_sum"):
+            sums[stage] = float(value)
+        elif name.startswith("voice_stage_duration_seconds_count"):
+            counts[stage] = float(value)
+    return {stage: round(sums[stage] / counts[stage] * 1000, 1) for stage in sums if counts.get(stage)}
+
+
+def start_server(args) -> Tuple[subprocess.Popen, str]:
+    """Start a local server with the stub backends"""
+    data_dir = tempfile.mkdtemp(prefix="load-test-")
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "load-test"),
+        "SHOPPING_LISTS_DIR": os.path.join(data_dir, "lists"),
+        "CHANGE_EVENTS_DB": os.path.join(data_dir, "change_events.db"),
+        "STT_BACKEND": "stub",
+        "AGENT_BACKEND": "stub",
+        "TTS_BACKEND": "stub",
+        "STUB_STT_LATENCY_MS": str(args.stt_latency),
+        "STUB_AGENT_LATENCY_MS": str(args.agent_latency),
+        "STUB_TTS_LATENCY_MS": str(args.tts_latency),
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_DIR, env=env
+    )
+    wait_for_health(args.port)
+    return server, f"http://127.0.0.1:{args.port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fridges", type=int, default=50, help="Simulated fridges polling their list")
+    parser.add_argument("--lists", type=int, default=0, help="Household lists shared by the fridges (default: one each)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between polls of one fridge")
+    parser.add_argument("--voice-rate", type=float, default=1.0, help="Voice commands per second, all fridges together")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="Load an already running server instead of starting one")
+    parser.add_argument("--insecure", action="store_true", help="Accept the self-signed certificate")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started server")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--stt-latency", type=float, default=400, help="Stub transcription latency (ms)")
+    parser.add_argument("--agent-latency", type=float, default=600, help="Stub agent latency (ms)")
+    parser.add_argument("--tts-latency", type=float, default=300, help="Stub TTS latency (ms)")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    server: Optional[subprocess.Popen] = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_server(args)
+
+    try:
+        target = Target(base_url, args.insecure)
+        result = run_load(target, args.fridges, args.lists or args.fridges, args.poll_interval,
+                          args.voice_rate, args.duration, args.seed)
+        result["voice_stage_mean_ms"] = voice_stage_means(target)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    result["config"] = {key: value for key, value in vars(args).items() if key != "json"}
+    print(f"{args.fridges} fridges polling every {args.poll_interval}s, {args.voice_rate} voice commands/s, "
+          f"{args.duration}s:")
+    for kind, stats in result["summary"].items():
+        print(f"  {kind:<6} {stats['requests']:>6} requests  {stats['throughput_rps']:>7} req/s  "
+              f"p50={stats['p50_ms']}ms  p95={stats['p95_ms']}ms  p99={stats['p99_ms']}ms  max={stats['max_ms']}ms  "
+              f"errors={stats['errors']} ({stats['error_rate']:.2%})")
+    if result["voice_stage_mean_ms"]:
+        print("  voice stages (mean ms): " + ", ".join(
+            f"{stage}={value}" for stage, value in sorted(result["voice_stage_mean_ms"].items())))
+    for sample in result["error_samples"]:
+        print(f"  error: {sample}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Stress test for concurrent shopping list mutations
+
+Fires thousands of concurrent mutations at one list and verifies that none
+of them is lost. Three targets are supported:
+
+    # Store and agent toolkit from many threads (default)
+    python benchmarks/stress_concurrency.py --mutations 5000 --threads 64
+
+    # FastAPI app in-process, including If-Match conflicts and retries
+    python benchmarks/stress_concurrency.py --target app --mutations 3000
+
+    # A running server (any number of uvicorn workers)
+    python benchmarks/stress_concurrency.py --target url --url https://localhost:8000 --insecure
+
+Exits with status 1 if any update was lost.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTER_ITEM = "מונה"
+
+
+def report(name: str, expected: dict, actual: dict, elapsed: float, mutations: int) -> bool:
+    """Print a result line and return whether every update survived"""
+    ok = expected == actual
+    status = "OK" if ok else "LOST UPDATES"
+    print(f"[{name}] {status}: {mutations} mutations in {elapsed:.2f}s "
+          f"({mutations / elapsed:.0f}/s) expected={expected} actual={actual}")
+    return ok
+
+
+def stress_store(mutations: int, threads: int) -> bool:
+    """Mix locked, optimistic and toolkit writers on one list"""
+    from list_store import ShoppingListStore, VersionConflictError
+
+    store = ShoppingListStore(base_dir=tempfile.mkdtemp(prefix="stress-lists-"), legacy_file=None)
+    list_id = "stress"
+
+    try:
+        from shopping_tool import ShoppingListToolkit
+        toolkit = ShoppingListToolkit(list_id=list_id, store=store)
+    except ImportError:
+        toolkit = None
+        print("agno not installed - skipping toolkit writers")
+
+    data = store.load(list_id)
+    data["items"].append({"id": "counter", "name": COUNTER_ITEM, "quantity": "0", "completed": False,
+                          "created_at": "", "tag": "אחר"})
+    store.save(list_id, data)
+
+    counts = {"adds": 0, "increments": 0, "conflicts": 0}
+    counts_lock = threading.Lock()
+
+    def locked_add(n):
+        # Same sequence as the REST endpoints: load, modify and save under the list lock
+        with store.lock(list_id):
+            data = store.load(list_id)
+            data["items"].append({"id": str(uuid.uuid4()), "name": f"פריט {n}", "quantity": "1",
+                                  "completed": False, "created_at": "", "tag": "אחר"})
+            assert store.save(list_id, data)
+        return "adds"
+
+    def optimistic_increment(n):
+        # No lock held while modifying: retry on version conflicts
+        while True:
+            data = store.load(list_id)
+            counter = next(item for item in data["items"] if item["id"] == "counter")
+            counter["quantity"] = str(int(counter["quantity"]) + 1)
+            try:
+                assert store.save(list_id, data, expected_version=data["version"])
+                return "increments"
+            except VersionConflictError:
+                with counts_lock:
+                    counts["conflicts"] += 1
+
+    def toolkit_add(n):
+        result = toolkit.add_item_with_smart_category(f"מוצר {n}", "1", "אחר")
+        assert "✅" in result, result
+        return "adds"
+
+    writers = [locked_add, optimistic_increment]
+    if toolkit:
+        writers.append(toolkit_add)
+
+    def run(n):
+        kind = writers[n % len(writers)](n)
+        with counts_lock:
+            counts[kind] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, range(mutations)))
+    elapsed = time.perf_counter() - start
+
+    final = store.load(list_id)
+    counter = next(item for item in final["items"] if item["id"] == "counter")
+    expected = {"items": counts["adds"] + 1, "counter": counts["increments"], "version": mutations + 1}
+    actual = {"items": len(final["items"]), "counter": int(counter["quantity"]), "version": final["version"]}
+    print(f"[store] optimistic retries after version conflicts: {counts['conflicts']}")
+    return report("store", expected, actual, elapsed, mutations)
+
+
+def stress_app(mutations: int, concurrency: int) -> bool:
+    """Drive the FastAPI app in-process with concurrent adds and If-Match toggles"""
+    os.environ.setdefault("OPENAI_API_KEY", "stress-test")
+    os.environ["SHOPPING_LISTS_DIR"] = tempfile.mkdtemp(prefix="stress-app-lists-")
+    import httpx
+    import server
+
+    list_id = f"stress-{uuid.uuid4().hex[:8]}"
+    counts = {"adds": 0, "toggles": 0, "conflicts": 0}
+
+    async def main():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            seed = await client.post(f"/api/add-item?list_id={list_id}", json={"name": COUNTER_ITEM})
+            seed_id = seed.json()["item"]["id"]
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def add(n):
+                response = await client.post(f"/api/add-item?list_id={list_id}", json={"name": f"פריט {n}"})
+                assert response.status_code == 200, response.text
+                counts["adds"] += 1
+
+            async def toggle(n):
+                # Toggle based on the version we read; retry when another request won
+                while True:
+                    current = await client.get(f"/api/shopping-list?list_id={list_id}")
+                    response = await client.post(
+                        f"/api/toggle-item?list_id={list_id}", json={"item_id": seed_id},
+                        headers={"If-Match": current.headers["ETag"]}
+                    )
+                    if response.status_code == 409:
+                        counts["conflicts"] += 1
+                        continue
+                    assert response.status_code == 200, response.text
+                    counts["toggles"] += 1
+                    return
+
+            async def run(n):
+                async with semaphore:
+                    await (toggle(n) if n % 20 == 0 else add(n))
+
+            await asyncio.gather(*(run(n) for n in range(mutations)))
+            final = (await client.get(f"/api/shopping-list?list_id={list_id}")).json()
+            return final
+
+    start = time.perf_counter()
+    final = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+
+    counter = next(item for item in final["items"] if item["name"] == COUNTER_ITEM)
+    expected = {"items": counts["adds"] + 1, "completed": counts["toggles"] % 2 == 1,
+                "version": counts["adds"] + counts["toggles"] + 1}
+    actual = {"items": len(final["items"]), "completed": counter["completed"], "version": final["version"]}
+    print(f"[app] toggles retried after 409 Conflict: {counts['conflicts']}")
+    return report("app", expected, actual, elapsed, mutations)
+
+
+def stress_url(base_url: str, mutations: int, threads: int, insecure: bool) -> bool:
+    """Add uniquely named items to a running server and verify they all arrive"""
+    context = ssl._create_unverified_context() if insecure else None
+    list_id = f"stress-{uuid.uuid4().hex[:8]}"
+    names = [f"פריט {n} {random.random()}" for n in range(mutations)]
+
+    def add(name):
+        request = urllib.request.Request(
+            f"{base_url}/api/add-item?list_id={list_id}",
+            data=json.dumps({"name": name}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, context=context, timeout=30) as response:
+            assert response.status == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(add, names))
+    elapsed = time.perf_counter() - start
+
+    with urllib.request.urlopen(f"{base_url}/api/shopping-list?list_id={list_id}", context=context) as response:
+        final = json.loads(response.read())
+    stored = sorted(item["name"] for item in final["items"])
+    expected = {"items": len(names), "version": len(names)}
+    actual = {"items": len(stored), "version": final.get("version")}
+    return report("url", expected, actual, elapsed, mutations) and stored == sorted(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["store", "app", "url"], default="store")
+    parser.add_argument("--mutations", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=64, help="Concurrent writers")
+    parser.add_argument("--url", default="https://localhost:8000")
+    parser.add_argument("--insecure", action="store_true", help="Accept the self-signed certificate")
+    args = parser.parse_args()
+
+    if args.target == "store":
+        ok = stress_store(args.mutations, args.threads)
+    elif args.target == "app":
+        ok = stress_app(args.mutations, args.threads)
+    else:
+        ok = stress_url(args.url.rstrip("/"), args.mutations, args.threads, args.insecure)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
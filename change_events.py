@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite table shared by all uvicorn workers; each worker tails it for other workers' changes
+CHANGE_EVENTS_DB = os.getenv("CHANGE_EVENTS_DB", "static2/change_events.db")
+
+# How often a worker checks the table for changes made by other workers
+EVENT_POLL_INTERVAL = float(os.getenv("CHANGE_EVENT_POLL_INTERVAL", "0.25"))
+
+# Events older than this are pruned; subscribers only need recent changes
+EVENT_RETENTION_SECONDS = int(os.getenv("CHANGE_EVENT_RETENTION_SECONDS", "3600"))
+
+
+class ChangeEventLog:
+    """Append-only SQLite table of list changes shared between worker processes"""
+
+    def __init__(self, db_file: str = CHANGE_EVENTS_DB):
+        self.db_file = db_file
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS change_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                list_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                origin_pid INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection (sqlite3 connections are not shared across threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def publish(self, list_id: str, version: int) -> int:
+        """Record that a list reached a new version"""
+        conn = self._connection()
+        cursor = conn.execute(
+            "INSERT INTO change_events (list_id, version, origin_pid, created_at) VALUES (?, ?, ?, ?)",
+            (list_id, version, os.getpid(), time.time())
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+    def latest_id(self) -> int:
+        """Get the id of the newest event"""
+        row = self._connection().execute("SELECT MAX(id) FROM change_events").fetchone()
+        return row[0] or 0
+
+    def read_after(self, last_id: int, limit: int = 1000) -> List[Tuple[int, str, int, int]]:
+        """Get (id, list_id, version, origin_pid) of the events newer than last_id"""
+        return self._connection().execute(
+            "SELECT id, list_id, version, origin_pid FROM change_events WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit)
+        ).fetchall()
+
+    def prune(self, max_age_seconds: int = EVENT_RETENTION_SECONDS) -> int:
+        """Delete events older than max_age_seconds"""
+        conn = self._connection()
+        cursor = conn.execute("DELETE FROM change_events WHERE created_at < ?", (time.time() - max_age_seconds,))
+        conn.commit()
+        return cursor.rowcount
+
+
+class ChangeNotifier:
+    """Fans list changes out to local push subscribers and to the other workers
+
+    Local saves are published to the shared event log and delivered to this
+    worker's subscribers immediately; a background task tails the log for
+    changes made by other workers, drops their stale resident copies and
+    delivers those changes too.
+    """
+
+    def __init__(self, store, event_log: ChangeEventLog):
+        self.store = store
+        self.event_log = event_log
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._delivered_versions: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_event_id = 0
+
+    def on_list_saved(self, list_id: str, version: int):
+        """Store listener: called after every local save, possibly from a worker thread"""
+        try:
+            self.event_log.publish(list_id, version)
+        except Exception as e:
+            logger.error(f"Error publishing change event for list {list_id}: {e}")
+        self._deliver_threadsafe(list_id, version)
+
+    def subscribe(self, list_id: str) -> asyncio.Queue:
+        """Get a queue receiving {"list_id", "version"} for every change of a list"""
+        queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(list_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, list_id: str, queue: asyncio.Queue):
+        """Stop delivering changes to a queue"""
+        queues = self._subscribers.get(list_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[list_id]
+                self._delivered_versions.pop(list_id, None)
+
+    def subscriber_count(self) -> int:
+        """Get the number of open push subscriptions in this worker"""
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def run(self):
+        """Tail the shared event log until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._last_event_id = await asyncio.to_thread(self.event_log.latest_id)
+        last_prune = time.monotonic()
+        pid = os.getpid()
+
+        while True:
+            try:
+                events = await asyncio.to_thread(self.event_log.read_after, self._last_event_id)
+                for event_id, list_id, version, origin_pid in events:
+                    self._last_event_id = event_id
+                    if origin_pid != pid:
+                        # Another worker wrote this list; don't serve our resident copy
+                        self.store.evict(list_id)
+                        self._deliver(list_id, version)
+
+                if time.monotonic() - last_prune > 60:
+                    await asyncio.to_thread(self.event_log.prune)
+                    last_prune = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reading change events: {e}")
+
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    def _deliver_threadsafe(self, list_id: str, version: int):
+        """Deliver a change from any thread"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._deliver(list_id, version)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, list_id, version)
+
+    def _deliver(self, list_id: str, version: int):
+        """Put a change on every subscriber queue of a list (event loop thread only)"""
+        if list_id not in self._subscribers:
+            return
+        # Local and remote changes arrive by different paths; never go back in versions
+        if version <= self._delivered_versions.get(list_id, -1):
+            return
+        self._delivered_versions[list_id] = version
+
+        event = {"list_id": list_id, "version": version}
+        for queue in list(self._subscribers.get(list_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow subscriber only needs the newest version; drop the oldest event
+                queue.get_nowait()
+                queue.put_nowait(event)
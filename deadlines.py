@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# End-to-end deadline of one voice command; a (possibly degraded) answer always arrives within it
+VOICE_DEADLINE_SECONDS = float(os.getenv("VOICE_DEADLINE_MS", "8000")) / 1000
+
+# Longest each remote stage may take, further limited by what is left of the deadline
+STAGE_BUDGETS: Dict[str, float] = {
+    "transcription": float(os.getenv("STT_BUDGET_MS", "4000")) / 1000,
+    "agent": float(os.getenv("AGENT_BUDGET_MS", "5000")) / 1000,
+    "tts": float(os.getenv("TTS_BUDGET_MS", "2500")) / 1000,
+}
+
+# Time kept back from a stage's budget for the local fallbacks and the stages after it
+FALLBACK_RESERVE_SECONDS = 0.25
+
+# Consecutive timeouts or errors of a remote dependency that open its circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+
+class StageTimeout(Exception):
+    """A voice pipeline stage ran out of its budget and was cancelled"""
+
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"{stage} exceeded its {budget * 1000:.0f}ms budget")
+        self.stage = stage
+        self.budget = budget
+
+
+class Deadline:
+    """End-to-end deadline of one voice command, handing out per-stage budgets"""
+
+    def __init__(self, seconds: float = VOICE_DEADLINE_SECONDS, start: Optional[float] = None):
+        self.start = time.monotonic() if start is None else start
+        self.expires_at = self.start + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, stage: str) -> float:
+        """Time the stage may take: its own budget, but never past the deadline (minus the fallback reserve)"""
+        return max(0.0, min(STAGE_BUDGETS.get(stage, self.remaining()),
+                            self.remaining() - FALLBACK_RESERVE_SECONDS))
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await a stage within its budget; cancel it and raise StageTimeout when the budget runs out
+
+        Work already handed to a thread (the blocking OpenAI clients) cannot
+        be interrupted; its result is discarded and the clients' own request
+        timeouts end it.
+        """
+        budget = self.budget(stage)
+        try:
+            return await asyncio.wait_for(awaitable, budget)
+        except asyncio.TimeoutError:
+            raise StageTimeout(stage, budget) from None
+
+
+class CircuitBreaker:
+    """Skips a remote dependency for a cool-down period after repeated failures
+
+    closed: calls go through. After failure_threshold consecutive failures the
+    circuit opens and allow() is False for cooldown seconds; then one trial
+    call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether to call the dependency now"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            trial_failed = self._trial_running
+            self._trial_running = False
+            if trial_failed or self.failures >= self.failure_threshold:
+                if self.opened_at is None or trial_failed:
+                    logger.warning(f"Circuit {self.name} opened for {self.cooldown:.0f}s after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """A call let through by allow() ended without an outcome (it was cancelled); allow another trial"""
+        with self._lock:
+            self._trial_running = False
+
+    def to_dict(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+import ssl
+import time
+from typing import List, Optional
+
+from metrics import TTS_CONNECTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Warm websocket connections kept open to the Edge read-aloud service; 0 opens one per reply (plain edge-tts)
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))
+
+# Connections are replaced after this age, before the service drops them, and checked this often
+TTS_CONNECTION_MAX_AGE_SECONDS = float(os.getenv("TTS_CONNECTION_MAX_AGE_SECONDS", "240"))
+TTS_KEEP_WARM_INTERVAL_SECONDS = 30
+
+TTS_CONNECT_TIMEOUT_SECONDS = 10
+TTS_TURN_TIMEOUT_SECONDS = 60
+
+# Longer texts are split by edge-tts itself; the pool only sends single-turn replies
+MAX_POOLED_TEXT_BYTES = 4096
+
+
+class PooledConnection:
+    """One websocket to the read-aloud service, used for one synthesis turn at a time"""
+
+    def __init__(self, websocket, loop: asyncio.AbstractEventLoop):
+        self.websocket = websocket
+        self.loop = loop
+        self.opened_at = time.monotonic()
+        self.turns = 0
+
+    def usable(self) -> bool:
+        return (not self.websocket.closed
+                and self.loop is asyncio.get_running_loop()
+                and time.monotonic() - self.opened_at < TTS_CONNECTION_MAX_AGE_SECONDS)
+
+    async def close(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+class EdgeTTSConnectionPool:
+    """Keeps websockets to the Edge TTS service open so a reply costs only its audio generation
+
+    edge_tts.Communicate opens a new HTTPS session and websocket (DNS, TCP,
+    TLS and the upgrade) for every text. The service accepts any number of
+    speech.config + SSML turns on one websocket, as the Edge browser sends
+    them, so the pool speaks that protocol itself (with edge-tts's SSML,
+    DRM token and header helpers) over connections it keeps warm.
+
+    A reused connection that fails (the service may drop idle connections)
+    is discarded and the text retried once on another connection.
+    """
+
+    def __init__(self, voice: str, size: int = TTS_POOL_SIZE):
+        self.voice = voice
+        self.size = size
+        self._idle: List[PooledConnection] = []
+        self._session = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self.opened = 0
+        self.reused = 0
+        self.dropped = 0
+        self.syntheses = 0
+
+    def accepts(self, text: str) -> bool:
+        return self.size > 0 and len(text.encode("utf-8")) <= MAX_POOLED_TEXT_BYTES
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.size,
+            "idle": len(self._idle),
+            "syntheses": self.syntheses,
+            "connections_opened": self.opened,
+            "connections_reused": self.reused,
+            "connections_dropped": self.dropped,
+            "reuse_ratio": round(self.reused / self.syntheses, 3) if self.syntheses else 0.0,
+        }
+
+    async def synthesize(self, text: str, audio_path: str):
+        connection = await self._acquire()
+        try:
+            audio = await asyncio.wait_for(self._speak(connection, text), TTS_TURN_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            self._drop(connection)
+            raise
+        except Exception as e:
+            self._drop(connection)
+            if not connection.turns:
+                raise
+            logger.info(f"Pooled TTS connection failed ({e}), retrying on another connection")
+            connection = await self._acquire()
+            try:
+                audio = await asyncio.wait_for(self._speak(connection, text), TTS_TURN_TIMEOUT_SECONDS)
+            except BaseException:
+                self._drop(connection)
+                raise
+
+        connection.turns += 1
+        self.syntheses += 1
+        self._release(connection)
+        with open(audio_path, "wb") as f:
+            f.write(audio)
+
+    async def keep_warm(self):
+        """Keep size fresh connections open, replacing expired ones (runs for the server's lifetime)"""
+        while self.size > 0:
+            try:
+                for connection in [connection for connection in self._idle if not connection.usable()]:
+                    self._idle.remove(connection)
+                    self._drop(connection)
+                while len(self._idle) < self.size:
+                    self._idle.append(await self._open())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not open TTS connection: {e}")
+            await asyncio.sleep(TTS_KEEP_WARM_INTERVAL_SECONDS)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _acquire(self) -> PooledConnection:
+        while self._idle:
+            connection = self._idle.pop()
+            if connection.usable():
+                self.reused += 1
+                TTS_CONNECTIONS_TOTAL.inc(event="reused")
+                return connection
+            self._drop(connection)
+        return await self._open()
+
+    def _release(self, connection: PooledConnection):
+        if connection.usable() and len(self._idle) < self.size:
+            self._idle.append(connection)
+        else:
+            self._drop(connection)
+
+    def _drop(self, connection: PooledConnection):
+        self.dropped += 1
+        TTS_CONNECTIONS_TOTAL.inc(event="dropped")
+        if connection.loop is asyncio.get_running_loop():
+            # Close in the background; a cancelled synthesis must not wait for the close handshake
+            asyncio.ensure_future(connection.close())
+
+    def _get_session(self):
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(
+                trust_env=True, timeout=aiohttp.ClientTimeout(total=None, connect=TTS_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def _open(self) -> PooledConnection:
+        import aiohttp
+        import certifi
+        from edge_tts.communicate import connect_id
+        from edge_tts.constants import SEC_MS_GEC_VERSION, WSS_HEADERS, WSS_URL
+        from edge_tts.drm import DRM
+
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+        for attempt in range(2):
+            try:
+                websocket = await self._get_session().ws_connect(
+                    f"{WSS_URL}&ConnectionId={connect_id()}"
+                    f"&Sec-MS-GEC={DRM.generate_sec_ms_gec()}"
+                    f"&Sec-MS-GEC-Version={SEC_MS_GEC_VERSION}",
+                    compress=15,
+                    headers=DRM.headers_with_muid(WSS_HEADERS),
+                    ssl=self._ssl_context,
+                )
+                break
+            except aiohttp.ClientResponseError as e:
+                # A 403 means our clock is off for the DRM token; edge-tts corrects the skew from the server date
+                if e.status != 403 or attempt:
+                    raise
+                DRM.handle_client_response_error(e)
+
+        self.opened += 1
+        TTS_CONNECTIONS_TOTAL.inc(event="opened")
+        return PooledConnection(websocket, asyncio.get_running_loop())
+
+    async def _speak(self, connection: PooledConnection, text: str) -> bytes:
+        """One synthesis turn: speech.config, the SSML, then audio messages until turn.end"""
+        import aiohttp
+        from xml.sax.saxutils import escape
+        from edge_tts.communicate import (connect_id, date_to_string, get_headers_and_data, mkssml,
+                                          remove_incompatible_characters, ssml_headers_plus_data)
+        from edge_tts.data_classes import TTSConfig
+
+        websocket = connection.websocket
+        await websocket.send_str(
+            f"X-Timestamp:{date_to_string()}\r\n"
+            "Content-Type:application/json; charset=utf-8\r\n"
+            "Path:speech.config\r\n\r\n"
+            '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+            '"sentenceBoundaryEnabled":"true","wordBoundaryEnabled":"false"'
+            "},"
+            '"outputFormat":"audio-24khz-48kbitrate-mono-mp3"'
+            "}}}}\r\n"
+        )
+        config = TTSConfig(self.voice, "+0%", "+0%", "+0Hz", "SentenceBoundary")
+        await websocket.send_str(ssml_headers_plus_data(
+            connect_id(), date_to_string(), mkssml(config, escape(remove_incompatible_characters(text)))
+        ))
+
+        audio = bytearray()
+        async for message in websocket:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                data = message.data.encode("utf-8")
+                headers, _ = get_headers_and_data(data, data.find(b"\r\n\r\n"))
+                if headers.get(b"Path") == b"turn.end":
+                    break
+            elif message.type == aiohttp.WSMsgType.BINARY:
+                header_length = int.from_bytes(message.data[:2], "big")
+                headers, data = get_headers_and_data(message.data, header_length)
+                if headers.get(b"Path") == b"audio" and headers.get(b"Content-Type") == b"audio/mpeg":
+                    audio.extend(data)
+            elif message.type == aiohttp.WSMsgType.ERROR:
+                raise ConnectionError(f"TTS websocket error: {message.data}")
+        else:
+            raise ConnectionError("TTS connection closed before the end of the turn")
+
+        if not audio:
+            raise ConnectionError("No audio received from the TTS service")
+        return bytes(audio)
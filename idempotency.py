@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# Clients send this header on requests they may retry; a retry with the same key gets the original response
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# How long a response is replayed for retries of its key
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+# Upper bound on remembered responses; the oldest are dropped first
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+
+# Responses bigger than this are not remembered (list endpoints and voice replies are a few KB)
+IDEMPOTENCY_MAX_BODY_BYTES = 256 * 1024
+
+MAX_KEY_LENGTH = 255
+
+
+class CachedResponse:
+    """Status, headers and body of a response kept for replaying to retries"""
+
+    def __init__(self, status_code: int, headers: List[Tuple[str, str]], body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.created_at = time.monotonic()
+
+
+class IdempotencyCache:
+    """Bounded TTL cache of responses keyed by idempotency key
+
+    A request that claims a key runs normally and stores its response with
+    finish(). Retries arriving while it is still running wait for it instead
+    of redoing the work, then get the stored response. If the original gives
+    up without storing one (e.g. a server error), the next waiting retry
+    claims the key and runs itself.
+
+    The cache is per worker process and must only be used from the event loop.
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Event] = {}
+        self.replays = 0
+        self.waits = 0
+
+    async def begin(self, key: Hashable) -> Optional[CachedResponse]:
+        """Get the stored response of a key, or claim the key and return None
+
+        Whoever gets None must call finish(key, ...) when done.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.replays += 1
+                return cached
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self._in_flight[key] = asyncio.Event()
+                return None
+
+            self.waits += 1
+            await in_flight.wait()
+
+    def finish(self, key: Hashable, response: Optional[CachedResponse]):
+        """Release a claimed key, storing its response for later retries unless None"""
+        if response is not None:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            self._prune()
+
+        in_flight = self._in_flight.pop(key, None)
+        if in_flight is not None:
+            in_flight.set()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Get the stored response of a key if it has not expired"""
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached.created_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        return cached
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _prune(self):
+        """Drop expired responses and the oldest ones beyond max_entries"""
+        # Entries are kept in insertion order, so expired ones are at the front
+        now = time.monotonic()
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest.created_at <= self.ttl_seconds and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
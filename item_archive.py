@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from list_store import set_item_completed
+from metrics import ITEM_ARCHIVE_MOVES_TOTAL
+from purchase_history import PurchaseHistory
+
+logger = logging.getLogger(__name__)
+
+# Cold storage of bought items moved off the lists, shared by all workers
+ITEM_ARCHIVE_DB = os.getenv("ITEM_ARCHIVE_DB", "static2/item_archive.db")
+
+# Bought items older than this leave the list for the archive; 0 keeps them on the list
+ARCHIVE_COMPLETED_AFTER_HOURS = float(os.getenv("ARCHIVE_COMPLETED_AFTER_HOURS", "48"))
+
+# How often the lists held in memory are checked for items to archive
+ARCHIVE_SWEEP_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_SWEEP_INTERVAL_SECONDS", "600"))
+
+MAX_ARCHIVE_PAGE = 200
+
+
+class ItemArchive:
+    """SQLite table of bought items moved off the shopping lists, newest first per list
+
+    Items keep their id, so archiving the same item twice (e.g. after a
+    failed list save) stores it once, and a restored item is the same item.
+    """
+
+    def __init__(self, db_file: str = ITEM_ARCHIVE_DB):
+        self.db_file = db_file
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_items (
+                list_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                tag TEXT,
+                completed_at TEXT,
+                archived_at REAL NOT NULL,
+                item TEXT NOT NULL,
+                PRIMARY KEY (list_id, item_id)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS archived_items_by_date ON archived_items (list_id, completed_at)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection (sqlite3 connections are not shared across threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, list_id: str, items: List[Dict]):
+        """Store items taken off a list"""
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO archived_items (list_id, item_id, name, tag, completed_at, archived_at, item) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(list_id, item["id"], item["name"], item.get("tag"), item.get("completed_at"), now,
+              json.dumps(item, ensure_ascii=False)) for item in items]
+        )
+        conn.commit()
+
+    def query(self, list_id: str, name: Optional[str] = None, tag: Optional[str] = None,
+              limit: int = 50, offset: int = 0) -> Tuple[int, List[Dict]]:
+        """Get (total matches, one page of items) of a list's archive, most recently bought first
+
+        Args:
+            name: Only items whose name contains this text
+            tag: Only items of this category
+        """
+        where, params = "list_id = ?", [list_id]
+        if name:
+            where += " AND name LIKE ? ESCAPE '\\'"
+            params.append("%" + name.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if tag:
+            where += " AND tag = ?"
+            params.append(tag)
+
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM archived_items WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT item FROM archived_items WHERE {where} ORDER BY completed_at DESC, item_id LIMIT ? OFFSET ?",
+            params + [max(1, min(limit, MAX_ARCHIVE_PAGE)), max(0, offset)]
+        ).fetchall()
+        return total, [json.loads(row[0]) for row in rows]
+
+    def get(self, list_id: str, item_ids: List[str]) -> List[Dict]:
+        """Get archived items by id; unknown ids are skipped"""
+        if not item_ids:
+            return []
+        placeholders = ",".join("?" * len(item_ids))
+        rows = self._connection().execute(
+            f"SELECT item FROM archived_items WHERE list_id = ? AND item_id IN ({placeholders})",
+            [list_id] + list(item_ids)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, list_id: str, item_ids: List[str]) -> int:
+        """Remove items from the archive (after they were restored to the list)"""
+        if not item_ids:
+            return 0
+        placeholders = ",".join("?" * len(item_ids))
+        conn = self._connection()
+        cursor = conn.execute(
+            f"DELETE FROM archived_items WHERE list_id = ? AND item_id IN ({placeholders})",
+            [list_id] + list(item_ids)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    def count(self, list_id: str) -> int:
+        """Number of items in a list's archive"""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM archived_items WHERE list_id = ?", (list_id,)
+        ).fetchone()[0]
+
+
+def archive_completed_items(store, archive: ItemArchive, list_id: str,
+                            max_age_hours: float = ARCHIVE_COMPLETED_AFTER_HOURS,
+                            history: Optional[PurchaseHistory] = None) -> int:
+    """Move a list's items bought more than max_age_hours ago into the archive
+
+    Bought items without a purchase time (bought before times were kept)
+    get the current time, so they are archived once they are old enough.
+    The items are archived before the list is saved without them; if the
+    save fails they are on both and the next sweep moves them again.
+    Once the list is saved, archived items are also recorded as purchases
+    in history, if given.
+
+    Returns:
+        Number of items archived
+    """
+    if max_age_hours <= 0:
+        return 0
+    cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+
+    with store.lock(list_id):
+        data = store.load(list_id)
+        stamped = 0
+        old = []
+        for item in data["items"]:
+            if not item.get("completed", False):
+                continue
+            if not item.get("completed_at"):
+                item["completed_at"] = datetime.now().isoformat()
+                stamped += 1
+            elif item["completed_at"] < cutoff:
+                old.append(item)
+        if not old and not stamped:
+            return 0
+
+        if old:
+            archive.add(list_id, old)
+            old_ids = {item["id"] for item in old}
+            data["items"] = [item for item in data["items"] if item["id"] not in old_ids]
+        if not store.save(list_id, data):
+            return 0
+
+    if old and history is not None:
+        history.record(list_id, old)
+    if old:
+        ITEM_ARCHIVE_MOVES_TOTAL.inc(len(old), direction="archived")
+        logger.info(f"Archived {len(old)} bought items of list {list_id}")
+    return len(old)
+
+
+def restore_items(store, archive: ItemArchive, list_id: str, item_ids: List[str],
+                  history: Optional[PurchaseHistory] = None) -> Tuple[List[Dict], Optional[int]]:
+    """Put archived items back on a list as not bought yet, and take them out of the archive
+
+    An item whose name is already on the list is not added again; the
+    list's item is marked not bought instead, and if it was bought, that
+    purchase is recorded in history (if given) once the list is saved.
+
+    Returns:
+        (the restored list items, the new list version), or ([], None) if no
+        id was in the archive or the list could not be saved
+    """
+    with store.lock(list_id):
+        items = archive.get(list_id, item_ids)
+        if not items:
+            return [], None
+
+        data = store.load(list_id)
+        by_name = {item["name"].lower().strip(): item for item in data["items"]}
+        restored, bought = {}, []
+        for item in items:
+            existing = by_name.get(item["name"].lower().strip())
+            if existing is None:
+                existing = by_name[item["name"].lower().strip()] = item
+                data["items"].append(item)
+            elif existing.get("completed", False):
+                bought.append(dict(existing))
+            set_item_completed(existing, False)
+            restored[existing["id"]] = existing
+
+        if not store.save(list_id, data):
+            return [], None
+        archive.delete(list_id, [item["id"] for item in items])
+
+    if bought and history is not None:
+        try:
+            history.record(list_id, bought)
+        except Exception as e:
+            logger.warning(f"Could not record purchases of list {list_id}: {e}")
+    ITEM_ARCHIVE_MOVES_TOTAL.inc(len(items), direction="restored")
+    return list(restored.values()), data["version"]
+
+
+async def archive_periodically(store, archive: ItemArchive, interval: float = ARCHIVE_SWEEP_INTERVAL_SECONDS,
+                               history: Optional[PurchaseHistory] = None):
+    """Archive old bought items of the lists in memory every interval seconds (runs for the server's lifetime)
+
+    Only resident lists are swept: they are the ones being loaded and
+    polled, and sweeping the rest would push them out of memory. A list is
+    swept within one interval of being used.
+    """
+    while ARCHIVE_COMPLETED_AFTER_HOURS > 0:
+        await asyncio.sleep(interval)
+        for list_id in store.resident_ids():
+            try:
+                await asyncio.to_thread(archive_completed_items, store, archive, list_id,
+                                        ARCHIVE_COMPLETED_AFTER_HOURS, history)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error archiving bought items of list {list_id}: {e}")
+
+
+_default_archive: Optional[ItemArchive] = None
+_default_archive_lock = threading.Lock()
+
+
+def get_default_archive() -> ItemArchive:
+    """Get the process-wide archive shared by the server and the agent toolkit"""
+    global _default_archive
+    with _default_archive_lock:
+        if _default_archive is None:
+            _default_archive = ItemArchive()
+        return _default_archive
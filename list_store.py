@@ -0,0 +1,417 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Every household/fridge gets its own list id; requests without one use the default list
+DEFAULT_LIST_ID = os.getenv("DEFAULT_LIST_ID", "family")
+
+# Each list is stored in its own shard file under LISTS_DIR
+LISTS_DIR = os.getenv("SHOPPING_LISTS_DIR", "static2/lists")
+
+# Single-file location used before lists were sharded; migrated into the default list
+LEGACY_LIST_FILE = "static2/shopping_list.json"
+
+# How many lists are kept resident in memory before the coldest ones are evicted
+MAX_RESIDENT_LISTS = int(os.getenv("MAX_RESIDENT_LISTS", "256"))
+
+LIST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Item categories (tags), shared by the agent's toolkit and the voice pipeline; "אחר" is the catch-all
+CATEGORIES = (
+    "חלב ומוצרי חלב",
+    "בשר ודגים",
+    "ירקות",
+    "פירות",
+    "לחם ומאפים",
+    "משקאות",
+    "חטיפים וממתקים",
+    "מוצרי בית",
+    "קפואים",
+    "תבלינים ורטבים",
+    "דגנים וקטניות",
+    "אחר",
+)
+
+# Keyword categorizer: the first category with a keyword inside the item name wins, so order matters
+CATEGORY_KEYWORDS = (
+    ("חלב ומוצרי חלב", ("חלב", "גבינה", "יוגורט", "קוטג", "חמאה", "שמנת", "לבנה", "מעדן")),
+    ("פירות", ("בננה", "תפוח", "תפוז", "ענב", "תות", "מלון", "אבטיח", "מנגו", "אגס", "אפרסק", "לימון", "אבוקדו")),
+    ("ירקות", ("עגבני", "מלפפון", "חסה", "גזר", "בצל", "פלפל", "ברוקולי", "שום", "קישוא", "חציל", "כרוב",
+               "פטרוזיליה", "כוסברה", "תפוא")),
+    ("לחם ומאפים", ("לחם", "פיתה", "בגט", "חלה", "עוגה", "לחמני", "קרואסון", "בורקס")),
+    ("משקאות", ("מים", "מיץ", "קולה", "בירה", "יין", "קפה", "תה", "סודה", "משקה")),
+    ("בשר ודגים", ("בשר", "עוף", "דג", "נקניק", "קציצ", "טונה", "שניצל", "פרגית", "הודו", "סלמון")),
+    ("חטיפים וממתקים", ("במבה", "ביסלי", "שוקולד", "חטיף", "עוגיות", "ממתק", "צ'יפס", "וופל", "סוכריות")),
+    ("קפואים", ("קפוא", "גלידה", "ארטיק")),
+    ("תבלינים ורטבים", ("מלח", "כמון", "פפריקה", "תבלין", "קטשופ", "מיונז", "חרדל", "רוטב", "טחינה", "שמן",
+                        "חומץ", "סוכר")),
+    ("דגנים וקטניות", ("אורז", "פסטה", "ספגטי", "קמח", "עדשים", "שעועית", "חומוס", "קוסקוס", "בורגול",
+                       "פתיתים", "שיבולת")),
+    ("מוצרי בית", ("נייר", "סבון", "שמפו", "אקונומיקה", "מרכך", "כביסה", "ספוג", "שקיות", "מגבונים",
+                   "משחת שיניים", "ניקוי", "כלים")),
+)
+
+# Identifies a shard file's content on disk: (inode, mtime_ns, size)
+ShardSignature = Optional[Tuple[int, int, int]]
+
+
+class InvalidListIdError(ValueError):
+    """Raised when a list id cannot be used to address a shard"""
+
+
+class VersionConflictError(Exception):
+    """Raised when a list changed since the version a writer based its update on"""
+
+    def __init__(self, list_id: str, expected_version: int, current_version: int):
+        super().__init__(
+            f"List {list_id} is at version {current_version}, expected {expected_version}"
+        )
+        self.list_id = list_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+def validate_list_id(list_id: str) -> str:
+    """Return the list id if it is safe to use as a shard name"""
+    if not list_id or not LIST_ID_PATTERN.match(list_id):
+        raise InvalidListIdError(f"Invalid list id: {list_id!r}")
+    return list_id
+
+
+def empty_list_data() -> Dict:
+    """Create the data of an empty shopping list"""
+    return {
+        "items": [],
+        "last_modified": datetime.now().isoformat(),
+        "version": 0
+    }
+
+
+def copy_list_data(data: Dict) -> Dict:
+    """Copy list data deep enough that callers can mutate items freely"""
+    copied = dict(data)
+    copied["items"] = [dict(item) for item in data.get("items", [])]
+    return copied
+
+
+def categorize_item_simple(item_name: str) -> str:
+    """Categorize an item by keywords in its name ("אחר" if none matches)"""
+    item_lower = item_name.lower()
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(word in item_lower for word in keywords):
+            return category
+    return "אחר"
+
+
+def set_item_completed(item: Dict, completed: bool):
+    """Mark an item bought or not, recording when it was bought (the archive moves old bought items out)"""
+    if completed and not item.get("completed", False):
+        item["completed_at"] = datetime.now().isoformat()
+    elif not completed:
+        item.pop("completed_at", None)
+    item["completed"] = completed
+
+
+def _lock_file(f):
+    """Block until this process holds an exclusive lock on an open file"""
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue  # LK_LOCK gives up after ~10s, keep waiting
+
+
+def _unlock_file(f):
+    """Release a lock taken with _lock_file"""
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ListLock:
+    """Reentrant per-list lock that excludes other threads and other worker processes
+
+    Threads of one process serialize on an RLock; the outermost acquisition
+    also takes an exclusive lock on the list's lock file so uvicorn workers
+    sharing the same shards never interleave a load/modify/save sequence.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+                lock_file = open(self.lock_path, 'a+')
+                try:
+                    _lock_file(lock_file)
+                except Exception:
+                    lock_file.close()
+                    raise
+                self._lock_file = lock_file
+            except Exception:
+                self.thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock_file(self._lock_file)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ShoppingListStore:
+    """Sharded shopping list storage with an LRU of resident lists and per-list locks
+
+    Safe to share between threads and between processes: writers take the
+    list's ListLock, shards are replaced atomically, and resident copies are
+    revalidated against the shard on disk so a write by another worker is
+    never served stale.
+    """
+
+    def __init__(
+            self,
+            base_dir: str = LISTS_DIR,
+            max_resident: int = MAX_RESIDENT_LISTS,
+            legacy_file: Optional[str] = LEGACY_LIST_FILE
+    ):
+        """Initialize the store
+
+        Args:
+            base_dir: Directory holding the list shards
+            max_resident: Maximum number of lists kept in memory
+            legacy_file: Pre-sharding list file migrated into the default list
+        """
+        self.base_dir = base_dir
+        self.max_resident = max(1, max_resident)
+        self.legacy_file = legacy_file
+
+        # list_id -> (data, signature of the shard the data was read from)
+        self._resident: "OrderedDict[str, Tuple[Dict, ShardSignature]]" = OrderedDict()
+        self._resident_lock = threading.Lock()
+        self._locks: Dict[str, ListLock] = {}
+        self._locks_guard = threading.Lock()
+        self._listeners: List[Callable[[str, int], None]] = []
+
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def shard_path(self, list_id: str) -> str:
+        """Get the shard file of a list
+
+        Shards are spread over 256 sub-directories so no single directory
+        grows with the number of households.
+        """
+        validate_list_id(list_id)
+        bucket = hashlib.sha1(list_id.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.base_dir, bucket, f"{list_id}.json")
+
+    def lock(self, list_id: str) -> ListLock:
+        """Get the lock guarding a single list
+
+        Hold it around a load/modify/save sequence; other lists are not blocked.
+        """
+        with self._locks_guard:
+            list_lock = self._locks.get(list_id)
+            if list_lock is None:
+                list_lock = ListLock(self.shard_path(list_id)[:-len(".json")] + ".lock")
+                self._locks[list_id] = list_lock
+            return list_lock
+
+    def add_listener(self, listener: Callable[[str, int], None]):
+        """Call listener(list_id, version) after every successful save"""
+        self._listeners.append(listener)
+
+    def load(self, list_id: str) -> Dict:
+        """Load a list, reading its shard only if it changed since it was last read
+
+        Returns a copy that the caller may modify and pass back to save().
+        """
+        validate_list_id(list_id)
+        # Readers only exclude threads; shards are replaced atomically on disk
+        with span("storage.load", timing="storage-load", list_id=list_id), self.lock(list_id).thread_lock:
+            return copy_list_data(self._current(list_id))
+
+    def version(self, list_id: str) -> int:
+        """Get the current version of a list"""
+        validate_list_id(list_id)
+        with self.lock(list_id).thread_lock:
+            return self._current(list_id).get("version", 0)
+
+    def save(self, list_id: str, data: Dict, expected_version: Optional[int] = None) -> bool:
+        """Persist a list to its shard and refresh the resident copy
+
+        Every successful save bumps the list version by one. When
+        expected_version is given the save is rejected with
+        VersionConflictError if another writer got there first.
+        """
+        validate_list_id(list_id)
+        with span("storage.save", timing="storage-save", list_id=list_id), self.lock(list_id):
+            current_version = self._current(list_id).get("version", 0)
+            if expected_version is not None and expected_version != current_version:
+                raise VersionConflictError(list_id, expected_version, current_version)
+
+            try:
+                data["last_modified"] = datetime.now().isoformat()
+                data["version"] = current_version + 1
+                signature = self._write_shard(list_id, data)
+            except Exception as e:
+                logger.error(f"Error saving shopping list {list_id}: {e}")
+                data["version"] = current_version
+                # Drop the resident copy so the next load re-reads the shard
+                self.evict(list_id)
+                return False
+
+            self._make_resident(list_id, copy_list_data(data), signature)
+
+        for listener in self._listeners:
+            try:
+                listener(list_id, data["version"])
+            except Exception as e:
+                logger.error(f"Error notifying change listener for list {list_id}: {e}")
+        return True
+
+    def evict(self, list_id: str):
+        """Drop a list from memory; it is reloaded lazily on next access"""
+        with self._resident_lock:
+            self._resident.pop(list_id, None)
+
+    def resident_ids(self) -> List[str]:
+        """Get the ids of lists currently held in memory, coldest first"""
+        with self._resident_lock:
+            return list(self._resident.keys())
+
+    def list_ids(self) -> List[str]:
+        """Get the ids of all lists that have a shard on disk"""
+        list_ids = []
+        if not os.path.isdir(self.base_dir):
+            return list_ids
+
+        for bucket in sorted(os.listdir(self.base_dir)):
+            bucket_dir = os.path.join(self.base_dir, bucket)
+            if not os.path.isdir(bucket_dir):
+                continue
+            for file_name in sorted(os.listdir(bucket_dir)):
+                if file_name.endswith(".json"):
+                    list_ids.append(file_name[:-len(".json")])
+        return list_ids
+
+    def _current(self, list_id: str) -> Dict:
+        """Get the resident data of a list, re-reading the shard if another process replaced it
+
+        Must be called with the list's thread lock held. The returned dict is
+        the resident copy itself and must not be modified.
+        """
+        signature = self._shard_signature(list_id)
+        with self._resident_lock:
+            entry = self._resident.get(list_id)
+            if entry is not None and entry[1] == signature:
+                self._resident.move_to_end(list_id)
+                return entry[0]
+
+        # Keep the signature taken before the read: a shard replaced since then only costs another read,
+        # while a later stat could label this data with a newer shard's signature and serve it stale for good
+        data = self._read_shard(list_id)
+        self._make_resident(list_id, data, signature)
+        return data
+
+    def _shard_signature(self, list_id: str) -> ShardSignature:
+        """Stat a shard; replacing it always yields a new inode"""
+        try:
+            stat = os.stat(self.shard_path(list_id))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _make_resident(self, list_id: str, data: Dict, signature: ShardSignature):
+        """Insert a list into the LRU, evicting the coldest lists when full"""
+        with self._resident_lock:
+            self._resident[list_id] = (data, signature)
+            self._resident.move_to_end(list_id)
+            while len(self._resident) > self.max_resident:
+                evicted_id, _ = self._resident.popitem(last=False)
+                logger.debug(f"Evicted cold shopping list from memory: {evicted_id}")
+
+    def _read_shard(self, list_id: str) -> Dict:
+        """Read a list from disk, falling back to the legacy file or an empty list"""
+        path = self.shard_path(list_id)
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+
+            if list_id == DEFAULT_LIST_ID and self.legacy_file and os.path.exists(self.legacy_file):
+                logger.info(f"Migrating legacy shopping list {self.legacy_file} into list {list_id}")
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self.lock(list_id):
+                    if not os.path.exists(path):
+                        self._write_shard(list_id, data)
+                return data
+        except Exception as e:
+            logger.error(f"Error loading shopping list {list_id}: {e}")
+
+        return empty_list_data()
+
+    def _write_shard(self, list_id: str, data: Dict) -> ShardSignature:
+        """Write a list atomically so readers never see a half-written shard"""
+        path = self.shard_path(list_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+        return self._shard_signature(list_id)
+
+
+_default_store: Optional[ShoppingListStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> ShoppingListStore:
+    """Get the process-wide store shared by the server and the agent toolkit"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ShoppingListStore()
+        return _default_store
@@ -0,0 +1,193 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from ipaddress import ip_address
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Self-signed certificate for HTTPS on the local network; generated once and reused on later starts
+SSL_DIR = os.getenv("SSL_DIR", "ssl_certs")
+CERT_FILE = os.path.join(SSL_DIR, "cert.pem")
+KEY_FILE = os.path.join(SSL_DIR, "key.pem")
+
+# How long get_local_ip() waits for address discovery before answering "localhost"
+LOCAL_IP_TIMEOUT = float(os.getenv("LOCAL_IP_TIMEOUT_SECONDS", "0.5"))
+
+_local_ip: Optional[str] = None
+_discovery: Optional[threading.Thread] = None
+_discovery_lock = threading.Lock()
+
+
+def discover_local_ip() -> Optional[str]:
+    """Find the LAN address of this machine from the route towards a public address
+
+    Connecting a UDP socket sends no packets; it only selects the outgoing
+    interface. Returns None when there is no route (e.g. no network yet).
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(LOCAL_IP_TIMEOUT)
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+def _run_discovery():
+    global _local_ip
+    _local_ip = discover_local_ip()
+    if _local_ip:
+        logger.info(f"Local IP address: {_local_ip}")
+
+
+def start_local_ip_discovery():
+    """Start discovering the LAN address in the background (once per process)"""
+    global _discovery
+    with _discovery_lock:
+        if _discovery is None:
+            _discovery = threading.Thread(target=_run_discovery, name="local-ip-discovery", daemon=True)
+            _discovery.start()
+
+
+def known_local_ip() -> Optional[str]:
+    """Get the LAN address if discovery has finished, without waiting"""
+    return _local_ip
+
+
+def get_local_ip(timeout: float = LOCAL_IP_TIMEOUT) -> str:
+    """Get the local IP address, waiting at most timeout seconds for discovery"""
+    start_local_ip_discovery()
+    _discovery.join(timeout)
+    return _local_ip or "localhost"
+
+
+def certificate_exists() -> bool:
+    return os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE)
+
+
+def generate_ssl_certificate() -> bool:
+    """Generate a self-signed certificate using the Python cryptography library
+
+    cryptography is imported here rather than at module import, so starting
+    with an existing certificate never loads it. The key is ECDSA P-256,
+    which takes about a millisecond to generate where RSA-2048 takes from
+    tens of milliseconds up to seconds on appliance CPUs.
+    """
+    os.makedirs(SSL_DIR, exist_ok=True)
+
+    if certificate_exists():
+        logger.info("SSL certificates already exist")
+        return True
+
+    try:
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        local_ip = get_local_ip()
+        logger.info(f"Generating SSL certificate for local IP: {local_ip}")
+
+        # Generate private key
+        private_key = ec.generate_private_key(ec.SECP256R1())
+
+        # Create certificate subject
+        subject = issuer = x509.Name([
+            x509.NameAttribute(NameOID.COUNTRY_NAME, "IL"),
+            x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Local"),
+            x509.NameAttribute(NameOID.LOCALITY_NAME, "Local"),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Smart Shopping List"),
+            x509.NameAttribute(NameOID.COMMON_NAME, local_ip),
+        ])
+
+        alternative_names = [
+            x509.DNSName("localhost"),
+            x509.DNSName("*.local"),
+            x509.IPAddress(ip_address("127.0.0.1")),
+        ]
+        if local_ip != "localhost":
+            alternative_names.append(x509.IPAddress(ip_address(local_ip)))
+
+        # Create certificate
+        cert = x509.CertificateBuilder().subject_name(
+            subject
+        ).issuer_name(
+            issuer
+        ).public_key(
+            private_key.public_key()
+        ).serial_number(
+            x509.random_serial_number()
+        ).not_valid_before(
+            datetime.utcnow()
+        ).not_valid_after(
+            # Certificate valid for 1 year
+            datetime.utcnow() + timedelta(days=365)
+        ).add_extension(
+            x509.SubjectAlternativeName(alternative_names),
+            critical=False,
+        ).add_extension(
+            x509.KeyUsage(
+                digital_signature=True,
+                content_commitment=False,
+                key_encipherment=False,
+                data_encipherment=False,
+                key_agreement=False,
+                key_cert_sign=False,
+                crl_sign=False,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            critical=True,
+        ).add_extension(
+            x509.ExtendedKeyUsage([
+                x509.oid.ExtendedKeyUsageOID.SERVER_AUTH,
+            ]),
+            critical=True,
+        ).sign(private_key, hashes.SHA256())
+
+        # Write the key and certificate atomically so a reboot mid-write never leaves half a pair
+        key_temp, cert_temp = f"{KEY_FILE}.tmp", f"{CERT_FILE}.tmp"
+        with open(key_temp, "wb") as f:
+            f.write(private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption()
+            ))
+        with open(cert_temp, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        os.replace(key_temp, KEY_FILE)
+        os.replace(cert_temp, CERT_FILE)
+
+        logger.info("SSL certificate generated successfully using Python cryptography")
+        logger.info(f"Certificate: {CERT_FILE}")
+        logger.info(f"Private key: {KEY_FILE}")
+        logger.info(f"Valid for: {', '.join(str(name.value) for name in alternative_names)}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error generating SSL certificate: {e}")
+        return False
+
+
+class CertificateGeneration:
+    """Generates a missing certificate in a background thread while the rest of startup runs"""
+
+    def __init__(self):
+        self.result: Optional[bool] = True if certificate_exists() else None
+        self._thread: Optional[threading.Thread] = None
+        if self.result is None:
+            self._thread = threading.Thread(target=self._run, name="certificate-generation", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.result = generate_ssl_certificate()
+
+    def wait(self) -> bool:
+        """Wait for the certificate; True if HTTPS can be used"""
+        if self._thread is not None:
+            self._thread.join()
+        return bool(self.result)
+
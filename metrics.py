@@ -0,0 +1,315 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Default histogram buckets (seconds) for voice pipeline stages; the README target is <2s end to end
+VOICE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+# Default histogram buckets (seconds) for plain HTTP requests
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Format a Prometheus label set, e.g. {stage="tts",le="0.5"}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base of metrics that keep one series per combination of label values"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests or fallbacks"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of durations in cumulative buckets, with their sum and count"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> ([count per bucket], sum, count)
+        self._series: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._series[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._label_values(labels))
+            return series[2] if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Current value read from a callback when metrics are rendered"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = HTTP_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry shared by the server and the agent
+REGISTRY = MetricsRegistry()
+
+VOICE_STAGE_SECONDS = REGISTRY.histogram(
+    "voice_stage_duration_seconds",
+    "Duration of voice pipeline stages (upload_read, preprocess, transcription, agent, tts, total)",
+    labelnames=("endpoint", "stage"), buckets=VOICE_BUCKETS
+)
+AGENT_TOOL_CALL_SECONDS = REGISTRY.histogram(
+    "agent_tool_call_duration_seconds",
+    "Duration of shopping list toolkit calls made by the agent",
+    labelnames=("tool",), buckets=HTTP_BUCKETS
+)
+AGENT_MODEL_CALL_SECONDS = REGISTRY.histogram(
+    "agent_model_call_duration_seconds",
+    "Duration of model round-trips made by the agent",
+    buckets=VOICE_BUCKETS
+)
+AGENT_COMMAND_MODEL_CALLS = REGISTRY.histogram(
+    "agent_command_model_calls",
+    "Model round-trips per agent command, by whether the prompt carried a list snapshot",
+    labelnames=("list_context",), buckets=(1, 2, 3, 4, 6, 8)
+)
+AGENT_COMMAND_TOKENS = REGISTRY.histogram(
+    "agent_command_tokens",
+    "Model tokens per agent command (all round-trips), by list snapshot and direction",
+    labelnames=("list_context", "direction"), buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+)
+AGENT_PROMPT_TOKENS = REGISTRY.histogram(
+    "agent_prompt_tokens",
+    "Tokens of the first model call's prompt by part: static (system prompt, tool schemas), memory, history, request",
+    labelnames=("part",), buckets=(50, 100, 200, 400, 800, 1600, 3200, 6400)
+)
+AGENT_INPUT_TOKENS_TOTAL = REGISTRY.counter(
+    "agent_input_tokens_total",
+    "Input tokens sent to the agent model, by whether the provider's prompt cache served them",
+    labelnames=("cache",)
+)
+AGENT_HISTORY_TOKENS = REGISTRY.histogram(
+    "agent_history_tokens",
+    "Tokens of earlier turns kept for replay with the next agent command",
+    buckets=(0, 100, 200, 400, 600, 800, 1200, 2000)
+)
+AGENT_HISTORY_SUMMARIES_TOTAL = REGISTRY.counter(
+    "agent_history_summaries_total",
+    "Batches of older turns folded into the session memory, by result",
+    labelnames=("result",)
+)
+AGENT_STORAGE_COMPACTIONS_TOTAL = REGISTRY.counter(
+    "agent_storage_compactions_total",
+    "Deletions of old agent sessions followed by a vacuum of the agent storage"
+)
+AGENT_FALLBACKS_TOTAL = REGISTRY.counter(
+    "agent_fallbacks_total",
+    "Voice commands handled by the keyword fallback instead of the agent",
+    labelnames=("reason",)
+)
+FALSE_POSITIVES_TOTAL = REGISTRY.counter(
+    "transcription_false_positives_total",
+    "Transcriptions discarded as likely Whisper hallucinations or empty",
+    labelnames=("endpoint",)
+)
+AUDIO_CLIPS_TOTAL = REGISTRY.counter(
+    "audio_preprocess_clips_total",
+    "Uploaded clips by preprocessing outcome (trimmed, silent, passthrough)",
+    labelnames=("endpoint", "outcome")
+)
+AUDIO_BYTES_SAVED_TOTAL = REGISTRY.counter(
+    "audio_preprocess_bytes_saved_total",
+    "Audio bytes not sent to speech-to-text thanks to silence trimming, downsampling and rejection",
+    labelnames=("endpoint",)
+)
+STT_CALLS_AVOIDED_TOTAL = REGISTRY.counter(
+    "stt_calls_avoided_total",
+    "Speech-to-text calls skipped because the clip had no speech",
+    labelnames=("endpoint", "reason")
+)
+VOICE_STAGE_TIMEOUTS_TOTAL = REGISTRY.counter(
+    "voice_stage_timeouts_total",
+    "Voice pipeline stages cancelled for exceeding their budget within the command deadline",
+    labelnames=("stage",)
+)
+CIRCUIT_BREAKER_SKIPS_TOTAL = REGISTRY.counter(
+    "circuit_breaker_skips_total",
+    "Calls to a remote dependency skipped because its circuit was open",
+    labelnames=("dependency",)
+)
+TTS_CONNECTIONS_TOTAL = REGISTRY.counter(
+    "tts_connections_total",
+    "Connections to the TTS service opened, reused for another reply, or dropped",
+    labelnames=("event",)
+)
+TTS_CACHE_LOOKUPS_TOTAL = REGISTRY.counter(
+    "tts_cache_lookups_total",
+    "Replies looked up in the synthesized speech cache",
+    labelnames=("result",)
+)
+VOICE_ANSWER_CACHE_LOOKUPS_TOTAL = REGISTRY.counter(
+    "voice_answer_cache_lookups_total",
+    "Read-only voice questions looked up in the answer cache (a hit skips the agent and TTS)",
+    labelnames=("result",)
+)
+ITEM_ARCHIVE_MOVES_TOTAL = REGISTRY.counter(
+    "item_archive_moves_total",
+    "Bought items moved off the lists into the archive, or restored from it",
+    labelnames=("direction",)
+)
+PURCHASES_RECORDED_TOTAL = REGISTRY.counter(
+    "purchases_recorded_total",
+    "Bought items appended to the purchase history as they left a list (cleared or archived)"
+)
+ITEMS_RECATEGORIZED_TOTAL = REGISTRY.counter(
+    "items_recategorized_total",
+    "Items moved out of \"אחר\" by the batch recategorization job",
+    labelnames=("categorizer",)
+)
+PRODUCT_CATALOG_LOOKUPS_TOTAL = REGISTRY.counter(
+    "product_catalog_lookups_total",
+    "Product catalog lookups by barcode, exact name or name prefix",
+    labelnames=("kind", "result")
+)
+HTTP_REQUESTS_TOTAL = REGISTRY.counter(
+    "http_requests_total",
+    "HTTP requests by route and status code",
+    labelnames=("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by route",
+    labelnames=("method", "route"), buckets=HTTP_BUCKETS
+)
@@ -0,0 +1,315 @@
+"""Product catalog: canonical names and categories by barcode or name, from a memory-mapped index file
+
+The catalog (hundreds of thousands of products) is imported once into a
+compact binary file with fixed-size records sorted by barcode and a name
+index sorted by normalized name. The server maps the file on first use
+and binary-searches it in place, so startup time and resident memory do
+not grow with the catalog: the OS pages in the few pages a lookup
+touches and shares them between workers.
+
+    python product_catalog.py import products.csv                  # barcode,name[,category] columns
+    python product_catalog.py import prices.csv --barcode-column ItemCode --name-column ItemName
+    python product_catalog.py lookup 7290000066318
+    python product_catalog.py lookup "חלב תנ"                      # name prefix
+
+File layout (little-endian): a header, the category names (JSON), one
+24-byte record per product sorted by barcode (GTIN-14 digits, name
+offset, name length, category), one 12-byte entry per distinct
+normalized name sorted by its UTF-8 bytes (key offset, key length,
+record) and the string bytes.
+"""
+import argparse
+import bisect
+import csv
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from list_store import CATEGORIES, categorize_item_simple
+from metrics import PRODUCT_CATALOG_LOOKUPS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_CATALOG_FILE = os.getenv("PRODUCT_CATALOG_FILE", "static2/product_catalog.idx")
+
+# How often a lookup checks whether the import tool replaced the file
+CATALOG_RELOAD_CHECK_SECONDS = 30
+
+MAGIC = b"SLCAT02\n"
+HEADER = struct.Struct("<8sIIQQQQQ")  # magic, products, names, categories at/length, records, names, strings at
+RECORD = struct.Struct("<14sIHBxxx")  # GTIN-14 barcode (zero bytes: none), name offset, name length, category index
+NAME_ENTRY = struct.Struct("<IHxxI")  # key offset, key length, record index
+BARCODE = struct.Struct("<14s")
+NO_BARCODE = bytes(BARCODE.size)
+
+MAX_NAME_BYTES = 0xFFFF
+# EAN-8, UPC-A, EAN-13 and GTIN-14
+BARCODE_PATTERN = re.compile(r"^(\d{8}|\d{12,14})$")
+GTIN_LENGTH = 14
+NIQQUD = re.compile(r"[\u0591-\u05C7]")
+
+
+def name_key(name: str) -> str:
+    """Names match ignoring case, niqqud and extra spaces"""
+    return " ".join(NIQQUD.sub("", name.lower()).split())
+
+
+def parse_barcode(barcode: str) -> Optional[str]:
+    """A barcode as stored in the index, zero-padded to GTIN-14, or None if it is not one
+
+    A UPC-A code and the EAN-13 with its leading zero are the same GTIN and
+    find the same product; codes of other lengths are not barcodes.
+    """
+    barcode = (barcode or "").strip()
+    if not BARCODE_PATTERN.match(barcode) or not barcode.strip("0"):
+        return None
+    return barcode.zfill(GTIN_LENGTH)
+
+
+def build_index(rows: Iterator[Dict], out_file: str) -> dict:
+    """Write the index file for rows of {"barcode", "name", "category"} (category optional)
+
+    Products without a valid barcode are only found by name; a barcode
+    seen twice keeps its first product. Categories outside CATEGORIES are
+    replaced by the keyword categorizer's. The file is written next to
+    out_file and moved over it, so a running server never maps half a file.
+    """
+    categories = list(CATEGORIES)
+    category_index = {category: i for i, category in enumerate(categories)}
+    products, barcodes, skipped = [], set(), 0
+    for row in rows:
+        name = " ".join((row.get("name") or "").split())
+        if not name or len(name.encode("utf-8")) > MAX_NAME_BYTES:
+            skipped += 1
+            continue
+        barcode = parse_barcode(row.get("barcode") or "")
+        if barcode in barcodes:
+            skipped += 1
+            continue
+        if barcode:
+            barcodes.add(barcode)
+        category = (row.get("category") or "").strip()
+        if category not in category_index:
+            category = categorize_item_simple(name)
+        products.append((barcode.encode("ascii") if barcode else NO_BARCODE, name, category_index[category]))
+    products.sort(key=lambda product: product[0])
+
+    strings = bytearray()
+    records = bytearray()
+    first_by_key = {}
+    for i, (barcode, name, category) in enumerate(products):
+        encoded = name.encode("utf-8")
+        records += RECORD.pack(barcode, len(strings), len(encoded), category)
+        strings += encoded
+        first_by_key.setdefault(name_key(name).encode("utf-8"), i)
+    names = bytearray()
+    for key in sorted(first_by_key):
+        names += NAME_ENTRY.pack(len(strings), len(key), first_by_key[key])
+        strings += key
+
+    category_bytes = json.dumps(categories, ensure_ascii=False).encode("utf-8")
+    categories_at = HEADER.size
+    records_at = categories_at + len(category_bytes)
+    names_at = records_at + len(records)
+    strings_at = names_at + len(names)
+
+    out_dir = os.path.dirname(out_file)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_file = f"{out_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(products), len(first_by_key), categories_at, len(category_bytes),
+                            records_at, names_at, strings_at))
+        f.write(category_bytes)
+        f.write(records)
+        f.write(names)
+        f.write(strings)
+    os.replace(tmp_file, out_file)
+    return {"file": out_file, "products": len(products), "names": len(first_by_key),
+            "with_barcode": len(barcodes), "skipped": skipped, "bytes": os.path.getsize(out_file)}
+
+
+class CatalogIndex:
+    """One mapping of an index file; lookups copy out only the bytes of the entries they compare and return"""
+
+    def __init__(self, mapped: mmap.mmap):
+        magic, self.products, self.names, categories_at, categories_len, self.records_at, self.names_at, \
+            self.strings_at = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError("not a product catalog file of this version; import the catalog again")
+        self.categories = json.loads(mapped[categories_at:categories_at + categories_len].decode("utf-8"))
+        self.mapped = mapped
+
+    def product(self, index: int) -> Dict:
+        barcode, name_at, name_len, category = RECORD.unpack_from(self.mapped, self.records_at + index * RECORD.size)
+        start = self.strings_at + name_at
+        return {
+            "barcode": barcode.decode("ascii") if barcode != NO_BARCODE else None,
+            "name": self.mapped[start:start + name_len].decode("utf-8"),
+            "category": self.categories[category],
+        }
+
+    def barcode_index(self, code: bytes) -> Optional[int]:
+        lo, hi = 0, self.products
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if BARCODE.unpack_from(self.mapped, self.records_at + mid * RECORD.size)[0] < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.products and BARCODE.unpack_from(self.mapped, self.records_at + lo * RECORD.size)[0] == code:
+            return lo
+        return None
+
+    def key(self, entry: int) -> bytes:
+        key_at, key_len, _ = NAME_ENTRY.unpack_from(self.mapped, self.names_at + entry * NAME_ENTRY.size)
+        start = self.strings_at + key_at
+        return self.mapped[start:start + key_len]
+
+    def record_of(self, entry: int) -> int:
+        return NAME_ENTRY.unpack_from(self.mapped, self.names_at + entry * NAME_ENTRY.size)[2]
+
+    def first_name_at_or_after(self, key: bytes) -> int:
+        return bisect.bisect_left(range(self.names), key, key=self.key)
+
+
+class ProductCatalog:
+    """Product lookups in an index file, mapped on first use
+
+    A missing file is an empty catalog. The file is re-mapped when the
+    import tool replaces it; lookups already running finish on the old
+    mapping.
+    """
+
+    def __init__(self, path: str = PRODUCT_CATALOG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index: Optional[CatalogIndex] = None
+        self._signature = None
+        self._checked_at: Optional[float] = None
+
+    def _current(self) -> Optional[CatalogIndex]:
+        """The current mapping, (re)mapping the file if it appeared or was replaced since the last check"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < CATALOG_RELOAD_CHECK_SECONDS:
+            return self._index
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._index, self._signature = None, None
+                return None
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if signature != self._signature:
+                self._index, self._signature = None, signature
+                try:
+                    with open(self.path, "rb") as f:
+                        self._index = CatalogIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                    logger.info(f"Product catalog mapped: {self._index.products} products from {self.path}")
+                except Exception as e:
+                    logger.error(f"Could not open product catalog {self.path}: {e}")
+            return self._index
+
+    def __len__(self) -> int:
+        index = self._current()
+        return index.products if index else 0
+
+    def by_barcode(self, barcode: str) -> Optional[Dict]:
+        """The product with this barcode, or None"""
+        index, code = self._current(), parse_barcode(barcode)
+        if index is None or code is None:
+            return None
+        found = index.barcode_index(code.encode("ascii"))
+        PRODUCT_CATALOG_LOOKUPS_TOTAL.inc(kind="barcode", result="miss" if found is None else "hit")
+        return None if found is None else index.product(found)
+
+    def by_name(self, name: str) -> Optional[Dict]:
+        """The product whose name matches name (ignoring case, niqqud and spaces), or None"""
+        index, key = self._current(), name_key(name).encode("utf-8")
+        if index is None or not key:
+            return None
+        entry = index.first_name_at_or_after(key)
+        found = entry < index.names and index.key(entry) == key
+        PRODUCT_CATALOG_LOOKUPS_TOTAL.inc(kind="name", result="hit" if found else "miss")
+        return index.product(index.record_of(entry)) if found else None
+
+    def by_prefix(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Products whose name starts with prefix, in name order, one per distinct name"""
+        index, key = self._current(), name_key(prefix).encode("utf-8")
+        if index is None or not key:
+            return []
+        products = []
+        entry = index.first_name_at_or_after(key)
+        while entry < index.names and len(products) < limit and index.key(entry).startswith(key):
+            products.append(index.product(index.record_of(entry)))
+            entry += 1
+        PRODUCT_CATALOG_LOOKUPS_TOTAL.inc(kind="prefix", result="hit" if products else "miss")
+        return products
+
+    def lookup(self, query: str, limit: int = 10) -> List[Dict]:
+        """Products for a barcode (all digits) or a name prefix"""
+        if parse_barcode(query) is not None:
+            product = self.by_barcode(query)
+            return [product] if product else []
+        return self.by_prefix(query, limit)
+
+    def stats(self) -> dict:
+        index = self._current()
+        return {"file": self.path, "available": index is not None, "products": index.products if index else 0,
+                "names": index.names if index else 0, "bytes": len(index.mapped) if index else 0}
+
+
+def read_csv(path: str, barcode_column: str, name_column: str, category_column: str) -> Iterator[Dict]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield {"barcode": row.get(barcode_column), "name": row.get(name_column),
+                   "category": row.get(category_column)}
+
+
+_default_catalog: Optional[ProductCatalog] = None
+_default_catalog_lock = threading.Lock()
+
+
+def get_default_catalog() -> ProductCatalog:
+    """Get the process-wide catalog shared by the server and the agent toolkit"""
+    global _default_catalog
+    with _default_catalog_lock:
+        if _default_catalog is None:
+            _default_catalog = ProductCatalog()
+        return _default_catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=PRODUCT_CATALOG_FILE, help="Index file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Build the index file from a CSV file")
+    importer.add_argument("csv_file")
+    importer.add_argument("--barcode-column", default="barcode")
+    importer.add_argument("--name-column", default="name")
+    importer.add_argument("--category-column", default="category")
+    finder = commands.add_parser("lookup", help="Look up a barcode or a name prefix")
+    finder.add_argument("query")
+    finder.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        started = time.perf_counter()
+        report = build_index(read_csv(args.csv_file, args.barcode_column, args.name_column, args.category_column),
+                             args.file)
+        report["seconds"] = round(time.perf_counter() - started, 2)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        for product in ProductCatalog(args.file).lookup(args.query, args.limit):
+            print(json.dumps(product, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Fraction of API requests profiled without being asked to (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Profiles are kept in a ring of at most PROFILE_RING_SIZE files, oldest dropped first
+PROFILE_DIR = os.getenv("PROFILE_DIR", "static2/profiles")
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+
+# Interval between stack samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+
+# Profiled requests allowed at once per process; more are served unprofiled
+MAX_CONCURRENT_PROFILES = 2
+
+PROFILE_MODES = ("sample", "cprofile")
+
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.(collapsed|pstats)$")
+
+# Limits concurrently profiled requests to MAX_CONCURRENT_PROFILES
+profile_slots = threading.BoundedSemaphore(MAX_CONCURRENT_PROFILES)
+
+
+class SamplingProfiler:
+    """Low-overhead profiler that samples the stacks of every thread at a fixed interval
+
+    Covers the event loop and the worker threads running the agent, so the
+    result shows where the process spent its time while the request ran.
+    Stacks are aggregated in the collapsed format used by flame graph tools
+    ("thread;outer (file:line);inner (file:line) count").
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        # Sample right away so requests shorter than one interval still get a stack
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if self._stop.wait(self.interval):
+                break
+
+
+class RequestProfiler:
+    """Profiles one request with either the sampling profiler or cProfile
+
+    cProfile is deterministic but only sees the thread that enabled it (the
+    event loop), and only one can be active at a time; when it is busy the
+    sampling profiler is used instead.
+    """
+
+    _cprofile_lock = threading.Lock()
+
+    def __init__(self, mode: str = "sample"):
+        self.mode = mode
+        self._sampler: Optional[SamplingProfiler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self.started_at = time.time()
+        self.duration = 0.0
+        self._start = 0.0
+
+    def start(self):
+        if self.mode == "cprofile" and self._cprofile_lock.acquire(blocking=False):
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self.mode = "sample"
+            self._sampler = SamplingProfiler()
+            self._sampler.start()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile_lock.release()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def save(self, store: "ProfileStore", label: str) -> str:
+        """Write the profile to the ring and return its name"""
+        if self._cprofile is not None:
+            return store.save(label, "pstats", lambda path: self._cprofile.dump_stats(path))
+        collapsed = self._sampler.collapsed()
+        return store.save(label, "collapsed", lambda path: _write_text(path, collapsed))
+
+
+def _write_text(path: str, text: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+class ProfileStore:
+    """Bounded on-disk ring of profile files shared by all worker processes"""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_profiles: int = PROFILE_RING_SIZE):
+        self.directory = directory
+        self.max_profiles = max(1, max_profiles)
+        self._lock = threading.Lock()
+
+    def save(self, label: str, extension: str, write) -> str:
+        """Write a profile through write(path) and drop the oldest beyond the ring size"""
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^\w-]+", "_", label).strip("_")[:80] or "request"
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{slug}.{extension}"
+        path = os.path.join(self.directory, name)
+
+        temp_path = f"{path}.tmp"
+        write(temp_path)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._prune()
+        return name
+
+    def list(self) -> List[Dict]:
+        """Get the stored profiles, newest first"""
+        profiles = []
+        if not os.path.isdir(self.directory):
+            return profiles
+        for name in os.listdir(self.directory):
+            if not PROFILE_NAME_PATTERN.match(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # Pruned by another worker
+            profiles.append({
+                "name": name,
+                "format": name.rsplit(".", 1)[1],
+                "size": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            })
+        profiles.sort(key=lambda profile: profile["name"], reverse=True)
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """Get the file of a stored profile, or None if the name is unknown"""
+        if not PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def _prune(self):
+        for profile in self.list()[self.max_profiles:]:
+            try:
+                os.unlink(os.path.join(self.directory, profile["name"]))
+            except FileNotFoundError:
+                pass
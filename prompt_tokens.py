@@ -0,0 +1,35 @@
+import math
+from functools import lru_cache
+
+# Tokenizer of the agent's model family (gpt-4.1); tiktoken is optional
+TOKEN_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Number of model tokens in text: exact with tiktoken installed, otherwise an estimate
+
+    The estimate assumes about 4 characters per token for ASCII and 2.5 for
+    other scripts (Hebrew words mostly split into 2-3 tokens); good enough to
+    compare prompt variants, not to bill them.
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5)
+
+
+def tokenizer_name() -> str:
+    """Which counter count_tokens() uses, for reports"""
+    return TOKEN_ENCODING if _encoding() is not None else "estimate"
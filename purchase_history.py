@@ -0,0 +1,280 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional
+
+from metrics import PURCHASES_RECORDED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Append-only log of bought items and the aggregates kept up to date with it, shared by all workers
+PURCHASE_HISTORY_DB = os.getenv("PURCHASE_HISTORY_DB", "static2/purchase_history.db")
+
+# Items bought at most this many minutes apart count as one shopping trip (for "bought together")
+PURCHASE_TRIP_GAP_MINUTES = float(os.getenv("PURCHASE_TRIP_GAP_MINUTES", "120"))
+
+# Larger trips only count their first items as bought together, bounding the pairs written per trip
+MAX_TRIP_ITEMS = 40
+
+# An item needs this many purchases before it has a buying interval
+MIN_PURCHASES_FOR_INTERVAL = 2
+
+DAY_SECONDS = 86400
+
+# When an item is due again: its last purchase plus its mean interval (NULL below two purchases)
+NEXT_DUE = "last_at + (last_at - first_at) / (purchases - 1)"
+
+
+def item_key(name: str) -> str:
+    """Items are the same item when their names match ignoring case and surrounding spaces"""
+    return name.lower().strip()
+
+
+def purchase_time(item: Dict) -> float:
+    """When a bought item was bought, as a Unix time (now for items bought before times were kept)"""
+    completed_at = item.get("completed_at")
+    if completed_at:
+        try:
+            return datetime.fromisoformat(completed_at).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def split_trips(purchases: List[Dict], gap_minutes: float = PURCHASE_TRIP_GAP_MINUTES) -> List[List[Dict]]:
+    """Group purchases (sorted by time) into trips: a gap longer than gap_minutes starts a new trip"""
+    trips = []
+    for purchase in purchases:
+        if trips and purchase["at"] - trips[-1][-1]["at"] <= gap_minutes * 60:
+            trips[-1].append(purchase)
+        else:
+            trips.append([purchase])
+    return trips
+
+
+class PurchaseHistory:
+    """SQLite log of purchases plus per-item and per-pair aggregates updated as purchases are appended
+
+    The log is never rewritten. Every purchase appended also updates, in
+    the same transaction, its item's count, first and last purchase time
+    (count and span give the mean interval) and the pair counts of the
+    items bought on the same trip, so suggestions read a few aggregate
+    rows instead of scanning the log. A purchase is keyed on (list, item
+    id, time bought), so recording the same bought item twice (a retried
+    clear, an archive sweep after a failed save) counts it once.
+    """
+
+    def __init__(self, db_file: str = PURCHASE_HISTORY_DB):
+        self.db_file = db_file
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connection()
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS purchases (
+                list_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                tag TEXT,
+                quantity TEXT,
+                purchased_at REAL NOT NULL,
+                recorded_at REAL NOT NULL,
+                UNIQUE (list_id, item_id, purchased_at)
+            );
+            CREATE INDEX IF NOT EXISTS purchases_by_recorded ON purchases (list_id, recorded_at);
+            CREATE TABLE IF NOT EXISTS item_stats (
+                list_id TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                tag TEXT,
+                purchases INTEGER NOT NULL,
+                first_at REAL NOT NULL,
+                last_at REAL NOT NULL,
+                PRIMARY KEY (list_id, item_key)
+            );
+            CREATE INDEX IF NOT EXISTS item_stats_by_due ON item_stats (list_id, {NEXT_DUE});
+            CREATE INDEX IF NOT EXISTS item_stats_by_count ON item_stats (list_id, purchases);
+            CREATE TABLE IF NOT EXISTS bought_together (
+                list_id TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                other_key TEXT NOT NULL,
+                trips INTEGER NOT NULL,
+                PRIMARY KEY (list_id, item_key, other_key)
+            );
+        """)
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection (sqlite3 connections are not shared across threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, list_id: str, items: Iterable[Dict]) -> int:
+        """Append bought items leaving a list to the history; items not bought are skipped
+
+        Returns:
+            Number of purchases appended (items already recorded are not counted again)
+        """
+        purchases = sorted(
+            ({"item": item, "key": item_key(item["name"]), "at": purchase_time(item)}
+             for item in items if item.get("completed", False) and item.get("name")),
+            key=lambda purchase: purchase["at"]
+        )
+        if not purchases:
+            return 0
+
+        now = time.time()
+        conn = self._connection()
+        appended = []
+        with conn:
+            for purchase in purchases:
+                item = purchase["item"]
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO purchases "
+                    "(list_id, item_id, item_key, name, tag, quantity, purchased_at, recorded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (list_id, item.get("id") or purchase["key"], purchase["key"], item["name"], item.get("tag"),
+                     str(item.get("quantity", "1")), purchase["at"], now)
+                )
+                if not cursor.rowcount:
+                    continue
+                appended.append(purchase)
+                conn.execute(
+                    "INSERT INTO item_stats (list_id, item_key, name, tag, purchases, first_at, last_at) "
+                    "VALUES (?, ?, ?, ?, 1, ?, ?) "
+                    "ON CONFLICT (list_id, item_key) DO UPDATE SET "
+                    "purchases = purchases + 1, first_at = MIN(first_at, excluded.first_at), "
+                    "last_at = MAX(last_at, excluded.last_at), "
+                    "name = CASE WHEN excluded.last_at >= last_at THEN excluded.name ELSE name END, "
+                    "tag = CASE WHEN excluded.last_at >= last_at THEN excluded.tag ELSE tag END",
+                    (list_id, purchase["key"], item["name"], item.get("tag"), purchase["at"], purchase["at"])
+                )
+
+            pairs = []
+            for trip in split_trips(appended):
+                keys = sorted({purchase["key"] for purchase in trip[:MAX_TRIP_ITEMS]})
+                for a, b in combinations(keys, 2):
+                    pairs += [(list_id, a, b), (list_id, b, a)]
+            conn.executemany(
+                "INSERT INTO bought_together (list_id, item_key, other_key, trips) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (list_id, item_key, other_key) DO UPDATE SET trips = trips + 1",
+                pairs
+            )
+
+        if appended:
+            PURCHASES_RECORDED_TOTAL.inc(len(appended))
+            logger.info(f"Recorded {len(appended)} purchases of list {list_id}")
+        return len(appended)
+
+    def _stats_row(self, row: sqlite3.Row, now: float) -> Dict:
+        suggestion = {
+            "name": row["name"],
+            "tag": row["tag"],
+            "purchases": row["purchases"],
+            "last_purchased": datetime.fromtimestamp(row["last_at"]).isoformat(timespec="seconds"),
+            "days_since_last": round((now - row["last_at"]) / DAY_SECONDS, 1),
+            "mean_interval_days": None,
+            "due_in_days": None,
+        }
+        if row["purchases"] >= MIN_PURCHASES_FOR_INTERVAL:
+            interval = (row["last_at"] - row["first_at"]) / (row["purchases"] - 1)
+            suggestion["mean_interval_days"] = round(interval / DAY_SECONDS, 1)
+            suggestion["due_in_days"] = round((row["last_at"] + interval - now) / DAY_SECONDS, 1)
+        return suggestion
+
+    def due(self, list_id: str, exclude: Iterable[str] = (), limit: int = 10,
+            horizon_days: float = 1.0) -> List[Dict]:
+        """Regular items due again within horizon_days (or overdue), most overdue first
+
+        Args:
+            exclude: Names to leave out (the items already on the list)
+        """
+        now = time.time()
+        excluded = {item_key(name) for name in exclude}
+        rows = self._connection().execute(
+            f"SELECT * FROM item_stats WHERE list_id = ? AND purchases >= ? AND {NEXT_DUE} <= ? "
+            f"ORDER BY {NEXT_DUE} LIMIT ?",
+            (list_id, MIN_PURCHASES_FOR_INTERVAL, now + horizon_days * DAY_SECONDS, limit + len(excluded))
+        ).fetchall()
+        return [self._stats_row(row, now) for row in rows if row["item_key"] not in excluded][:limit]
+
+    def regulars(self, list_id: str, exclude: Iterable[str] = (), limit: int = 10) -> List[Dict]:
+        """The most often bought items"""
+        now = time.time()
+        excluded = {item_key(name) for name in exclude}
+        rows = self._connection().execute(
+            "SELECT * FROM item_stats WHERE list_id = ? ORDER BY purchases DESC LIMIT ?",
+            (list_id, limit + len(excluded))
+        ).fetchall()
+        return [self._stats_row(row, now) for row in rows if row["item_key"] not in excluded][:limit]
+
+    def bought_with(self, list_id: str, names: Iterable[str], limit: int = 10) -> List[Dict]:
+        """Items most often bought on the same trip as any of names, not counting names themselves"""
+        keys = sorted({item_key(name) for name in names})
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection().execute(
+            f"SELECT s.name, s.tag, SUM(t.trips) AS trips FROM bought_together t "
+            f"JOIN item_stats s ON s.list_id = t.list_id AND s.item_key = t.other_key "
+            f"WHERE t.list_id = ? AND t.item_key IN ({placeholders}) AND t.other_key NOT IN ({placeholders}) "
+            f"GROUP BY t.other_key ORDER BY trips DESC, s.purchases DESC LIMIT ?",
+            [list_id] + keys + keys + [limit]
+        ).fetchall()
+        return [{"name": row["name"], "tag": row["tag"], "trips": row["trips"]} for row in rows]
+
+    def last_recorded(self, list_id: str) -> float:
+        """When purchases of the list were last appended (0 if never); changes whenever its aggregates do"""
+        row = self._connection().execute(
+            "SELECT MAX(recorded_at) FROM purchases WHERE list_id = ?", (list_id,)
+        ).fetchone()
+        return row[0] or 0.0
+
+    def item_counts(self, list_id: str) -> List[tuple]:
+        """(name, tag, purchases) of every item the list ever bought"""
+        return [tuple(row) for row in self._connection().execute(
+            "SELECT name, tag, purchases FROM item_stats WHERE list_id = ?", (list_id,)
+        )]
+
+    def item(self, list_id: str, name: str) -> Optional[Dict]:
+        """Purchase aggregates of one item, or None if it was never bought"""
+        row = self._connection().execute(
+            "SELECT * FROM item_stats WHERE list_id = ? AND item_key = ?", (list_id, item_key(name))
+        ).fetchone()
+        return self._stats_row(row, time.time()) if row else None
+
+    def suggestions(self, list_id: str, current_names: Iterable[str], limit: int = 10) -> Dict:
+        """Due, regular and bought-together items for a list, leaving out what is already on it"""
+        current_names = list(current_names)
+        return {
+            "due": self.due(list_id, current_names, limit),
+            "regulars": self.regulars(list_id, current_names, limit),
+            "bought_with": self.bought_with(list_id, current_names, limit),
+        }
+
+
+_default_history: Optional[PurchaseHistory] = None
+_default_history_lock = threading.Lock()
+
+
+def get_default_history() -> PurchaseHistory:
+    """Get the process-wide purchase history shared by the server, the archive and the agent toolkit"""
+    global _default_history
+    with _default_history_lock:
+        if _default_history is None:
+            _default_history = PurchaseHistory()
+        return _default_history
@@ -0,0 +1,199 @@
+"""Batch recategorization of items left under "אחר"
+
+Items added through the REST add-item path or missed by the keyword
+categorizer stay under "אחר". This job collects them from every list,
+categorizes each distinct name once (the local keyword categorizer, or a
+batched model request per RECATEGORIZE_BATCH_SIZE names) and saves
+each changed list once. Items whose category changed meanwhile are left
+alone. The server runs it on POST /admin/recategorize; by hand (the
+running server's workers and their push clients see the changed lists
+through the shared change event log):
+
+    python recategorize.py                      # keyword categorizer, all lists
+    python recategorize.py --model              # batched model request (needs OPENAI_API_KEY)
+    python recategorize.py --list cohen --dry-run
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from change_events import ChangeEventLog
+from list_store import (CATEGORIES, InvalidListIdError, ShoppingListStore, categorize_item_simple, get_default_store,
+                        validate_list_id)
+from metrics import ITEMS_RECATEGORIZED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+UNCATEGORIZED = "אחר"
+
+# Model and largest number of names per request when categorizing with the model
+RECATEGORIZE_MODEL = os.getenv("RECATEGORIZE_MODEL", "gpt-4.1-nano")
+RECATEGORIZE_BATCH_SIZE = int(os.getenv("RECATEGORIZE_BATCH_SIZE", "200"))
+RECATEGORIZE_TIMEOUT_SECONDS = 60
+
+MODEL_INSTRUCTIONS = (
+    "אתה מסווג מוצרים ברשימת קניות לקטגוריות. הקטגוריות האפשריות: " + ", ".join(CATEGORIES) + ". "
+    "תקבל מערך JSON של שמות מוצרים. החזר אובייקט JSON שבו כל שם מוצר הוא מפתח והערך הוא הקטגוריה שלו, "
+    "בדיוק כפי שהיא כתובה ברשימה. מוצר שלא מתאים לאף קטגוריה מקבל \"אחר\"."
+)
+
+
+def collect_uncategorized(store: ShoppingListStore, list_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """Names of the items under "אחר" (or without a category) per list, lists without any left out"""
+    found = {}
+    for list_id in list_ids:
+        names = [item["name"] for item in store.load(list_id)["items"]
+                 if item.get("tag", UNCATEGORIZED) == UNCATEGORIZED and item.get("name")]
+        if names:
+            found[list_id] = names
+    return found
+
+
+def categorize_locally(names: Iterable[str]) -> Dict[str, str]:
+    return {name: categorize_item_simple(name) for name in names}
+
+
+def categorize_with_model(names: List[str], client=None, model: str = RECATEGORIZE_MODEL) -> Dict[str, str]:
+    """Categorize names with one chat completion; names the model skips or puts in unknown categories are left out"""
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(timeout=RECATEGORIZE_TIMEOUT_SECONDS, max_retries=1)
+
+    completion = client.chat.completions.create(
+        model=model,
+        temperature=0,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": MODEL_INSTRUCTIONS},
+            {"role": "user", "content": json.dumps(names, ensure_ascii=False)},
+        ],
+    )
+    answer = json.loads(completion.choices[0].message.content or "{}")
+    return {name: answer[name] for name in names if answer.get(name) in CATEGORIES}
+
+
+def apply_categories(store: ShoppingListStore, list_id: str, categories: Dict[str, str]) -> Dict[str, int]:
+    """Move the list's "אחר" items to their new categories with a single save
+
+    Returns:
+        Number of items moved per category (empty if nothing moved or the save failed)
+    """
+    moved = {}
+    with store.lock(list_id):
+        data = store.load(list_id)
+        for item in data["items"]:
+            category = categories.get(item.get("name"), UNCATEGORIZED)
+            if item.get("tag", UNCATEGORIZED) == UNCATEGORIZED and category != UNCATEGORIZED:
+                item["tag"] = category
+                moved[category] = moved.get(category, 0) + 1
+        if moved and not store.save(list_id, data):
+            logger.error(f"Could not save recategorized list {list_id}")
+            return {}
+    return moved
+
+
+def recategorize(store: Optional[ShoppingListStore] = None, list_ids: Optional[List[str]] = None,
+                 use_model: bool = False, dry_run: bool = False, client=None) -> dict:
+    """Recategorize the "אחר" items of the given lists (all lists by default) and report what moved
+
+    With the model, names it leaves in "אחר" or skips (and whole batches
+    whose request fails) get the keyword categorizer's answer. Lists that
+    were not in memory before the job are evicted again afterwards.
+    """
+    store = store or get_default_store()
+    started = time.perf_counter()
+    resident_before = set(store.resident_ids())
+    list_ids = list_ids if list_ids is not None else store.list_ids()
+
+    found = collect_uncategorized(store, list_ids)
+    names = sorted({name for list_names in found.values() for name in list_names})
+    collected = time.perf_counter()
+
+    categories, model_requests, model_failures = {}, 0, 0
+    if use_model:
+        for start in range(0, len(names), RECATEGORIZE_BATCH_SIZE):
+            batch = names[start:start + RECATEGORIZE_BATCH_SIZE]
+            model_requests += 1
+            categories.update(categorize_locally(batch))
+            try:
+                answer = categorize_with_model(batch, client)
+            except Exception as e:
+                model_failures += 1
+                logger.warning(f"Model categorization of {len(batch)} names failed, using keywords: {e}")
+                continue
+            categories.update((name, category) for name, category in answer.items() if category != UNCATEGORIZED)
+    else:
+        categories = categorize_locally(names)
+    categorized = time.perf_counter()
+
+    by_list, by_category = {}, {}
+    for list_id in found:
+        if dry_run:
+            moved = {}
+            for name in found[list_id]:
+                category = categories.get(name, UNCATEGORIZED)
+                if category != UNCATEGORIZED:
+                    moved[category] = moved.get(category, 0) + 1
+        else:
+            moved = apply_categories(store, list_id, categories)
+        if moved:
+            by_list[list_id] = sum(moved.values())
+            for category, count in moved.items():
+                by_category[category] = by_category.get(category, 0) + count
+    for list_id in set(found) - resident_before:
+        store.evict(list_id)
+    finished = time.perf_counter()
+
+    moved_total = sum(by_list.values())
+    categorizer = "model" if use_model else "local"
+    if not dry_run:
+        ITEMS_RECATEGORIZED_TOTAL.inc(moved_total, categorizer=categorizer)
+    logger.info(f"Recategorized {moved_total} of {sum(map(len, found.values()))} uncategorized items "
+                f"in {len(by_list)} lists ({categorizer}) in {finished - started:.2f}s")
+    return {
+        "categorizer": categorizer,
+        "dry_run": dry_run,
+        "lists_scanned": len(list_ids),
+        "uncategorized_items": sum(map(len, found.values())),
+        "distinct_names": len(names),
+        "moved_items": moved_total,
+        "still_uncategorized": sum(map(len, found.values())) - moved_total,
+        "lists_written": 0 if dry_run else len(by_list),
+        "by_list": by_list,
+        "by_category": by_category,
+        "model_requests": model_requests,
+        "model_failures": model_failures,
+        "seconds": {
+            "collect": round(collected - started, 3),
+            "categorize": round(categorized - collected, 3),
+            "apply": round(finished - categorized, 3),
+            "total": round(finished - started, 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="append", dest="list_ids", help="Only this list (may be repeated)")
+    parser.add_argument("--model", action="store_true", help="Categorize with a batched model request")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would move without saving")
+    args = parser.parse_args()
+    try:
+        list_ids = [validate_list_id(list_id) for list_id in args.list_ids] if args.list_ids else None
+    except InvalidListIdError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO)
+    store = get_default_store()
+    # Saves here reach no server listener; publish them like a worker would, so the workers drop their
+    # resident copies and push the new versions to their clients
+    store.add_listener(ChangeEventLog().publish)
+    report = recategorize(store, list_ids, use_model=args.model, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
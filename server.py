@@ -1,32 +1,52 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import (FastAPI, HTTPException, UploadFile, File, Depends, Query, Header, Request, Response, WebSocket,
+                     WebSocketDisconnect)
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security.utils import get_authorization_scheme_param
 from pydantic import BaseModel
+from contextlib import asynccontextmanager, contextmanager
+import hmac
 import json
 import os
+import random
 import asyncio
 import tempfile
+import time
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 import logging
 import ssl
-import socket
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from ipaddress import ip_address
-import datetime
-
-# Voice processing imports
-import edge_tts
-from openai import OpenAI
+
 from dotenv import load_dotenv
 
+from list_store import (DEFAULT_LIST_ID, InvalidListIdError, categorize_item_simple, get_default_store,
+                        set_item_completed, validate_list_id)
+from change_events import ChangeEventLog, ChangeNotifier
+from idempotency import (IDEMPOTENCY_HEADER, IDEMPOTENCY_MAX_BODY_BYTES, MAX_KEY_LENGTH, CachedResponse,
+                         IdempotencyCache)
+from metrics import (REGISTRY, AGENT_FALLBACKS_TOTAL, AUDIO_BYTES_SAVED_TOTAL, AUDIO_CLIPS_TOTAL,
+                     CIRCUIT_BREAKER_SKIPS_TOTAL, FALSE_POSITIVES_TOTAL, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_TOTAL,
+                     STT_CALLS_AVOIDED_TOTAL, VOICE_STAGE_SECONDS, VOICE_STAGE_TIMEOUTS_TOTAL)
+from tracing import span, start_trace, write_trace
+from voice_backends import create_agent_backend, create_synthesizer, create_transcriber
+from profiling import PROFILE_MODES, PROFILE_SAMPLE_RATE, ProfileStore, RequestProfiler, profile_slots
+from audio_preprocessing import EndOfSpeechDetector, PreparedAudio, StreamingDecoder, prepare_for_transcription
+from deadlines import CircuitBreaker, Deadline, StageTimeout
+from tts_cache import TTSCache
+from autocomplete import Autocomplete
+from item_archive import archive_periodically, get_default_archive, restore_items
+from purchase_history import get_default_history
+from product_catalog import get_default_catalog
+from recategorize import recategorize
+from voice_intents import VOICE_ANSWER_CACHE, VoiceAnswerCache, read_only_intent
+from agent_history import (AGENT_SESSION_MAX_AGE_DAYS, HISTORY_SUMMARY_BATCH, HISTORY_TOKEN_BUDGET, HISTORY_TURNS,
+                           compact_storage, compact_storage_periodically, storage_stats)
+from local_network import (CERT_FILE, KEY_FILE, CertificateGeneration, get_local_ip, known_local_ip,
+                           start_local_ip_discovery)
+
 # Load environment variables
 load_dotenv()
 
@@ -34,129 +54,76 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = OpenAI()
-
-app = FastAPI(title="Smart Shopping List API with Voice")
-
-# SSL Certificate paths
-SSL_DIR = "ssl_certs"
-CERT_FILE = os.path.join(SSL_DIR, "cert.pem")
-KEY_FILE = os.path.join(SSL_DIR, "key.pem")
-
-
-def get_local_ip():
-    """Get the local IP address"""
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "localhost"
-
-
-def generate_ssl_certificate():
-    """Generate self-signed SSL certificate using Python cryptography library"""
-    os.makedirs(SSL_DIR, exist_ok=True)
+# Number of uvicorn worker processes; workers share list shards and change events on disk
+WORKERS = int(os.getenv("WORKERS", "1"))
 
-    if os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
-        logger.info("SSL certificates already exist")
-        return True
+# Interval of keep-alive comments on idle server-sent event streams
+SSE_KEEPALIVE_SECONDS = 15
 
-    try:
-        local_ip = get_local_ip()
-        logger.info(f"Generating SSL certificate for local IP: {local_ip}")
+# Token for the /admin endpoints and X-Profile requests; admin features are disabled without it
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-        # Generate private key
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
+# Limits of one /api/voice-stream command; the client stops recording after 10 seconds
+MAX_VOICE_STREAM_SECONDS = 12
+MAX_VOICE_STREAM_BYTES = 2 * 1024 * 1024
+VOICE_STREAM_DRAIN_SECONDS = 2  # Wait for the decoder to catch up after the client stops
 
-        # Create certificate subject
-        subject = issuer = x509.Name([
-            x509.NameAttribute(NameOID.COUNTRY_NAME, "IL"),
-            x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Local"),
-            x509.NameAttribute(NameOID.LOCALITY_NAME, "Local"),
-            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Smart Shopping List"),
-            x509.NameAttribute(NameOID.COMMON_NAME, local_ip),
-        ])
-
-        # Create certificate
-        cert = x509.CertificateBuilder().subject_name(
-            subject
-        ).issuer_name(
-            issuer
-        ).public_key(
-            private_key.public_key()
-        ).serial_number(
-            x509.random_serial_number()
-        ).not_valid_before(
-            datetime.datetime.utcnow()
-        ).not_valid_after(
-            # Certificate valid for 1 year
-            datetime.datetime.utcnow() + datetime.timedelta(days=365)
-        ).add_extension(
-            x509.SubjectAlternativeName([
-                x509.DNSName("localhost"),
-                x509.DNSName("*.local"),
-                x509.IPAddress(ip_address("127.0.0.1")),
-                x509.IPAddress(ip_address(local_ip)),
-            ]),
-            critical=False,
-        ).add_extension(
-            x509.KeyUsage(
-                digital_signature=True,
-                content_commitment=False,
-                key_encipherment=True,
-                data_encipherment=False,
-                key_agreement=False,
-                key_cert_sign=False,
-                crl_sign=False,
-                encipher_only=False,
-                decipher_only=False,
-            ),
-            critical=True,
-        ).add_extension(
-            x509.ExtendedKeyUsage([
-                x509.oid.ExtendedKeyUsageOID.SERVER_AUTH,
-            ]),
-            critical=True,
-        ).sign(private_key, hashes.SHA256())
-
-        # Write private key to file
-        with open(KEY_FILE, "wb") as f:
-            f.write(private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-
-        # Write certificate to file
-        with open(CERT_FILE, "wb") as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
-
-        logger.info("SSL certificate generated successfully using Python cryptography")
-        logger.info(f"Certificate: {CERT_FILE}")
-        logger.info(f"Private key: {KEY_FILE}")
-        logger.info(f"Valid for: localhost, *.local, 127.0.0.1, {local_ip}")
-        return True
+# Fixed voice answers synthesized at startup, so a degraded command is still answered with speech right away
+VOICE_ERROR_MESSAGE = "מצטער, לא הצלחתי לעבד את הפקודה. אנא נסה שוב."
+VOICE_TIMEOUT_MESSAGE = "מצטער, זה לוקח יותר מדי זמן. אנא נסה שוב."
+VOICE_DONE_MESSAGE = "בוצע, הפרטים מופיעים על המסך"
+FALLBACK_PHRASES = [VOICE_ERROR_MESSAGE, VOICE_TIMEOUT_MESSAGE, VOICE_DONE_MESSAGE]
 
-    except Exception as e:
-        logger.error(f"Error generating SSL certificate: {e}")
-        return False
+# Fixed replies of the keyword fallback
+EMPTY_LIST_REPLY = "רשימת הקניות ריקה כרגע"
+ALL_DONE_REPLY = "כל הפריטים ברשימה הושלמו"
+UNKNOWN_COMMAND_REPLY = "לא הבנתי את הפקודה. תוכל לומר 'הוסף' ושם הפריט, או 'תראה לי את הרשימה'"
 
+# Phrases synthesized into the TTS cache at startup; TTS_WARM_PHRASES adds more ("|"-separated)
+WARM_PHRASES = FALLBACK_PHRASES + [EMPTY_LIST_REPLY, ALL_DONE_REPLY, UNKNOWN_COMMAND_REPLY] + [
+    phrase.strip() for phrase in os.getenv("TTS_WARM_PHRASES", "").split("|") if phrase.strip()
+]
 
-def check_ssl_requirements():
-    """Check if SSL certificates exist or can be generated"""
-    if os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
-        return True
-
-    # Try to generate certificates
-    return generate_ssl_certificate()
-
+# Server-Timing metric each voice pipeline stage counts towards
+VOICE_STAGE_TIMINGS = {
+    "upload_read": "upload",
+    "preprocess": "vad",
+    "transcription": "stt",
+    "agent": "agent",
+    "tts": "tts",
+}
+
+# Endpoints whose responses are replayed to retries carrying the same Idempotency-Key
+IDEMPOTENT_PATHS = {
+    "/api/add-item",
+    "/api/toggle-item",
+    "/api/remove-item",
+    "/api/batch",
+    "/api/clear-list",
+    "/api/voice-command",
+    "/api/transcribe",
+    "/api/text-to-speech",
+}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run background tasks for the lifetime of the server"""
+    notifier_task = asyncio.create_task(change_notifier.run())
+    tts_connections_task = asyncio.create_task(synthesizer.keep_warm())
+    warmup_task = asyncio.create_task(synthesize_warm_phrases())
+    agent_storage_task = asyncio.create_task(compact_storage_periodically())
+    archive_task = asyncio.create_task(archive_periodically(list_store, item_archive, history=purchase_history))
+    yield
+    archive_task.cancel()
+    agent_storage_task.cancel()
+    warmup_task.cancel()
+    tts_connections_task.cancel()
+    notifier_task.cancel()
+    await synthesizer.close()
+
+
+app = FastAPI(title="Smart Shopping List API with Voice", lifespan=lifespan)
 
 # Data models
 class ShoppingItem(BaseModel):
@@ -169,7 +136,8 @@ class ShoppingItem(BaseModel):
 
 
 class AddItemRequest(BaseModel):
-    name: str
+    name: str = ""
+    barcode: Optional[str] = None  # Scanned barcode; the catalog supplies the name and category
     quantity: str = "1"
     tag: str = "אחר"  # Optional tag
 
@@ -185,6 +153,11 @@ class RemoveItemRequest(BaseModel):
 class ShoppingListResponse(BaseModel):
     items: List[ShoppingItem]
     last_modified: str
+    version: int = 0
+
+
+class RestoreItemsRequest(BaseModel):
+    item_ids: List[str]
 
 
 class TagStatsResponse(BaseModel):
@@ -197,6 +170,23 @@ class TextToSpeechRequest(BaseModel):
     text: str
 
 
+class BatchOperation(BaseModel):
+    op: Literal["add", "toggle", "remove", "update"]
+    item_id: Optional[str] = None  # toggle, remove, update
+    name: Optional[str] = None  # add
+    quantity: Optional[str] = None  # add, update
+    tag: Optional[str] = None  # add, update
+    completed: Optional[bool] = None  # toggle: set this state instead of flipping
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+
+# Upper bound on operations in one /api/batch request
+MAX_BATCH_OPERATIONS = 200
+
+
 # Predefined categories in Hebrew
 PREDEFINED_TAGS = [
     "חלב ומוצרי חלב",
@@ -214,45 +204,12 @@ PREDEFINED_TAGS = [
 ]
 
 
-def categorize_item_simple(item_name: str) -> str:
-    """Simple item categorization"""
-    item_lower = item_name.lower()
-
-    # Dairy products
-    if any(word in item_lower for word in ["חלב", "גבינה", "יוגורט", "קוטג", "חמאה", "שמנת"]):
-        return "חלב ומוצרי חלב"
-
-    # Fruits
-    elif any(word in item_lower for word in ["בננה", "תפוח", "תפוז", "ענב", "תות", "מלון", "אבטיח", "מנגו"]):
-        return "פירות"
-
-    # Vegetables
-    elif any(word in item_lower for word in ["עגבני", "מלפפון", "חסה", "גזר", "בצל", "פלפל", "ברוקולי"]):
-        return "ירקות"
-
-    # Bread and bakery
-    elif any(word in item_lower for word in ["לחם", "פיתה", "בגט", "חלה", "עוגה"]):
-        return "לחם ומאפים"
-
-    # Beverages
-    elif any(word in item_lower for word in ["מים", "מיץ", "קולה", "בירה", "יין", "קפה", "תה"]):
-        return "משקאות"
-
-    # Meat and fish
-    elif any(word in item_lower for word in ["בשר", "עוף", "דג", "נקניק", "קציצ", "טונה"]):
-        return "בשר ודגים"
-
-    else:
-        return "אחר"
-
-
 def auto_categorize_item(item_name: str) -> str:
     """Return default category - agent will handle intelligent categorization"""
     return categorize_item_simple(item_name)
 
 
 # File paths
-SHOPPING_LIST_FILE = "static2/shopping_list.json"
 STATIC_DIR = "static"
 AUDIO_DIR = "static2/audio"
 
@@ -260,6 +217,62 @@ AUDIO_DIR = "static2/audio"
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# Sharded storage shared with the agent toolkit (one shard per household list)
+list_store = get_default_store()
+
+# Fans every save out to push subscribers in this worker and, via SQLite, in all other workers
+change_notifier = ChangeNotifier(list_store, ChangeEventLog())
+
+# Product names and categories by barcode or name; the index file is mapped on first lookup
+product_catalog = get_default_catalog()
+
+# Bought items leave the lists for this archive after ARCHIVE_COMPLETED_AFTER_HOURS, keeping loads and polls small
+item_archive = get_default_archive()
+
+# Bought items leaving the lists (cleared or archived) are appended here; /api/suggestions reads its aggregates
+purchase_history = get_default_history()
+
+# Prefix indexes of each household's items, purchase history and the category lexicon for the add-item box
+autocomplete = Autocomplete(list_store, purchase_history, product_catalog)
+list_store.add_listener(change_notifier.on_list_saved)
+
+# Voice pipeline backends (OpenAI Whisper, the agno agent, edge-tts); STT_BACKEND/AGENT_BACKEND/TTS_BACKEND=stub
+# swap in offline stubs with fixed latency for load tests
+transcriber = create_transcriber()
+agent_backend = create_agent_backend(list_store)
+synthesizer = create_synthesizer()
+
+# The agent model and TTS service are skipped for a cool-down after repeated timeouts or errors; voice commands
+# are then answered by the keyword fallback and cached speech
+agent_circuit = CircuitBreaker("agent")
+tts_circuit = CircuitBreaker("tts")
+tts_cache = TTSCache()
+
+# Answers to read-only voice questions ("מה יש ברשימה") per list version; any save of the list drops them
+voice_answers = VoiceAnswerCache()
+list_store.add_listener(voice_answers.invalidate)
+
+# Recent responses of requests sent with an Idempotency-Key (per worker process)
+idempotency_cache = IdempotencyCache()
+
+# Ring of recent request profiles (shared by all workers)
+profile_store = ProfileStore()
+
+REGISTRY.gauge("shopping_lists_resident", "Shopping lists held in memory by this worker",
+               lambda: len(list_store.resident_ids()))
+REGISTRY.gauge("list_event_subscribers", "Open /api/events streams in this worker",
+               change_notifier.subscriber_count)
+REGISTRY.gauge("idempotency_cache_entries", "Responses kept for Idempotency-Key retries",
+               lambda: len(idempotency_cache))
+REGISTRY.gauge("tts_connections_idle", "Warm connections to the TTS service waiting for the next reply",
+               lambda: synthesizer.stats().get("idle", 0))
+REGISTRY.gauge("agent_circuit_open", "1 while the agent model is skipped after repeated failures",
+               lambda: int(agent_circuit.state == "open"))
+REGISTRY.gauge("tts_circuit_open", "1 while the TTS service is skipped after repeated failures",
+               lambda: int(tts_circuit.state == "open"))
+REGISTRY.gauge("voice_answer_cache_entries", "Answers to read-only voice questions kept for the current list version",
+               lambda: len(voice_answers))
+
 
 def ensure_static_files():
     """Ensure all required static files exist"""
@@ -276,43 +289,169 @@ def ensure_static_files():
 ensure_static_files()
 
 
-def load_shopping_list():
-    """Load shopping list from JSON file"""
+def get_list_id(list_id: str = Query(DEFAULT_LIST_ID, description="Household shopping list id")) -> str:
+    """Resolve and validate the list id of a request"""
     try:
-        if os.path.exists(SHOPPING_LIST_FILE):
-            with open(SHOPPING_LIST_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Ensure all items have tags
-                for item in data.get("items", []):
-                    if "tag" not in item:
-                        item["tag"] = auto_categorize_item(item.get("name", ""))
-                return data
-        else:
-            empty_list = {
-                "items": [],
-                "last_modified": datetime.now().isoformat()
-            }
-            save_shopping_list(empty_list)
-            return empty_list
-    except Exception as e:
-        logger.error(f"Error loading shopping list data: {e}")
-        return {
-            "items": [],
-            "last_modified": datetime.now().isoformat()
-        }
+        return validate_list_id(list_id)
+    except InvalidListIdError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-def save_shopping_list(data):
-    """Save shopping list to JSON file"""
+def get_expected_version(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """Parse the list version a mutation was based on from the If-Match header"""
+    if if_match is None or if_match.strip() == "*":
+        return None
     try:
-        data["last_modified"] = datetime.now().isoformat()
-        with open(SHOPPING_LIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info("Shopping list data saved successfully")
-        return True
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid If-Match header: {if_match}")
+
+
+def ensure_list_version(data, expected_version: Optional[int]):
+    """Reject a mutation with 409 if the list changed since the client's version"""
+    current_version = data.get("version", 0)
+    if expected_version is not None and expected_version != current_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Shopping list was modified (current version {current_version})",
+            headers={"ETag": list_etag(current_version)}
+        )
+
+
+def list_etag(version: int) -> str:
+    """Format a list version as an ETag"""
+    return f'"{version}"'
+
+
+def new_shopping_item(name: str, quantity: str = "1", tag: Optional[str] = "אחר") -> dict:
+    """Build a new list item, auto-categorizing it if no specific tag was chosen
+
+    A name found in the product catalog takes the catalog's spelling and,
+    unless a tag was chosen, its category.
+    """
+    product = product_catalog.by_name(name)
+    if product is not None:
+        name = product["name"]
+    if tag == "אחר" or not tag:
+        tag = product["category"] if product and product["category"] != "אחר" else categorize_item_simple(name)
+
+    return {
+        "id": str(uuid.uuid4()),
+        "name": name.strip(),
+        "quantity": (quantity or "1").strip(),
+        "completed": False,
+        "created_at": datetime.now().isoformat(),
+        "tag": tag
+    }
+
+
+def find_item_by_name(data, name: str) -> Optional[dict]:
+    """Find an item by name, ignoring case and surrounding whitespace"""
+    wanted = name.lower().strip()
+    for item in data["items"]:
+        if item["name"].lower().strip() == wanted:
+            return item
+    return None
+
+
+def record_purchases(list_id: str, items: List[dict]):
+    """Keep the bought items that left the list (or went back on it) in the purchase history
+
+    A failure only loses history, never the list change.
+    """
+    try:
+        purchase_history.record(list_id, items)
     except Exception as e:
-        logger.error(f"Error saving shopping list data: {e}")
-        return False
+        logger.warning(f"Could not record purchases of list {list_id}: {e}")
+
+
+def add_or_reuse_item(data, name: str, quantity: str = "1", tag: Optional[str] = "אחר",
+                      bought: Optional[List[dict]] = None):
+    """Add an item unless one with the same name is already on the list
+
+    Like the agent toolkit, an existing item is reused instead of duplicated,
+    so a retried add never adds the item twice. An existing item that was
+    already bought is put back on the list, and its purchase appended to
+    bought (to be recorded once the list is saved).
+
+    Returns:
+        (item, outcome) where outcome is "added", "restored" or "existing";
+        only "existing" leaves the list unchanged
+    """
+    existing_item = find_item_by_name(data, name)
+    if existing_item is None:
+        new_item = new_shopping_item(name, quantity, tag)
+        data["items"].append(new_item)
+        return new_item, "added"
+
+    if existing_item.get("completed", False):
+        if bought is not None:
+            bought.append(dict(existing_item))
+        set_item_completed(existing_item, False)
+        return existing_item, "restored"
+    return existing_item, "existing"
+
+
+def find_item(data, item_id: str) -> dict:
+    """Find an item by id or raise 404"""
+    for item in data["items"]:
+        if item["id"] == item_id:
+            return item
+    raise HTTPException(status_code=404, detail=f"Item not found: {item_id}")
+
+
+def remove_item_by_id(data, item_id: str, bought: Optional[List[dict]] = None) -> dict:
+    """Remove an item by id and return it, or raise 404; the item is appended to bought (kept if it was bought)"""
+    item = find_item(data, item_id)
+    if bought is not None:
+        bought.append(item)
+    data["items"] = [other for other in data["items"] if other["id"] != item_id]
+    return item
+
+
+def load_shopping_list(list_id: str = DEFAULT_LIST_ID):
+    """Load a household shopping list from its shard"""
+    data = list_store.load(list_id)
+    # Ensure all items have tags
+    for item in data.get("items", []):
+        if "tag" not in item:
+            item["tag"] = auto_categorize_item(item.get("name", ""))
+    return data
+
+
+def save_shopping_list(data, list_id: str = DEFAULT_LIST_ID):
+    """Save a household shopping list to its shard"""
+    if list_store.save(list_id, data):
+        logger.info(f"Shopping list {list_id} saved successfully")
+        return True
+    return False
+
+
+async def update_shopping_list(list_id: str, expected_version: Optional[int], change):
+    """Load a list under its lock, apply change(data, bought) and save it, in a worker thread
+
+    The list lock (a thread lock plus flock, possibly held by an agent
+    thread or another worker) and the shard write block, so they stay off
+    the event loop. change returns (result, changed); an unchanged list is
+    not saved. Items change appends to bought (leaving the list or going
+    back on it) are recorded as purchases once the save succeeded; the
+    ones not bought are skipped.
+
+    Returns:
+        (data, result, saved), saved being True for an unchanged list
+    """
+    def locked_update():
+        bought = []
+        with list_store.lock(list_id):
+            data = load_shopping_list(list_id)
+            ensure_list_version(data, expected_version)
+            result, changed = change(data, bought)
+            saved = save_shopping_list(data, list_id) if changed else True
+        if changed and saved and bought:
+            record_purchases(list_id, bought)
+        return data, result, saved
+
+    return await asyncio.to_thread(locked_update)
 
 
 # ============================================================================
@@ -390,6 +529,68 @@ def clean_text_for_tts(text: str) -> str:
 # SECURITY MIDDLEWARE
 # ============================================================================
 
+def is_admin_token(token: Optional[str]) -> bool:
+    """Check a token against ADMIN_TOKEN in constant time"""
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def request_admin_token(x_admin_token: Optional[str], authorization: Optional[str]) -> Optional[str]:
+    """Get the admin token from X-Admin-Token or an Authorization: Bearer header"""
+    if x_admin_token:
+        return x_admin_token
+    scheme, token = get_authorization_scheme_param(authorization)
+    return token if scheme.lower() == "bearer" else None
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None), authorization: Optional[str] = Header(None)):
+    """Allow a request only with the admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not is_admin_token(request_admin_token(x_admin_token, authorization)):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def requested_profile_mode(request: Request) -> Optional[str]:
+    """Decide whether to profile a request: an admin asked for it via X-Profile, or it was sampled"""
+    mode = request.headers.get("X-Profile")
+    if mode:
+        token = request_admin_token(request.headers.get("X-Admin-Token"), request.headers.get("Authorization"))
+        if is_admin_token(token):
+            return mode if mode in PROFILE_MODES else "sample"
+        return None
+
+    if PROFILE_SAMPLE_RATE > 0 and request.url.path.startswith("/api/") and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """Profile requests an admin asked for (X-Profile: sample|cprofile) or sampled by PROFILE_SAMPLE_RATE
+
+    The profile is written to the on-disk ring and named in the X-Profile-Id
+    response header; fetch it from /admin/profiles.
+    """
+    mode = requested_profile_mode(request)
+    if mode is None or not profile_slots.acquire(blocking=False):
+        return await call_next(request)
+
+    try:
+        profiler = RequestProfiler(mode)
+        profiler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.stop()
+
+        label = f"{request.method}-{request.url.path}-{int(profiler.duration * 1000)}ms"
+        name = await asyncio.to_thread(profiler.save, profile_store, label)
+        logger.info(f"Profiled {request.method} {request.url.path} ({profiler.mode}): {name}")
+        response.headers["X-Profile-Id"] = name
+        return response
+    finally:
+        profile_slots.release()
+
 @app.middleware("http")
 async def security_headers_middleware(request, call_next):
     """Add basic security headers"""
@@ -408,6 +609,197 @@ async def security_headers_middleware(request, call_next):
     return response
 
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Count requests and their duration per route for /metrics"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (e.g. /api/shopping-list/by-tag/{tag}) to keep the series bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS_TOTAL.inc(method=request.method, route=route_path, status=str(status))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route_path)
+
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    """Replay the original response to retries that carry the same Idempotency-Key
+
+    Fridges on flaky Wi-Fi retry requests whose response got lost; without
+    this a retried voice command would run STT, the agent and TTS again.
+    A retry that arrives while the original is still running waits for it.
+    Server errors are not remembered so they can be retried for real.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key or request.method != "POST" or request.url.path not in IDEMPOTENT_PATHS:
+        return await call_next(request)
+
+    if len(key) > MAX_KEY_LENGTH:
+        return JSONResponse(status_code=400, content={"detail": f"{IDEMPOTENCY_HEADER} is too long"})
+
+    # Keys are scoped to the endpoint and household list they were used with
+    cache_key = (request.url.path, request.query_params.get("list_id", DEFAULT_LIST_ID), key)
+    cached = await idempotency_cache.begin(cache_key)
+    if cached is not None:
+        logger.info(f"Replaying response for {request.url.path} with {IDEMPOTENCY_HEADER} {key}")
+        return replay_response(cached)
+
+    to_store = None
+    try:
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = [(name, value) for name, value in response.headers.items() if name != "content-length"]
+        if response.status_code < 500 and len(body) <= IDEMPOTENCY_MAX_BODY_BYTES:
+            to_store = CachedResponse(response.status_code, headers, body)
+        return Response(content=body, status_code=response.status_code, headers=dict(headers))
+    finally:
+        idempotency_cache.finish(cache_key, to_store)
+
+
+def replay_response(cached: CachedResponse) -> Response:
+    """Build a response from a remembered one"""
+    response = Response(content=cached.body, status_code=cached.status_code, headers=dict(cached.headers))
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """Add a Server-Timing breakdown to API responses and append the request's spans to the trace log
+
+    Storage, speech-to-text, agent, model and TTS time show up in the browser
+    devtools timing tab; set TRACE_LOG_FILE to keep full span trees for the
+    waterfall viewer (tools/trace_viewer.py).
+    """
+    # Event streams stay open indefinitely and have no meaningful total
+    if not request.url.path.startswith("/api/") or request.url.path == "/api/events":
+        return await call_next(request)
+
+    trace = start_trace(f"{request.method} {request.url.path}")
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        total_ms = (time.perf_counter() - trace.start) * 1000
+        response.headers["Server-Timing"] = trace.server_timing(total_ms)
+        return response
+    finally:
+        write_trace(trace, (time.perf_counter() - trace.start) * 1000, status)
+
+
+@contextmanager
+def voice_stage(endpoint: str, stage: str):
+    """Time a voice pipeline stage for /metrics and as a span of the request trace"""
+    with VOICE_STAGE_SECONDS.time(endpoint=endpoint, stage=stage), \
+            span(f"voice.{stage}", timing=VOICE_STAGE_TIMINGS.get(stage), endpoint=endpoint):
+        yield
+
+
+async def prepare_audio(endpoint: str, path: str) -> PreparedAudio:
+    """Trim silence from an upload before STT and count the bytes and calls it saved"""
+    with voice_stage(endpoint, "preprocess"):
+        audio = await prepare_for_transcription(path)
+
+    AUDIO_CLIPS_TOTAL.inc(endpoint=endpoint, outcome=audio.outcome)
+    AUDIO_BYTES_SAVED_TOTAL.inc(audio.bytes_saved, endpoint=endpoint)
+    if audio.silent:
+        STT_CALLS_AVOIDED_TOTAL.inc(endpoint=endpoint, reason="silence")
+    logger.info(f"Audio preprocessing: {audio.outcome}, {audio.original_bytes} -> {audio.output_bytes} bytes, "
+                f"{audio.speech_ms:.0f}ms speech in {audio.duration_ms:.0f}ms")
+    return audio
+
+
+async def remove_temp_files(*paths: Optional[str]):
+    """Delete the temporary files of an upload"""
+    paths = [path for path in dict.fromkeys(paths) if path and os.path.exists(path)]
+    if paths:
+        await asyncio.sleep(0.1)  # Small delay to ensure files are released (without blocking the event loop)
+    for path in paths:
+        try:
+            os.unlink(path)
+            logger.info(f"Cleaned up temporary file: {path}")
+        except Exception as cleanup_error:
+            logger.warning(f"Could not delete temporary file {path}: {cleanup_error}")
+            # File will be cleaned up by system temp cleanup eventually
+
+
+async def synthesize_warm_phrases():
+    """Put the fixed voice answers and common replies into the TTS cache once, in the background at startup"""
+    for phrase in WARM_PHRASES:
+        text = clean_text_for_tts(phrase)
+        if tts_cache.contains(text):
+            continue
+        try:
+            await tts_cache.synthesize(synthesizer, text)
+        except Exception as e:
+            # The service is likely unreachable; the phrases are synthesized on first use instead
+            logger.warning(f"Could not synthesize warm phrases: {e}")
+            return
+
+
+def cached_speech_url(phrase: str) -> Optional[str]:
+    """URL of a fixed answer's cached speech, or None if it was never synthesized"""
+    filename = tts_cache.get(clean_text_for_tts(phrase))
+    return tts_cache.url(filename) if filename else None
+
+
+async def speak(endpoint: str, text: str, deadline: Deadline, degraded: List[str],
+                cache: bool = False) -> Optional[str]:
+    """Synthesize an answer within the deadline and return its URL
+
+    Answers already in the TTS cache are reused; with cache the new speech is
+    added to it (for answers likely to be asked for again). When the TTS
+    service is too slow or its circuit is open, the cached "done" phrase is
+    played instead (the full answer is still shown on screen); None if even
+    that is missing.
+    """
+    cached = tts_cache.get(text)
+    if cached:
+        return tts_cache.url(cached)
+
+    if deadline.budget("tts") <= 0:
+        # The earlier stages used up the deadline; TTS was never tried, so nothing counts against its circuit
+        if "deadline" not in degraded:
+            degraded.append("deadline")
+        return cached_speech_url(VOICE_DONE_MESSAGE)
+
+    if not tts_circuit.allow():
+        CIRCUIT_BREAKER_SKIPS_TOTAL.inc(dependency="tts")
+        degraded.append("tts_circuit_open")
+        return cached_speech_url(VOICE_DONE_MESSAGE)
+
+    audio_filename = f"voice_response_{uuid.uuid4().hex[:8]}.mp3"
+    audio_path = os.path.join(AUDIO_DIR, audio_filename)
+    try:
+        with voice_stage(endpoint, "tts"):
+            if cache:
+                audio_url = tts_cache.url(await deadline.run("tts", tts_cache.synthesize(synthesizer, text)))
+            else:
+                await deadline.run("tts", synthesizer.synthesize(text, audio_path))
+                audio_url = f"/static/audio/{audio_filename}"
+        tts_circuit.record_success()
+        return audio_url
+    except StageTimeout as e:
+        logger.warning(f"TTS timed out ({e}), answering with cached speech")
+        VOICE_STAGE_TIMEOUTS_TOTAL.inc(stage="tts")
+        degraded.append("tts_timeout")
+    except Exception as e:
+        logger.error(f"Error generating TTS: {e}")
+        degraded.append("tts_error")
+    except BaseException:
+        # Cancelled with the request; a half-open trial must not stay pending
+        tts_circuit.release()
+        raise
+    tts_circuit.record_failure()
+    await remove_temp_files(audio_path)  # A cancelled synthesis may leave a partial file
+    return cached_speech_url(VOICE_DONE_MESSAGE)
+
+
 # ============================================================================
 # VOICE PROCESSING ENDPOINTS
 # ============================================================================
@@ -416,32 +808,39 @@ async def security_headers_middleware(request, call_next):
 async def transcribe_audio(file: UploadFile = File(...)):
     """Transcribe uploaded audio to Hebrew text using OpenAI Whisper"""
     temp_file_path = None
+    audio = None
+    request_start = time.perf_counter()
     try:
         logger.info(f"Received audio file: {file.filename}, content_type: {file.content_type}")
 
         # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.flush()
-            temp_file_path = temp_file.name
+        with voice_stage("transcribe", "upload_read"):
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
+                content = await file.read()
+                temp_file.write(content)
+                temp_file.flush()
+                temp_file_path = temp_file.name
 
-            logger.info(f"Temporary file created: {temp_file_path}, size: {len(content)} bytes")
+        logger.info(f"Temporary file created: {temp_file_path}, size: {len(content)} bytes")
+
+        audio = await prepare_audio("transcribe", temp_file_path)
+        if audio.silent:
+            return {
+                "success": True,
+                "transcription": "",
+                "message": "No speech detected",
+                "filtered": True
+            }
 
         # Transcribe using OpenAI Whisper (file is now closed)
-        with open(temp_file_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="he"  # Hebrew language
-            )
-
-        transcribed_text = transcription.text
+        with voice_stage("transcribe", "transcription"):
+            transcribed_text = await transcriber.transcribe(audio.path)
         logger.info(f"Transcription successful: {transcribed_text}")
 
         # Check for false positives
         if is_likely_false_positive(transcribed_text):
             logger.info(f"Filtered out false positive: {transcribed_text}")
+            FALSE_POSITIVES_TOTAL.inc(endpoint="transcribe")
             return {
                 "success": True,
                 "transcription": "",  # Return empty to indicate false positive
@@ -460,21 +859,14 @@ async def transcribe_audio(file: UploadFile = File(...)):
         logger.error(f"Error transcribing audio: {e}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
     finally:
-        # Clean up temp file with better error handling
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                import time
-                time.sleep(0.1)  # Small delay to ensure file is released
-                os.unlink(temp_file_path)
-                logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as cleanup_error:
-                logger.warning(f"Could not delete temporary file {temp_file_path}: {cleanup_error}")
-                # File will be cleaned up by system temp cleanup eventually
+        VOICE_STAGE_SECONDS.observe(time.perf_counter() - request_start, endpoint="transcribe", stage="total")
+        await remove_temp_files(temp_file_path, audio.path if audio else None)
 
 
 @app.post("/api/text-to-speech")
 async def text_to_speech(request: TextToSpeechRequest):
     """Convert Hebrew text to speech using edge-tts"""
+    request_start = time.perf_counter()
     try:
         text = request.text.strip()
         if not text:
@@ -484,22 +876,25 @@ async def text_to_speech(request: TextToSpeechRequest):
         clean_text = clean_text_for_tts(text)
         logger.info(f"Generating TTS for cleaned text: {clean_text}")
 
-        # Generate unique filename
-        audio_filename = f"response_{uuid.uuid4().hex[:8]}.mp3"
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
-
-        # Generate TTS using edge-tts with Hebrew voice
-        voice = "he-IL-HilaNeural"  # Female Hebrew voice
-        # Alternative: "he-IL-AvriNeural" for male voice
+        # Common phrases were synthesized at startup
+        cached = tts_cache.get(clean_text)
+        if cached:
+            audio_url = tts_cache.url(cached)
+        else:
+            # Generate unique filename
+            audio_filename = f"response_{uuid.uuid4().hex[:8]}.mp3"
+            audio_path = os.path.join(AUDIO_DIR, audio_filename)
 
-        communicate = edge_tts.Communicate(clean_text, voice)
-        await communicate.save(audio_path)
+            # Generate TTS using edge-tts with Hebrew voice
+            with voice_stage("text-to-speech", "tts"):
+                await synthesizer.synthesize(clean_text, audio_path)
 
-        logger.info(f"TTS generated successfully: {audio_filename}")
+            logger.info(f"TTS generated successfully: {audio_filename}")
+            audio_url = f"/static/audio/{audio_filename}"
 
         return {
             "success": True,
-            "audio_url": f"/static/audio/{audio_filename}",
+            "audio_url": audio_url,
             "text": clean_text,
             "original_text": text,
             "message": "TTS generated successfully"
@@ -508,122 +903,367 @@ async def text_to_speech(request: TextToSpeechRequest):
     except Exception as e:
         logger.error(f"Error generating TTS: {e}")
         raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
+    finally:
+        VOICE_STAGE_SECONDS.observe(time.perf_counter() - request_start, endpoint="text-to-speech", stage="total")
 
 
-@app.post("/api/voice-command")
-async def process_voice_command(file: UploadFile = File(...)):
-    """Process voice command end-to-end: STT -> Agent -> TTS"""
-    temp_file_path = None
-    try:
-        logger.info("Processing voice command...")
-
-        # Step 1: Transcribe audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.flush()
-            temp_file_path = temp_file.name
+async def run_voice_command(endpoint: str, audio: PreparedAudio, list_id: str, deadline: Deadline) -> dict:
+    """STT -> Agent -> TTS for a prepared clip, answered within the deadline
 
-            logger.info(f"Audio file size: {len(content)} bytes")
+    Silent clips never reach STT. A stage that exceeds its budget is cancelled
+    and replaced by its local fallback (keyword parser, cached speech); the
+    fallbacks used are listed in "degraded".
+    """
+    degraded = []
 
+    # Silent clips are answered like an empty transcription
+    transcribed_text = ""
+    if not audio.silent:
         # Transcribe using OpenAI Whisper (file is now closed)
-        with open(temp_file_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="he"
-            )
-
-        transcribed_text = transcription.text.strip()
-        logger.info(f"Voice command transcribed: {transcribed_text}")
-
-        if not transcribed_text:
+        try:
+            with voice_stage(endpoint, "transcription"):
+                transcribed_text = (await deadline.run("transcription", transcriber.transcribe(audio.path))).strip()
+        except StageTimeout as e:
+            # There is no local STT; tell the user right away instead of waiting
+            logger.warning(f"Transcription timed out ({e})")
+            VOICE_STAGE_TIMEOUTS_TOTAL.inc(stage="transcription")
             return {
                 "success": False,
-                "error": "לא הצלחתי לשמוע פקודה ברורה",
+                "error": str(e),
                 "transcription": "",
-                "response": "לא הצלחתי לשמוע פקודה ברורה. אנא נסה שוב."
+                "response": VOICE_TIMEOUT_MESSAGE,
+                "audio_url": cached_speech_url(VOICE_TIMEOUT_MESSAGE),
+                "degraded": ["transcription_timeout"]
             }
+        logger.info(f"Voice command transcribed: {transcribed_text}")
 
-        # Step 2: Process with shopping agent (simplified version for now)
-        agent_response = await process_shopping_command(transcribed_text)
-
-        # Step 3: Clean response for TTS (remove markdown formatting)
-        clean_response = clean_text_for_tts(agent_response)
-        logger.info(f"Cleaned response for TTS: {clean_response}")
-
-        # Step 4: Generate TTS response
-        audio_filename = f"voice_response_{uuid.uuid4().hex[:8]}.mp3"
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
-
-        voice = "he-IL-HilaNeural"
-        communicate = edge_tts.Communicate(clean_response, voice)
-        await communicate.save(audio_path)
-
-        logger.info("Voice command processed successfully")
+    if not transcribed_text:
+        if not audio.silent:
+            FALSE_POSITIVES_TOTAL.inc(endpoint=endpoint)
+        return {
+            "success": False,
+            "error": "לא הצלחתי לשמוע פקודה ברורה",
+            "transcription": "",
+            "response": "לא הצלחתי לשמוע פקודה ברורה. אנא נסה שוב."
+        }
 
+    # Read-only questions already answered at this list version skip the agent; their speech is in the TTS cache
+    intent = read_only_intent(transcribed_text) if VOICE_ANSWER_CACHE != "off" else None
+    version = await asyncio.to_thread(list_store.version, list_id) if intent else None
+    cached_answer = voice_answers.get(list_id, intent, version) if intent else None
+    if cached_answer is not None:
+        logger.info(f"Answering {intent!r} from the voice answer cache")
         return {
             "success": True,
             "transcription": transcribed_text,
-            "response": agent_response,
-            "audio_url": f"/static/audio/{audio_filename}"
+            "response": cached_answer,
+            "audio_url": await speak(endpoint, clean_text_for_tts(cached_answer), deadline, degraded, cache=True),
+            "degraded": degraded,
+            "cached": True
         }
 
-    except Exception as e:
-        logger.error(f"Error processing voice command: {e}")
-        error_message = "מצטער, לא הצלחתי לעבד את הפקודה. אנא נסה שוב."
+    # Step 2: Process with shopping agent (simplified version for now)
+    with voice_stage(endpoint, "agent"):
+        agent_response = await process_shopping_command(transcribed_text, list_id, deadline, degraded)
 
-        # Generate error TTS
-        try:
-            audio_filename = f"error_response_{uuid.uuid4().hex[:8]}.mp3"
-            audio_path = os.path.join(AUDIO_DIR, audio_filename)
-            voice = "he-IL-HilaNeural"
+    # Only the agent's own answer, given while the list stayed at the version it was asked about
+    if intent and not degraded and await asyncio.to_thread(list_store.version, list_id) == version:
+        voice_answers.put(list_id, intent, version, agent_response)
 
-            # Clean error message for TTS
-            clean_error_message = clean_text_for_tts(error_message)
-            communicate = edge_tts.Communicate(clean_error_message, voice)
-            await communicate.save(audio_path)
+    # Step 3: Clean response for TTS (remove markdown formatting)
+    clean_response = clean_text_for_tts(agent_response)
+    logger.info(f"Cleaned response for TTS: {clean_response}")
 
-            return {
-                "success": False,
-                "error": str(e),
-                "transcription": "",
-                "response": error_message,
-                "audio_url": f"/static/audio/{audio_filename}"
-            }
+    # Step 4: Generate TTS response
+    audio_url = await speak(endpoint, clean_response, deadline, degraded, cache=intent is not None)
+
+    logger.info(f"Voice command processed successfully{f' (degraded: {degraded})' if degraded else ''}")
+
+    return {
+        "success": True,
+        "transcription": transcribed_text,
+        "response": agent_response,
+        "audio_url": audio_url,
+        "degraded": degraded
+    }
+
+
+async def voice_command_error(error: Exception) -> dict:
+    """Spoken answer to a voice command that failed; raises if even the error TTS fails"""
+    logger.error(f"Error processing voice command: {error}")
+
+    # The error phrase is normally cached at startup; synthesize (and cache) it otherwise
+    audio_url = cached_speech_url(VOICE_ERROR_MESSAGE)
+    if audio_url is None:
+        audio_url = tts_cache.url(await tts_cache.synthesize(synthesizer, clean_text_for_tts(VOICE_ERROR_MESSAGE)))
+
+    return {
+        "success": False,
+        "error": str(error),
+        "transcription": "",
+        "response": VOICE_ERROR_MESSAGE,
+        "audio_url": audio_url
+    }
+
+
+@app.post("/api/voice-command")
+async def process_voice_command(file: UploadFile = File(...), list_id: str = Depends(get_list_id)):
+    """Process voice command end-to-end: STT -> Agent -> TTS"""
+    temp_file_path = None
+    audio = None
+    request_start = time.perf_counter()
+    deadline = Deadline()
+    try:
+        logger.info("Processing voice command...")
+
+        # Step 1: Transcribe audio
+        with voice_stage("voice-command", "upload_read"):
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
+                content = await file.read()
+                temp_file.write(content)
+                temp_file.flush()
+                temp_file_path = temp_file.name
+
+        logger.info(f"Audio file size: {len(content)} bytes")
+
+        audio = await prepare_audio("voice-command", temp_file_path)
+        return await run_voice_command("voice-command", audio, list_id, deadline)
+
+    except Exception as e:
+        try:
+            return await voice_command_error(e)
         except:
             raise HTTPException(status_code=500, detail=f"Voice command processing failed: {str(e)}")
     finally:
-        # Clean up temp file with better error handling
-        if temp_file_path and os.path.exists(temp_file_path):
+        VOICE_STAGE_SECONDS.observe(time.perf_counter() - request_start, endpoint="voice-command", stage="total")
+        await remove_temp_files(temp_file_path, audio.path if audio else None)
+
+
+class VoiceStream:
+    """Audio of one /api/voice-stream command, decoded and checked for end of speech while it arrives"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes_received = 0
+        self.detector = EndOfSpeechDetector()
+        self.decoder = StreamingDecoder() if StreamingDecoder.available() else None
+        self.decoding = False
+        # Whether the decoder got through all of the received audio (set by finish)
+        self.decoded_all = False
+        self._write_failed = False
+        self.speech_ended = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.decoder:
+            await self.decoder.start()
+            self.decoding = True
+            self._pump = asyncio.create_task(self._decode())
+
+    async def add(self, chunk: bytes):
+        self.bytes_received += len(chunk)
+        with open(self.path, "ab") as f:
+            f.write(chunk)
+        if self.decoding:
+            try:
+                await self.decoder.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                self.decoding = False  # Not decodable as it streams; the whole file is checked at the end
+                self._write_failed = True
+
+    async def _decode(self):
+        while True:
+            pcm = await self.decoder.read()
+            if not pcm:
+                return
+            if self.detector.feed(pcm):
+                self.speech_ended.set()
+
+    async def finish(self, drain: bool):
+        """Stop decoding; with drain, first wait for the audio still inside the decoder"""
+        if not self._pump:
+            return
+        if drain and self.decoding:
+            self.decoder.finish()
             try:
-                import time
-                time.sleep(0.1)  # Small delay to ensure file is released
-                os.unlink(temp_file_path)
-                logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as cleanup_error:
-                logger.warning(f"Could not delete temporary file {temp_file_path}: {cleanup_error}")
-                # File will be cleaned up by system temp cleanup eventually
+                await asyncio.wait_for(asyncio.shield(self._pump), VOICE_STREAM_DRAIN_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        # The pump only returns by itself at the decoder's end of output
+        reached_eof = self._pump.done() and not self._pump.cancelled() and self._pump.exception() is None
+        self.decoded_all = reached_eof and not self._write_failed
+        self._pump.cancel()
+        self._pump = None
+        self.decoding = False
+        await self.decoder.close()
+
+    async def prepare(self) -> PreparedAudio:
+        """Prepare the received audio for STT, reusing what was decoded while it streamed
+
+        The streamed audio is reused only if it holds the whole utterance:
+        the decoder got through everything received, or it heard the user
+        stop (what was still in the decoder comes after that). Otherwise the
+        whole file is decoded again, so the end of the command is not lost.
+        """
+        complete = self.decoded_all or self.speech_ended.is_set()
+        if self.detector.pcm and not complete:
+            logger.warning(f"Voice stream decoded only {self.detector.duration_ms}ms while streaming, "
+                           f"decoding the whole recording")
+        if self.detector.pcm and complete:
+            with voice_stage("voice-stream", "preprocess"):
+                audio = await prepare_for_transcription(self.path, bytes(self.detector.pcm), self.detector.levels)
+            AUDIO_CLIPS_TOTAL.inc(endpoint="voice-stream", outcome=audio.outcome)
+            AUDIO_BYTES_SAVED_TOTAL.inc(audio.bytes_saved, endpoint="voice-stream")
+            if audio.silent:
+                STT_CALLS_AVOIDED_TOTAL.inc(endpoint="voice-stream", reason="silence")
+            return audio
+        return await prepare_audio("voice-stream", self.path)
+
+
+@app.websocket("/api/voice-stream")
+async def voice_stream(websocket: WebSocket):
+    """Voice command streamed while the user speaks: STT starts as soon as the server hears them stop
+
+    The client sends MediaRecorder chunks as binary messages and {"type": "end"}
+    if the user stops recording. The server answers {"type": "end_of_speech"}
+    when it detects the end of the utterance (the client stops recording), then
+    {"type": "result", ...} with the same fields as /api/voice-command.
+    """
+    try:
+        list_id = validate_list_id(websocket.query_params.get("list_id", DEFAULT_LIST_ID))
+    except InvalidListIdError:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    trace = start_trace("WS /api/voice-stream")
+    stream_start = time.perf_counter()
+    temp_file_path = None
+    audio = None
+    stream = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
+            temp_file_path = temp_file.name
+        stream = VoiceStream(temp_file_path)
+        await stream.start()
+
+        reason = await receive_voice_stream(websocket, stream)
+        await stream.finish(drain=reason != "end_of_speech")
+        VOICE_STAGE_SECONDS.observe(time.perf_counter() - stream_start, endpoint="voice-stream", stage="capture")
+        logger.info(f"Voice stream finished ({reason}): {stream.bytes_received} bytes, "
+                    f"{stream.detector.duration_ms}ms decoded while streaming")
+        if reason == "end_of_speech":
+            await websocket.send_json({"type": "end_of_speech"})
+
+        # Everything from here on is what the user waits for after they stop speaking
+        command_start = time.perf_counter()
+        deadline = Deadline()
+        try:
+            audio = await stream.prepare()
+            result = await run_voice_command("voice-stream", audio, list_id, deadline)
+        except Exception as e:
+            result = await voice_command_error(e)
+        VOICE_STAGE_SECONDS.observe(time.perf_counter() - command_start, endpoint="voice-stream", stage="total")
+        await websocket.send_json({"type": "result", **result})
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        logger.info("Voice stream client disconnected")
+    except Exception as e:
+        logger.error(f"Error processing voice stream: {e}")
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        if stream:
+            await stream.finish(drain=False)
+        write_trace(trace, (time.perf_counter() - stream_start) * 1000, 101)
+        await remove_temp_files(temp_file_path, audio.path if audio else None)
 
 
-async def process_shopping_command(command: str) -> str:
-    """Process shopping command and return response"""
+async def receive_voice_stream(websocket: WebSocket, stream: VoiceStream) -> str:
+    """Receive audio chunks until the end of speech, the client's end message or a limit; return which"""
+    deadline = time.monotonic() + MAX_VOICE_STREAM_SECONDS
+    end_of_speech = asyncio.create_task(stream.speech_ended.wait())
     try:
-        # Import and use shopping agent
-        from shopping_agent import SmartShoppingAgent
-        agent = SmartShoppingAgent()
-        response = agent.process_voice_command(command)
+        while True:
+            receive = asyncio.create_task(websocket.receive())
+            done, _ = await asyncio.wait({receive, end_of_speech}, timeout=max(0.0, deadline - time.monotonic()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if receive not in done:
+                receive.cancel()
+                return "end_of_speech" if end_of_speech in done else "time_limit"
+
+            message = receive.result()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                await stream.add(message["bytes"])
+                if stream.bytes_received > MAX_VOICE_STREAM_BYTES:
+                    return "size_limit"
+            elif message.get("text") and json.loads(message["text"]).get("type") == "end":
+                return "client_end"
+    finally:
+        end_of_speech.cancel()
+
+
+async def process_shopping_command(command: str, list_id: str = DEFAULT_LIST_ID, deadline: Optional[Deadline] = None,
+                                   degraded: Optional[List[str]] = None) -> str:
+    """Process shopping command against a household list and return response
+
+    The agent gets its budget of the deadline; if it runs out, or the agent's
+    circuit is open after repeated failures, the keyword fallback answers.
+    Fallbacks used are appended to degraded.
+    """
+    if degraded is None:
+        degraded = []
+
+    if deadline and deadline.budget("agent") <= 0:
+        # Transcription used up the deadline; the agent was never tried, so nothing counts against its circuit
+        logger.warning("No time left for the shopping agent, using fallback processing")
+        AGENT_FALLBACKS_TOTAL.inc(reason="deadline")
+        if "deadline" not in degraded:
+            degraded.append("deadline")
+        return await fallback_command_processing(command, list_id)
+
+    if not agent_circuit.allow():
+        CIRCUIT_BREAKER_SKIPS_TOTAL.inc(dependency="agent")
+        AGENT_FALLBACKS_TOTAL.inc(reason="circuit_open")
+        degraded.append("agent_circuit_open")
+        return await fallback_command_processing(command, list_id)
+
+    try:
+        agent_run = agent_backend.run(command, list_id)
+        response = await (deadline.run("agent", agent_run) if deadline else agent_run)
+        agent_circuit.record_success()
         return response
     except ImportError:
         # Fallback processing if agent is not available
         logger.warning("Shopping agent not available, using fallback processing")
-        return await fallback_command_processing(command)
+        AGENT_FALLBACKS_TOTAL.inc(reason="agent_unavailable")
+        agent_circuit.record_success()  # Not a remote failure; never leave a half-open trial pending
+        return await fallback_command_processing(command, list_id)
+    except StageTimeout as e:
+        logger.warning(f"Shopping agent timed out ({e}), using fallback processing")
+        VOICE_STAGE_TIMEOUTS_TOTAL.inc(stage="agent")
+        AGENT_FALLBACKS_TOTAL.inc(reason="timeout")
+        agent_circuit.record_failure()
+        degraded.append("agent_timeout")
+        return await fallback_command_processing(command, list_id)
     except Exception as e:
         logger.error(f"Error with shopping agent: {e}")
-        return await fallback_command_processing(command)
+        AGENT_FALLBACKS_TOTAL.inc(reason="agent_error")
+        agent_circuit.record_failure()
+        degraded.append("agent_error")
+        return await fallback_command_processing(command, list_id)
+    except BaseException:
+        # Cancelled with the request; a half-open trial must not stay pending
+        agent_circuit.release()
+        raise
 
 
-async def fallback_command_processing(command: str) -> str:
+async def fallback_command_processing(command: str, list_id: str = DEFAULT_LIST_ID) -> str:
     """Fallback command processing without the full agent"""
     command_lower = command.lower()
 
@@ -635,19 +1275,16 @@ async def fallback_command_processing(command: str) -> str:
             item_name = item_name.replace(word, "").strip()
 
         if item_name:
-            # Add item to shopping list
-            data = load_shopping_list()
-            new_item = {
-                "id": str(uuid.uuid4()),
-                "name": item_name,
-                "quantity": "1",
-                "completed": False,
-                "created_at": datetime.now().isoformat(),
-                "tag": categorize_item_simple(item_name)
-            }
-            data["items"].append(new_item)
+            # Add item to shopping list; reuse an existing one, since an agent run cancelled for its
+            # deadline may still have added it
+            def add(data, bought):
+                new_item, outcome = add_or_reuse_item(data, item_name, "1", categorize_item_simple(item_name),
+                                                      bought)
+                return new_item, outcome != "existing"
+
+            _, new_item, saved = await update_shopping_list(list_id, None, add)
 
-            if save_shopping_list(data):
+            if saved:
                 return f"הוספתי {item_name} לרשימת הקניות בקטגוריה {new_item['tag']}"
             else:
                 return "מצטער, לא הצלחתי להוסיף את הפריט"
@@ -656,15 +1293,15 @@ async def fallback_command_processing(command: str) -> str:
 
     elif any(word in command_lower for word in ["רשימה", "מה יש", "תראה"]):
         # Show shopping list
-        data = load_shopping_list()
+        data = await asyncio.to_thread(load_shopping_list, list_id)
         items = data.get("items", [])
 
         if not items:
-            return "רשימת הקניות ריקה כרגע"
+            return EMPTY_LIST_REPLY
 
         pending_items = [item for item in items if not item.get("completed", False)]
         if not pending_items:
-            return "כל הפריטים ברשימה הושלמו"
+            return ALL_DONE_REPLY
 
         item_list = ", ".join([item["name"] for item in pending_items[:5]])
         if len(pending_items) > 5:
@@ -673,7 +1310,7 @@ async def fallback_command_processing(command: str) -> str:
             return f"יש לך {len(pending_items)} פריטים ברשימה: {item_list}"
 
     else:
-        return "לא הבנתי את הפקודה. תוכל לומר 'הוסף' ושם הפריט, או 'תראה לי את הרשימה'"
+        return UNKNOWN_COMMAND_REPLY
 
 
 # ============================================================================
@@ -715,17 +1352,113 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus-style metrics of this worker process"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List the request profiles in the ring, newest first"""
+    return {
+        "profiles": await asyncio.to_thread(profile_store.list),
+        "ring_size": profile_store.max_profiles,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+    }
+
+
+@app.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def download_profile(name: str):
+    """Download a profile (.collapsed for flame graph tools, .pstats for pstats/snakeviz)"""
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {name}")
+    return FileResponse(path, filename=name, media_type="application/octet-stream")
+
+
+@app.get("/admin/tts", dependencies=[Depends(require_admin)])
+async def tts_stats():
+    """Connection reuse of the TTS service, hits of the synthesized speech cache and of read-only voice answers"""
+    return {
+        "connections": synthesizer.stats(),
+        "cache": tts_cache.stats(),
+        "answers": voice_answers.stats(),
+        "circuit": tts_circuit.to_dict(),
+    }
+
+
+@app.get("/admin/agent-history", dependencies=[Depends(require_admin)])
+async def agent_history_stats():
+    """Size of the agent's session storage and the limits that keep its history bounded"""
+    return {
+        "storage": await asyncio.to_thread(storage_stats),
+        "history_turns": HISTORY_TURNS,
+        "history_token_budget": HISTORY_TOKEN_BUDGET,
+        "summary_batch": HISTORY_SUMMARY_BATCH,
+        "session_max_age_days": AGENT_SESSION_MAX_AGE_DAYS,
+    }
+
+
+@app.post("/admin/agent-history/compact", dependencies=[Depends(require_admin)])
+async def compact_agent_history():
+    """Delete old agent sessions and vacuum the storage now"""
+    return await asyncio.to_thread(compact_storage)
+
+
+@app.post("/admin/recategorize", dependencies=[Depends(require_admin)])
+async def recategorize_items(
+        list_id: Optional[List[str]] = Query(None, description="Only these lists (default all)"),
+        model: bool = Query(False, description="Categorize with one batched model request instead of keywords"),
+        dry_run: bool = False
+):
+    """Move items left under "אחר" to their categories across lists, one write per list, and report what moved"""
+    try:
+        list_ids = [validate_list_id(value) for value in list_id] if list_id else None
+    except InvalidListIdError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(recategorize, list_store, list_ids, model, dry_run)
+
+
 @app.get("/api/shopping-list", response_model=ShoppingListResponse)
-async def get_shopping_list():
-    """Get the current shopping list"""
+async def get_shopping_list(response: Response, list_id: str = Depends(get_list_id)):
+    """Get the current shopping list of a household"""
     try:
-        data = load_shopping_list()
+        data = await asyncio.to_thread(load_shopping_list, list_id)
+        response.headers["ETag"] = list_etag(data.get("version", 0))
         return ShoppingListResponse(**data)
     except Exception as e:
         logger.error(f"Error getting shopping list: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/api/events")
+async def stream_list_events(request: Request, list_id: str = Depends(get_list_id)):
+    """Push list changes to the browser as server-sent events"""
+    queue = change_notifier.subscribe(list_id)
+
+    async def event_stream():
+        try:
+            # Start with the current version so the client can tell if it missed anything
+            current = {"list_id": list_id, "version": await asyncio.to_thread(list_store.version, list_id)}
+            yield f"event: change\ndata: {json.dumps(current)}\n\n"
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                    yield f"event: change\ndata: {json.dumps(event)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            change_notifier.unsubscribe(list_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/api/tags")
 async def get_tags():
     """Get all available tags/categories"""
@@ -733,10 +1466,10 @@ async def get_tags():
 
 
 @app.get("/api/shopping-list/by-tag/{tag}")
-async def get_shopping_list_by_tag(tag: str):
+async def get_shopping_list_by_tag(tag: str, list_id: str = Depends(get_list_id)):
     """Get shopping list items filtered by tag"""
     try:
-        data = load_shopping_list()
+        data = await asyncio.to_thread(load_shopping_list, list_id)
         filtered_items = [item for item in data["items"] if item.get("tag", "אחר") == tag]
         return {
             "items": filtered_items,
@@ -750,10 +1483,10 @@ async def get_shopping_list_by_tag(tag: str):
 
 
 @app.get("/api/tag-stats")
-async def get_tag_stats():
+async def get_tag_stats(list_id: str = Depends(get_list_id)):
     """Get statistics for each tag"""
     try:
-        data = load_shopping_list()
+        data = await asyncio.to_thread(load_shopping_list, list_id)
         tag_stats = {}
 
         # Initialize all predefined tags
@@ -781,61 +1514,160 @@ async def get_tag_stats():
             if stats["count"] > 0
         ]
 
-        return {"tag_stats": stats}
+        return {"tag_stats": stats, "hot_items": len(data["items"]),
+                "archived_items": await asyncio.to_thread(item_archive.count, list_id)}
     except Exception as e:
         logger.error(f"Error getting tag stats: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@app.post("/api/add-item")
-async def add_item(request: AddItemRequest):
-    """Add a new item to the shopping list"""
+@app.get("/api/archive")
+async def get_archive(
+        list_id: str = Depends(get_list_id),
+        q: Optional[str] = Query(None, description="Only items whose name contains this text"),
+        tag: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=200),
+        offset: int = Query(0, ge=0)
+):
+    """Get archived (bought and moved off the list) items of a household, most recently bought first"""
     try:
-        data = load_shopping_list()
-
-        # Auto-categorize if no tag provided or tag is default
-        tag = request.tag
-        if tag == "אחר" or not tag:
-            tag = categorize_item_simple(request.name)
-
-        new_item = {
-            "id": str(uuid.uuid4()),
-            "name": request.name.strip(),
-            "quantity": request.quantity.strip(),
-            "completed": False,
-            "created_at": datetime.now().isoformat(),
-            "tag": tag
-        }
+        total, items = await asyncio.to_thread(item_archive.query, list_id, q, tag, limit, offset)
+        return {"items": items, "total": total, "limit": limit, "offset": offset}
+    except Exception as e:
+        logger.error(f"Error querying archive: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        data["items"].append(new_item)
 
-        if save_shopping_list(data):
-            logger.info(f"Added item: {request.name} with tag: {tag}")
-            return {"success": True, "message": "Item added successfully", "item": new_item}
+@app.post("/api/archive/restore")
+async def restore_archived_items(request: RestoreItemsRequest, response: Response,
+                                 list_id: str = Depends(get_list_id)):
+    """Put archived items back on the list as not bought yet"""
+    if not request.item_ids:
+        raise HTTPException(status_code=400, detail="No item ids given")
+
+    try:
+        items, version = await asyncio.to_thread(restore_items, list_store, item_archive, list_id,
+                                                 request.item_ids, purchase_history)
+    except Exception as e:
+        logger.error(f"Error restoring archived items: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    if version is None:
+        raise HTTPException(status_code=404, detail="No archived items with these ids")
+    logger.info(f"Restored {len(items)} archived items to list {list_id}")
+    response.headers["ETag"] = list_etag(version)
+    return {"success": True, "items": items, "version": version}
+
+
+@app.get("/api/suggestions")
+async def get_suggestions(list_id: str = Depends(get_list_id), limit: int = Query(10, ge=1, le=50)):
+    """Suggest items to add from the purchase history: due again, bought regularly, bought with what is listed
+
+    Items already on the list are left out. Answered from the history's
+    per-item and per-pair aggregates, whatever the length of the history.
+    """
+    try:
+        names = [item["name"] for item in (await asyncio.to_thread(load_shopping_list, list_id))["items"]]
+        return await asyncio.to_thread(purchase_history.suggestions, list_id, names, limit)
+    except Exception as e:
+        logger.error(f"Error getting suggestions: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/autocomplete")
+async def autocomplete_names(
+        list_id: str = Depends(get_list_id),
+        q: str = Query(..., min_length=1, max_length=64, description="What was typed so far"),
+        limit: int = Query(8, ge=1, le=20)
+):
+    """Suggest item names for the add-item box: names with a word starting with q, most bought first
+
+    Names on the list, bought before or in the category lexicon come
+    first; the product catalog fills in when they are too few.
+    """
+    try:
+        return {"q": q, "suggestions": await asyncio.to_thread(autocomplete.suggest, list_id, q, limit)}
+    except Exception as e:
+        logger.error(f"Error autocompleting {q!r}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get("/api/products")
+async def find_products(q: str = Query(..., min_length=1, description="Barcode or beginning of a product name"),
+                        limit: int = Query(10, ge=1, le=50)):
+    """Look up the product catalog by barcode or name prefix (canonical names and categories)"""
+    try:
+        return {"products": await asyncio.to_thread(product_catalog.lookup, q, limit)}
+    except Exception as e:
+        logger.error(f"Error looking up products: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/api/add-item")
+async def add_item(
+        request: AddItemRequest,
+        response: Response,
+        list_id: str = Depends(get_list_id),
+        expected_version: Optional[int] = Depends(get_expected_version)
+):
+    """Add a new item to the shopping list, by name or by scanned barcode"""
+    name, tag = request.name, request.tag
+    if request.barcode:
+        product = product_catalog.by_barcode(request.barcode)
+        if product is not None:
+            name = product["name"]
+            tag = product["category"] if tag == "אחר" else tag
+        elif not name.strip():
+            raise HTTPException(status_code=404, detail=f"Unknown barcode: {request.barcode}")
+    if not name.strip():
+        raise HTTPException(status_code=400, detail="Item name is required")
+
+    def add(data, bought):
+        item, outcome = add_or_reuse_item(data, name, request.quantity, tag, bought)
+        return (item, outcome), outcome != "existing"
+
+    try:
+        data, (item, outcome), saved = await update_shopping_list(list_id, expected_version, add)
+        if outcome == "existing":
+            logger.info(f"Item already on list {list_id}: {name}")
+            response.headers["ETag"] = list_etag(data.get("version", 0))
+            return {"success": True, "message": "Item already on the list", "item": item,
+                    "duplicate": True, "version": data.get("version", 0)}
+
+        if saved:
+            logger.info(f"Added item to list {list_id}: {name} with tag: {item['tag']} ({outcome})")
+            response.headers["ETag"] = list_etag(data["version"])
+            return {"success": True, "message": "Item added successfully", "item": item,
+                    "duplicate": outcome != "added", "version": data["version"]}
         else:
             raise HTTPException(status_code=500, detail="Failed to save shopping list")
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding item: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 @app.post("/api/toggle-item")
-async def toggle_item(request: ToggleItemRequest):
+async def toggle_item(
+        request: ToggleItemRequest,
+        response: Response,
+        list_id: str = Depends(get_list_id),
+        expected_version: Optional[int] = Depends(get_expected_version)
+):
     """Toggle the completed status of an item"""
-    try:
-        data = load_shopping_list()
+    def toggle(data, bought):
+        item = find_item(data, request.item_id)
+        set_item_completed(item, not item["completed"])
+        return item, True
 
-        for item in data["items"]:
-            if item["id"] == request.item_id:
-                item["completed"] = not item["completed"]
-                break
-        else:
-            raise HTTPException(status_code=404, detail="Item not found")
-
-        if save_shopping_list(data):
-            logger.info(f"Toggled item: {request.item_id}")
-            return {"success": True, "message": "Item toggled successfully"}
+    try:
+        data, _, saved = await update_shopping_list(list_id, expected_version, toggle)
+        if saved:
+            logger.info(f"Toggled item in list {list_id}: {request.item_id}")
+            response.headers["ETag"] = list_etag(data["version"])
+            return {"success": True, "message": "Item toggled successfully", "version": data["version"]}
         else:
             raise HTTPException(status_code=500, detail="Failed to save shopping list")
 
@@ -847,45 +1679,127 @@ async def toggle_item(request: ToggleItemRequest):
 
 
 @app.post("/api/remove-item")
-async def remove_item(request: RemoveItemRequest):
+async def remove_item(
+        request: RemoveItemRequest,
+        response: Response,
+        list_id: str = Depends(get_list_id),
+        expected_version: Optional[int] = Depends(get_expected_version)
+):
     """Remove an item from the shopping list"""
+    def remove(data, bought):
+        return remove_item_by_id(data, request.item_id, bought), True
+
     try:
-        data = load_shopping_list()
+        data, _, saved = await update_shopping_list(list_id, expected_version, remove)
+        if saved:
+            logger.info(f"Removed item from list {list_id}: {request.item_id}")
+            response.headers["ETag"] = list_etag(data["version"])
+            return {"success": True, "message": "Item removed successfully", "version": data["version"]}
+        else:
+            raise HTTPException(status_code=500, detail="Failed to save shopping list")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error removing item: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        original_length = len(data["items"])
-        data["items"] = [item for item in data["items"] if item["id"] != request.item_id]
 
-        if len(data["items"]) == original_length:
-            raise HTTPException(status_code=404, detail="Item not found")
+@app.post("/api/batch")
+async def apply_batch(
+        request: BatchRequest,
+        response: Response,
+        list_id: str = Depends(get_list_id),
+        expected_version: Optional[int] = Depends(get_expected_version)
+):
+    """Apply an ordered list of operations atomically with a single save and change event
+
+    Either every operation is applied or, if any of them fails, none is.
+    """
+    if not request.operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+    if len(request.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    def apply_all(data, bought):
+        results = []
+        for index, operation in enumerate(request.operations):
+            try:
+                results.append(apply_batch_operation(data, operation, bought))
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code,
+                                    detail=f"Operation {index} ({operation.op}) failed: {e.detail}")
+        return results, True
 
-        if save_shopping_list(data):
-            logger.info(f"Removed item: {request.item_id}")
-            return {"success": True, "message": "Item removed successfully"}
+    try:
+        data, results, saved = await update_shopping_list(list_id, expected_version, apply_all)
+        if saved:
+            logger.info(f"Applied batch of {len(request.operations)} operations to list {list_id}")
+            response.headers["ETag"] = list_etag(data["version"])
+            return {"success": True, "results": results, "version": data["version"]}
         else:
             raise HTTPException(status_code=500, detail="Failed to save shopping list")
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error removing item: {e}")
+        logger.error(f"Error applying batch: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def apply_batch_operation(data, operation: BatchOperation, bought: Optional[List[dict]] = None) -> dict:
+    """Apply one batch operation to loaded list data, appending the items it takes off or puts back to bought"""
+    if operation.op == "add":
+        if not operation.name or not operation.name.strip():
+            raise HTTPException(status_code=400, detail="name is required")
+        item, outcome = add_or_reuse_item(data, operation.name, operation.quantity, operation.tag,
+                                          bought)
+        return {"op": "add", "item": item, "duplicate": outcome != "added"}
+
+    if not operation.item_id:
+        raise HTTPException(status_code=400, detail="item_id is required")
+
+    if operation.op == "toggle":
+        item = find_item(data, operation.item_id)
+        set_item_completed(item, (not item["completed"]) if operation.completed is None else operation.completed)
+        return {"op": "toggle", "item_id": item["id"], "completed": item["completed"]}
+
+    if operation.op == "remove":
+        remove_item_by_id(data, operation.item_id, bought)
+        return {"op": "remove", "item_id": operation.item_id}
+
+    item = find_item(data, operation.item_id)
+    if operation.quantity is not None and operation.quantity.strip():
+        item["quantity"] = operation.quantity.strip()
+    if operation.tag:
+        item["tag"] = operation.tag
+    return {"op": "update", "item": item}
+
+
 @app.post("/api/clear-list")
-async def clear_list():
+async def clear_list(
+        response: Response,
+        list_id: str = Depends(get_list_id),
+        expected_version: Optional[int] = Depends(get_expected_version)
+):
     """Clear all items from the shopping list"""
-    try:
-        data = {
-            "items": [],
-            "last_modified": datetime.now().isoformat()
-        }
+    def clear(data, bought):
+        bought.extend(data["items"])
+        data.clear()
+        data.update(items=[], last_modified=datetime.now().isoformat())
+        return None, True
 
-        if save_shopping_list(data):
-            logger.info("Cleared shopping list")
-            return {"success": True, "message": "Shopping list cleared successfully"}
+    try:
+        data, _, saved = await update_shopping_list(list_id, expected_version, clear)
+        if saved:
+            logger.info(f"Cleared shopping list {list_id}")
+            response.headers["ETag"] = list_etag(data["version"])
+            return {"success": True, "message": "Shopping list cleared successfully", "version": data["version"]}
         else:
             raise HTTPException(status_code=500, detail="Failed to clear shopping list")
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error clearing list: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -900,15 +1814,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add trusted host middleware for basic protection
+class LocalNetworkHostMiddleware(TrustedHostMiddleware):
+    """TrustedHostMiddleware that also accepts the LAN address once background discovery has found it"""
+
+    async def __call__(self, scope, receive, send):
+        local_ip = known_local_ip()
+        if local_ip and local_ip not in self.allowed_hosts:
+            self.allowed_hosts.append(local_ip)
+        await super().__call__(scope, receive, send)
+
+
+# Add trusted host middleware for basic protection; the LAN address is discovered without blocking import
+start_local_ip_discovery()
 app.add_middleware(
-    TrustedHostMiddleware,
-    allowed_hosts=["localhost", "127.0.0.1", "*.local", get_local_ip()]
+    LocalNetworkHostMiddleware,
+    allowed_hosts=["localhost", "127.0.0.1", "*.local"]
 )
 
 if __name__ == "__main__":
+    # A missing certificate is generated while static files are checked and uvicorn is imported
+    certificate = CertificateGeneration()
+
     import uvicorn
 
+    # Multiple workers need an import string so each process can import the app
+    app_target = "server:app" if WORKERS > 1 else app
+    if WORKERS > 1:
+        logger.info(f"Starting {WORKERS} worker processes sharing {list_store.base_dir}")
+
     ensure_static_files()
 
     required_files = ["index.html", "styles.css", "scripts.js"]
@@ -923,7 +1856,7 @@ if __name__ == "__main__":
         logger.info("Server will start but some features may not work properly")
 
     # Check SSL requirements
-    use_ssl = check_ssl_requirements()
+    use_ssl = certificate.wait()
 
     if use_ssl:
         logger.info("Starting Smart Shopping List Server with HTTPS support...")
@@ -939,9 +1872,10 @@ if __name__ == "__main__":
 
         # Run with SSL
         uvicorn.run(
-            app,
+            app_target,
             host="0.0.0.0",
             port=8000,
+            workers=WORKERS,
             ssl_keyfile=KEY_FILE,
             ssl_certfile=CERT_FILE,
             ssl_version=ssl.PROTOCOL_TLSv1_2
@@ -955,4 +1889,4 @@ if __name__ == "__main__":
         logger.info(f"  http://{get_local_ip()}:8000")
 
         # Run without SSL
-        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+        uvicorn.run(app_target, host="0.0.0.0", port=8000, workers=WORKERS)
\ No newline at end of file
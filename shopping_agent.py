@@ -1,45 +1,76 @@
 import os
-from typing import Optional
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 from agno.storage.sqlite import SqliteStorage
+from agno.memory.v2.schema import SessionSummary
 from agno.utils.log import logger
-from shopping_tool import ShoppingListToolkit
+from agent_history import (AGENT_STORAGE_FILE, HISTORY_SUMMARY_BATCH, HISTORY_TURNS, MAX_PENDING_TURNS,
+                           agent_session_id, history_window, run_tokens, session_lock, shorten_turn,
+                           summarize_turns, turn_note)
+from shopping_tool import AGENT_TOOL_OUTPUT, ShoppingListToolkit
+from list_store import DEFAULT_LIST_ID, ShoppingListStore
+from deadlines import STAGE_BUDGETS
+from metrics import (AGENT_COMMAND_MODEL_CALLS, AGENT_COMMAND_TOKENS, AGENT_HISTORY_SUMMARIES_TOTAL,
+                     AGENT_HISTORY_TOKENS, AGENT_INPUT_TOKENS_TOTAL, AGENT_MODEL_CALL_SECONDS, AGENT_PROMPT_TOKENS,
+                     AGENT_TOOL_CALL_SECONDS)
+from tracing import record_span, span
+from agent_prompt import (AGENT_NAME, STATIC_PROMPT_SHA, STATIC_PROMPT_TOKENS, session_memory, system_prompt,
+                          tool_schema_tokens, voice_message)
+from prompt_tokens import count_tokens
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Voice commands carry a compact snapshot of the list when it fits LIST_CONTEXT_TOKEN_BUDGET, so questions
+# about the list are answered in one model call without a tool round-trip; auto | off
+LIST_CONTEXT_MODE = os.getenv("LIST_CONTEXT_MODE", "auto")
+
+
+def record_tool_call(function_name: str, function_call: Callable, arguments: Dict[str, Any]):
+    """Agent tool hook: time every toolkit call the model makes"""
+    start = time.perf_counter()
+    try:
+        with span(f"tool.{function_name}", timing="tools", arguments=arguments):
+            return function_call(**arguments)
+    finally:
+        AGENT_TOOL_CALL_SECONDS.observe(time.perf_counter() - start, tool=function_name)
+
 
 class SmartShoppingAgent:
     """Smart Shopping Agent for Samsung Smart Fridge with Hebrew voice command support and intelligent categorization"""
 
     def __init__(
             self,
-            shopping_list_file: str = "static/shopping_list.json",
-            storage_file: str = "tmp/shopping_agent.db",
+            list_id: str = DEFAULT_LIST_ID,
+            storage_file: str = AGENT_STORAGE_FILE,
             session_id: Optional[str] = None,
-            user_id: str = "family"
+            user_id: Optional[str] = None,
+            store: Optional[ShoppingListStore] = None
     ):
         """Initialize the Smart Shopping Agent
 
         Args:
-            shopping_list_file: Path to the shopping list JSON file
+            list_id: Household shopping list the agent operates on
             storage_file: Path to the SQLite storage file
-            session_id: Optional session ID for conversation continuity
-            user_id: User identifier for the agent
+            session_id: Optional session ID (defaults to the household's long-lived session)
+            user_id: User identifier for the agent (defaults to the household list id)
+            store: Shared list store (defaults to the process-wide store)
         """
+        user_id = user_id or list_id
+        session_id = session_id or agent_session_id(list_id)
 
         # Ensure directories exist
-        shopping_dir = os.path.dirname(shopping_list_file)
         storage_dir = os.path.dirname(storage_file)
-
-        if shopping_dir:
-            os.makedirs(shopping_dir, exist_ok=True)
         if storage_dir:
             os.makedirs(storage_dir, exist_ok=True)
 
         # Initialize the shopping toolkit
-        self.shopping_toolkit = ShoppingListToolkit(file_path=shopping_list_file)
+        self.list_id = list_id
+        self.shopping_toolkit = ShoppingListToolkit(list_id=list_id, store=store, output_format=AGENT_TOOL_OUTPUT)
 
         # Initialize storage
         self.storage = SqliteStorage(
@@ -47,105 +78,33 @@ class SmartShoppingAgent:
             db_file=storage_file
         )
 
-        # Create the agent with Hebrew instructions and smart categorization
+        # Create the agent with the Hebrew system prompt and smart categorization
         self.agent = Agent(
-            name="עוזר רשימת קניות חכם עם קטגוריות",
-            model=OpenAIChat(id="gpt-4.1-nano"),
+            name=AGENT_NAME,
+            # Bound each model round-trip by the agent's budget, so a run abandoned at the voice deadline ends soon
+            model=OpenAIChat(id="gpt-4.1-nano", timeout=STAGE_BUDGETS["agent"], max_retries=1),
             tools=[self.shopping_toolkit],
             storage=self.storage,
             session_id=session_id,
             user_id=user_id,
-            description="""
-            אתה עוזר רשימת קניות חכם למקרר סמסונג חכם עם יכולות קטגוריזציה מתקדמות. 
-            אתה מתמחה בניהול רשימות קניות למשפחות ישראליות, תומך בפקודות קול בעברית,
-            ומסוגל לקטלג מוצרים באופן חכם לקטגוריות מתאימות.
-            """,
-            instructions=[
-                "🏠 אתה עוזר המטבח החכם של המשפחה - ידידותי, מועיל ויעיל",
-                "🇮🇱 תמיד תגיב בעברית ותבין הקשר תרבותי ישראלי",
-                "🛒 התמחותך היא בניהול רשימות קניות חכמות ויעילות עם קטגוריזציה אוטומטית",
-
-                "📂 קטגוריות זמינות - חובה להכיר:",
-                "   • חלב ומוצרי חלב - חלב, גבינות (צהובה/לבנה/קוטג'/בולגרית), יוגורט, חמאה, שמנת",
-                "   • בשר ודגים - בשר בקר, עוף, כבש, דגים, נקניקים, קציצות, טונה",
-                "   • ירקות - עגבניות, מלפפון, חסה, גזר, בצל, פלפל, ברוקולי, תפוח אדמה",
-                "   • פירות - תפוחים, בננות, תפוזים, ענבים, תותים, מלון, אבטיח",
-                "   • לחם ומאפים - לחם, פיתה, בגט, חלה, עוגות, מאפים, עוגיות אפייה",
-                "   • משקאות - מים, מיץ, קולה, בירה, יין, קפה, תה, משקאות קלים",
-                "   • חטיפים וממתקים - שוקולד, עוגיות, חטיפים, גלידה, סוכריות, דוריטוס, במבה",
-                "   • מוצרי בית - נייר טואלט, סבון, שמפו, חומרי ניקוי, מגבות",
-                "   • קפואים - פיצה קפואה, ירקות קפואים, דגים קפואים, גלידה",
-                "   • תבלינים ורטבים - מלח, פלפל, קטשופ, מיונז, חרדל, שמן, חומץ, רטבים",
-                "   • דגנים וקטניות - אורז, פסטה, קמח, שעועית, עדשים, פתיתי שיבולת שועל",
-                "   • אחר - רק למוצרים שאי אפשר לקטלג אחרת",
-
-                "🧠 חובה! תהליך הוספת פריט:",
-                "   1. קרא את שם המוצר בקפידה",
-                "   2. נתח: מיונז = רטב → תבלינים ורטבים",
-                "   3. נתח: דוריטוס = חטיף → חטיפים וממתקים",
-                "   4. נתח: גבינה צהובה = מוצר חלב → חלב ומוצרי חלב",
-                "   5. קרא בקול רם לעצמך: 'זה מוצר מסוג X, אז הקטגוריה היא Y'",
-                "   6. השתמש ב-add_item_with_smart_category עם suggested_category שקבעת",
-                "   7. לעולם אל תשתמש ב'אחר' אלא אם באמת אין ברירה",
-
-                "⚡ דוגמאות חובה לזכור:",
-                "   • מיונז, קטשופ, חרדל → תבלינים ורטבים",
-                "   • דוריטוס, במבה, ביסלי → חטיפים וממתקים",
-                "   • גבינה (כל סוג), חלב, יוגורט → חלב ומוצרי חלב",
-                "   • עגבניות, מלפפון, גזר → ירקות",
-                "   • בננות, תפוחים, תפוזים → פירות",
-                "   • לחם, פיתה, בגט → לחם ומאפים",
-                "   • קולה, מיץ, בירה → משקאות",
-
-                "⚡ פקודות זמינות:",
-                "   • add_item_with_smart_category - הוספת פריט עם קטגוריה חכמה (חובה!)",
-                "   • get_shopping_list - הצגת הרשימה מקובצת לפי קטגוריות",
-                "   • get_items_by_category - הצגת פריטים בקטגוריה ספציפית",
-                "   • get_category_statistics - סטטיסטיקות לפי קטגוריות",
-                "   • update_item_category - עדכון קטגוריה של פריט קיים",
-                "   • mark_item_completed/remove_item_by_name - ניהול פריטים",
-
-                "💡 התנהגות חכמה:",
-                "   • תמיד נתח מוצרים ישראליים נפוצים נכון",
-                "   • הכר שמות מותגים ישראליים (תנובה, שטראוס, עלית וכו')",
-                "   • התחשב בהקשר (למשל: 'מיץ תפוזים' → משקאות)",
-                "   • כשבספק, בחר בקטגוריה הכי הגיונית, לא 'אחר'",
-
-                # ============================================================================
-                # VOICE RESPONSE RULES - NEW AND IMPORTANT!
-                # ============================================================================
-                "🎤 חוקי תגובה קולית - חובה לקרוא!",
-                "   • תגיב תמיד קצר ולעניין - מקסימום 10 מילים",
-                "   • אל תשתמש באמוג'ים בכלל - הם נשמעים כמו שטויות בדיבור",
-                "   • אל תסביר למה בחרת בקטגוריה - פשוט תוסיף",
-                "   • אל תציע דברים נוספים - עשה רק מה שביקשו",
-                "   • פורמט מושלם: 'הוספתי [פריט] לקטגוריה [קטגוריה]'",
-                "   • אם זה שאלה: תן תשובה של מקסימום 5 מילים",
-
-                "🎯 דוגמאות תגובות מושלמות:",
-                "   • User: 'תוסיף חלב' → You: 'הוספתי חלב לחלב ומוצרי חלב'",
-                "   • User: 'תוסיף מלון' → You: 'הוספתי מלון לפירות'",
-                "   • User: 'מה יש לי ברשימה' → You: 'יש לך 5 פריטים ברשימה'",
-                "   • User: 'תוסיף מיונז' → You: 'הוספתי מיונז לתבלינים ורטבים'",
-
-                "❌ דוגמאות תגובות גרועות (אל תעשה):",
-                "   • 'מלון הוא פרי ולכן הקטגוריה המתאימה היא פירות. אוסיף...' ❌",
-                "   • 'הוספתי את הפריט מלון לרשימת הקניות תחת הקטגוריה פירות 🍉📋' ❌",
-                "   • 'אם יש עוד משהו שתרצה להוסיף, אני כאן!' ❌",
-
-                "🔄 תמיד עדכן את המשתמש על פעולות שבוצעו בהצלחה עם פרטי הקטגוריה",
-                "❓ אם לא בטוח בקטגוריה, תשאל הבהרות במקום לשים ב'אחר'",
-                "📱 תהיה מהיר ויעיל - זה מקרר חכם במטבח עסוק!",
-                "🎤 כשמקבל פקודות קול, פרש אותן בצורה חכמה עם קטגוריזציה נכונה",
-                "🗣️ זכור: אנשים שומעים אותך, לא רואים - דבר קצר וברור!"
-            ],
+            # Built once per process and identical for every household and command, so the provider's
+            # prompt cache serves it; the session memory follows it and the command comes last
+            system_message=system_prompt,
             show_tool_calls=False,  # Hide tool calls for cleaner voice experience
             markdown=False,  # Disable markdown for voice
-            read_chat_history=True,
+            # Replay only the last turns (trimmed to HISTORY_TOKEN_BUDGET after every run) plus the
+            # session memory older turns are summarized into, instead of a tool reading the whole history
+            add_history_to_messages=True,
+            num_history_runs=HISTORY_TURNS,
+            add_session_summary_references=True,
             add_datetime_to_instructions=False,  # Remove datetime for voice
+            tool_hooks=[record_tool_call],
         )
 
-        logger.info(f"Smart Shopping Agent with categorization initialized for user: {user_id}")
+        # Model calls and tokens of the last chat() run, for benchmarks
+        self.last_run_stats: Dict[str, Any] = {}
+
+        logger.info(f"Smart Shopping Agent with categorization initialized for list {list_id}, user: {user_id}")
 
 
 
@@ -158,22 +117,131 @@ class SmartShoppingAgent:
         # through its instructions and context understanding
         return "אחר"  # Default, agent will override this
 
-    def chat(self, message: str) -> str:
+    def chat(self, message: str, list_context: str = "none", history_text: Optional[str] = None,
+             raise_errors: bool = False) -> str:
         """Send a message to the shopping agent and get response
 
         Args:
             message: User message in Hebrew or English
+            list_context: Whether the message carries a list snapshot ("snapshot" or "none"), for metrics
+            history_text: What to keep of the message in the history (defaults to the whole message)
+            raise_errors: Raise agent and model errors instead of answering with the error text
 
         Returns:
             Agent's response
         """
         try:
-            response = self.agent.run(message)
+            with session_lock(self.agent.session_id):
+                response = self.agent.run(message)
+                # Before the history is trimmed, which shortens this run's message
+                self._record_model_calls(response, list_context, message)
+                summary_due = self._trim_history(history_text)
+            if summary_due:
+                # Off the reply's path; the next command of the household waits for the session lock
+                threading.Thread(target=self.summarize_history, daemon=True).start()
             return response.content if response else "מצטער, לא הצלחתי לעבד את הבקשה"
         except Exception as e:
             logger.error(f"Error in agent chat: {e}")
+            if raise_errors:
+                raise
             return f"שגיאה: {str(e)}"
 
+    def _trim_history(self, history_text: Optional[str] = None) -> bool:
+        """Keep only the replay window of the session's runs and note the turns that left it
+
+        Returns whether enough noted turns wait to be summarized.
+        """
+        session_id = self.agent.session_id
+        runs = (self.agent.memory.runs or {}).get(session_id) or []
+        if not runs:
+            return False
+        if history_text:
+            shorten_turn(runs[-1], history_text)
+
+        keep = history_window(runs)
+        dropped, self.agent.memory.runs[session_id] = runs[:len(runs) - keep], runs[len(runs) - keep:]
+        AGENT_HISTORY_TOKENS.observe(sum(run_tokens(run) for run in runs[len(runs) - keep:]))
+        if self.agent.session_state is None:
+            self.agent.session_state = {}
+        pending = self.agent.session_state.setdefault("history_pending", [])
+        pending.extend(turn_note(run) for run in dropped)
+        del pending[:-MAX_PENDING_TURNS]
+
+        self.agent.write_to_storage(session_id=session_id, user_id=self.agent.user_id)
+        return len(pending) >= HISTORY_SUMMARY_BATCH
+
+    def summarize_history(self):
+        """Fold the turns that left the replay window into the session memory the agent gets in its prompt"""
+        session_id = self.agent.session_id
+        user_id = self.agent.user_id or "default"
+        with session_lock(session_id):
+            # Reload: other commands may have run since this agent's turn
+            self.agent.read_from_storage(session_id=session_id)
+            pending = (self.agent.session_state or {}).get("history_pending") or []
+            if len(pending) < HISTORY_SUMMARY_BATCH:
+                return
+            summaries = self.agent.memory.summaries.setdefault(user_id, {})
+            previous = summaries.get(session_id)
+            try:
+                summary = summarize_turns(self.agent.model, previous.summary if previous else None, pending)
+            except Exception as e:
+                AGENT_HISTORY_SUMMARIES_TOTAL.inc(result="error")
+                logger.warning(f"Could not summarize agent history: {e}")
+                return
+            summaries[session_id] = SessionSummary(summary=summary, last_updated=datetime.now())
+            self.agent.session_state["history_pending"] = []
+            self.agent.write_to_storage(session_id=session_id, user_id=self.agent.user_id)
+            AGENT_HISTORY_SUMMARIES_TOTAL.inc(result="ok")
+
+    def _record_model_calls(self, response, list_context: str = "none", request: Optional[str] = None):
+        """Record every model round-trip of a run (for /metrics and the request trace) and its token totals
+
+        The first round-trip also records how its prompt splits into the
+        static part (system prompt and tool schemas, served from the
+        provider's prompt cache once warm) and the parts that vary:
+        session memory, replayed history and the request message.
+        """
+        messages = getattr(response, "messages", None) or []
+        layout = {
+            "static": STATIC_PROMPT_TOKENS + tool_schema_tokens(getattr(self.agent, "_tools_for_model", None)),
+            "memory": count_tokens(session_memory(self.agent) or ""),
+            "history": sum(count_tokens(str(m.content or "")) for m in messages if getattr(m, "from_history", False)),
+            "request": count_tokens(request or ""),
+        }
+
+        calls = input_tokens = output_tokens = cached_tokens = 0
+        for message in messages:
+            if message.role != "assistant" or getattr(message, "from_history", False):
+                continue
+            calls += 1
+            if message.metrics is not None:
+                input_tokens += message.metrics.input_tokens or 0
+                output_tokens += message.metrics.output_tokens or 0
+                cached_tokens += message.metrics.cached_tokens or 0
+            if message.metrics is not None and message.metrics.time is not None:
+                AGENT_MODEL_CALL_SECONDS.observe(message.metrics.time)
+                timer = message.metrics.timer
+                if timer is not None and timer.start_time is not None and timer.end_time is not None:
+                    split = {f"prompt_{part}_tokens": tokens for part, tokens in layout.items()} if calls == 1 else {}
+                    record_span("model.response", timer.start_time, timer.end_time, timing="model",
+                                input_tokens=message.metrics.input_tokens,
+                                output_tokens=message.metrics.output_tokens,
+                                cached_tokens=message.metrics.cached_tokens,
+                                **(dict(split, prompt_sha=STATIC_PROMPT_SHA) if split else {}))
+
+        self.last_run_stats = {"list_context": list_context, "model_calls": calls,
+                               "input_tokens": input_tokens, "output_tokens": output_tokens,
+                               "cached_tokens": cached_tokens, "prompt_sha": STATIC_PROMPT_SHA,
+                               "prompt_tokens": layout}
+        if calls:
+            AGENT_COMMAND_MODEL_CALLS.observe(calls, list_context=list_context)
+            AGENT_COMMAND_TOKENS.observe(input_tokens, list_context=list_context, direction="input")
+            AGENT_COMMAND_TOKENS.observe(output_tokens, list_context=list_context, direction="output")
+            for part, tokens in layout.items():
+                AGENT_PROMPT_TOKENS.observe(tokens, part=part)
+            AGENT_INPUT_TOKENS_TOTAL.inc(cached_tokens, cache="hit")
+            AGENT_INPUT_TOKENS_TOTAL.inc(max(0, input_tokens - cached_tokens), cache="miss")
+
     def print_response(self, message: str, stream: bool = True):
         """Print agent response to console
 
@@ -187,19 +255,27 @@ class SmartShoppingAgent:
             logger.error(f"Error printing response: {e}")
             print(f"שגיאה: {str(e)}")
 
-    def process_voice_command(self, voice_text: str) -> str:
-        """Process voice command with enhanced context for Hebrew voice input"""
-        # Add context that this is a voice command for better processing
-        voice_context = f"""
-        פקודת קול בעברית: "{voice_text}"
+    def process_voice_command(self, voice_text: str, list_context: Optional[str] = None,
+                              raise_errors: bool = False) -> str:
+        """Process voice command with enhanced context for Hebrew voice input
 
-        חשוב: זו פקודה קולית! תגיב קצר ולעניין בלי אמוג'ים.
-        אם זה בקשה להוספת פריט - הוסף אותו ותגיב במשפט קצר.
-        אם זה שאלה - תן תשובה קצרה.
-        מקסימום 10 מילים בתגובה!
+        Args:
+            voice_text: Transcribed command
+            list_context: "auto" to include a snapshot of the list when it fits its token budget,
+                "off" to let the agent read the list through its tools (defaults to LIST_CONTEXT_MODE)
+            raise_errors: Raise agent and model errors instead of answering with the error text
         """
-
-        return self.chat(voice_context)
+        # The voice rules are in the static system prompt; only the command and the snapshot vary
+        snapshot = None
+        if (list_context or LIST_CONTEXT_MODE) != "off":
+            snapshot = self.shopping_toolkit.get_list_snapshot()
+
+        # The history keeps the spoken command only, not the snapshot
+        history_text = voice_message(voice_text)
+        if snapshot is None:
+            return self.chat(history_text, history_text=history_text, raise_errors=raise_errors)
+        return self.chat(voice_message(voice_text, snapshot), list_context="snapshot", history_text=history_text,
+                         raise_errors=raise_errors)
 
     def get_session_id(self) -> str:
         """Get the current session ID"""
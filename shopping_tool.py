@@ -1,36 +1,90 @@
-import json
+import functools
 import os
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 import uuid
 from agno.tools import Toolkit
 from agno.utils.log import logger
+from list_store import (CATEGORIES, DEFAULT_LIST_ID, ShoppingListStore, get_default_store, set_item_completed,
+                        validate_list_id)
+from prompt_tokens import count_tokens
+
+# Largest list snapshot, in tokens, the agent puts into a voice command's prompt
+LIST_CONTEXT_TOKEN_BUDGET = int(os.getenv("LIST_CONTEXT_TOKEN_BUDGET", "600"))
+
+# Output of the list-reading tools: "human" prose with emojis for people, "compact" terse lines for the agent
+OUTPUT_FORMATS = ("human", "compact")
+
+# Format of the list-reading tools when the agent calls them; compact costs far fewer tokens
+AGENT_TOOL_OUTPUT = os.getenv("AGENT_TOOL_OUTPUT", "compact")
+
+# Items listed by a compact tool answer; the rest is only counted
+COMPACT_MAX_ITEMS = int(os.getenv("COMPACT_MAX_ITEMS", "60"))
+
+
+def compact_entry(item: Dict) -> str:
+    """An item as "name ×quantity", quantity omitted when 1 and "✓" when already bought"""
+    quantity = str(item.get("quantity", "1")).strip()
+    entry = item["name"] + (f" ×{quantity}" if quantity not in ("", "1") else "")
+    return entry + " ✓" if item.get("completed", False) else entry
+
+
+def compact_lines(items: List[Dict], max_items: Optional[int] = None) -> List[str]:
+    """One "category: entries" line per category; past max_items (pending first) only a count of the rest"""
+    shown = items
+    if max_items is not None and len(items) > max_items:
+        shown = sorted(items, key=lambda item: item.get("completed", False))[:max_items]
+
+    categories: Dict[str, List[str]] = {}
+    for item in shown:
+        categories.setdefault(item.get("tag", "אחר"), []).append(compact_entry(item))
+
+    lines = [f"{category}: {', '.join(entries)}" for category, entries in categories.items()]
+    if len(shown) < len(items):
+        lines.append(f"(+{len(items) - len(shown)} נוספים לא מוצגים)")
+    return lines
+
+
+def with_list_lock(method):
+    """Run a toolkit method while holding the lock of the toolkit's list"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.store.lock(self.list_id):
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class ShoppingListToolkit(Toolkit):
     """Agno toolkit for managing smart shopping lists with category tags and real-time synchronization"""
 
-    def __init__(self, file_path: str = "static/shopping_list.json"):
+    def __init__(self, list_id: str = DEFAULT_LIST_ID, store: Optional[ShoppingListStore] = None,
+                 output_format: str = "human", archive=None, history=None, catalog=None):
+        """Initialize the toolkit
+
+        Args:
+            list_id: Household shopping list the tools operate on
+            store: Shared list store (defaults to the process-wide store)
+            output_format: "human" for readable prose, "compact" for terse lines that cost the agent's
+                model fewer tokens (get_shopping_list, get_items_by_category, search_items and the statistics)
+            archive: Archive of bought items moved off the list (defaults to the process-wide archive)
+            history: Purchase history that cleared bought items are recorded in (defaults to the process-wide one)
+            catalog: Product catalog for canonical names and categories (defaults to the process-wide one)
+        """
         super().__init__(name="shopping_list_toolkit")
-        self.file_path = file_path
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.list_id = validate_list_id(list_id)
+        self.store = store or get_default_store()
+        self.output_format = output_format
+        self._archive = archive
+        self._history = history
+        self._catalog = catalog
 
         # Available categories for smart categorization
-        self.available_categories = [
-            "חלב ומוצרי חלב",
-            "בשר ודגים",
-            "ירקות",
-            "פירות",
-            "לחם ומאפים",
-            "משקאות",
-            "חטיפים וממתקים",
-            "מוצרי בית",
-            "קפואים",
-            "תבלינים ורטבים",
-            "דגנים וקטניות",
-            "אחר"
-        ]
-
-        self.ensure_file_exists()
+        self.available_categories = list(CATEGORIES)
+
         self.register(self.add_item)
         self.register(self.add_item_with_smart_category)
         self.register(self.clear_completed_items)
@@ -39,34 +93,22 @@ class ShoppingListToolkit(Toolkit):
         self.register(self.get_items_by_category)
         self.register(self.mark_item_completed)
         self.register(self.get_shopping_stats)
+        self.register(self.get_purchase_suggestions)
+        self.register(self.find_products)
         self.register(self.remove_item_by_name)
         self.register(self.search_items)
         self.register(self.update_item_category)
         self.register(self.update_item_quantity)
 
-    def ensure_file_exists(self):
-        """Ensure the shopping list file exists"""
-        if not os.path.exists(self.file_path):
-            dir_path = os.path.dirname(self.file_path)
-            if dir_path:
-                os.makedirs(dir_path, exist_ok=True)
-
-            empty_list = {
-                "items": [],
-                "last_modified": datetime.now().isoformat()
-            }
-            self._save_data(empty_list)
-
     def _load_data(self) -> Dict:
-        """Load data from JSON file"""
+        """Load this household's list from the shared store"""
         try:
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Ensure all items have tags
-                for item in data.get("items", []):
-                    if "tag" not in item:
-                        item["tag"] = "אחר"
-                return data
+            data = self.store.load(self.list_id)
+            # Ensure all items have tags
+            for item in data.get("items", []):
+                if "tag" not in item:
+                    item["tag"] = "אחר"
+            return data
         except Exception as e:
             logger.error(f"Error loading shopping list data: {e}")
             return {
@@ -75,16 +117,29 @@ class ShoppingListToolkit(Toolkit):
             }
 
     def _save_data(self, data: Dict) -> bool:
-        """Save data to JSON file"""
-        try:
-            data["last_modified"] = datetime.now().isoformat()
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.info("Shopping list data saved successfully")
+        """Save this household's list to the shared store"""
+        if self.store.save(self.list_id, data):
+            logger.info(f"Shopping list {self.list_id} saved successfully")
             return True
-        except Exception as e:
-            logger.error(f"Error saving shopping list data: {e}")
-            return False
+        return False
+
+    def get_list_snapshot(self, token_budget: int = LIST_CONTEXT_TOKEN_BUDGET) -> Optional[str]:
+        """Compact snapshot of the list for the agent's prompt, or None if it exceeds token_budget
+
+        Not registered as a tool: the agent injects it into the prompt so
+        questions about the list are answered without a tool round-trip.
+        One line per category, quantity after "×" when not 1, "✓" marks
+        items already bought.
+        """
+        items = self._load_data().get("items", [])
+        if not items:
+            return "מצב הרשימה: ריקה"
+
+        completed = sum(1 for item in items if item.get("completed", False))
+        lines = [f"מצב הרשימה ({len(items)} פריטים, {completed} נקנו ✓):"]
+        lines.extend(compact_lines(items))
+        snapshot = "\n".join(lines)
+        return snapshot if count_tokens(snapshot) <= token_budget else None
 
     def get_available_categories(self) -> str:
         """Get list of available categories for categorization
@@ -111,6 +166,11 @@ class ShoppingListToolkit(Toolkit):
             if not items:
                 return "הרשימה ריקה כרגע. אין פריטים ברשימת הקניות."
 
+            if self.output_format == "compact":
+                completed = sum(1 for item in items if item.get("completed", False))
+                return "\n".join([f"{len(items)} פריטים, {completed} נקנו ✓"]
+                                 + compact_lines(items, COMPACT_MAX_ITEMS))
+
             # Group items by category
             categories = {}
             for item in items:
@@ -147,6 +207,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error getting shopping list: {e}")
             return f"שגיאה בקבלת רשימת הקניות: {str(e)}"
 
+    @with_list_lock
     def add_item_with_smart_category(self, name: str, quantity: str = "1", suggested_category: str = None) -> str:
         """Add a new item to the shopping list with intelligent category assignment
 
@@ -174,10 +235,15 @@ class ShoppingListToolkit(Toolkit):
             if existing_item:
                 return f"הפריט '{name}' כבר קיים ברשימה בקטגוריה '{existing_item.get('tag', 'אחר')}' עם כמות: {existing_item['quantity']}"
 
-            # Determine category - prioritize AI suggestion
+            # Determine category - prioritize AI suggestion, then the product catalog
             category = "אחר"  # default
+            product = self._product_catalog().by_name(name)
+            if product is not None:
+                name = product["name"]
             if suggested_category and suggested_category in self.available_categories:
                 category = suggested_category
+            elif product is not None:
+                category = product["category"]
 
             # If no valid suggestion provided, the agent should determine this
             # by analyzing the product name in the context of available categories
@@ -236,6 +302,9 @@ class ShoppingListToolkit(Toolkit):
             if not category_items:
                 return f"אין פריטים בקטגוריה '{category}'"
 
+            if self.output_format == "compact":
+                return "\n".join([f"{len(category_items)} פריטים"] + compact_lines(category_items, COMPACT_MAX_ITEMS))
+
             response = f"פריטים בקטגוריה '{category}' ({len(category_items)} פריטים):\n\n"
 
             pending_items = []
@@ -290,6 +359,10 @@ class ShoppingListToolkit(Toolkit):
                 else:
                     category_stats[category]["pending"] += 1
 
+            if self.output_format == "compact":
+                return "\n".join(f"{category}: {stats['total']} ({stats['completed']} ✓)"
+                                 for category, stats in category_stats.items() if stats["total"] > 0)
+
             response = "📊 סטטיסטיקות לפי קטגוריות:\n\n"
 
             for category, stats in category_stats.items():
@@ -303,6 +376,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error getting category statistics: {e}")
             return f"שגיאה בקבלת סטטיסטיקות קטגוריות: {str(e)}"
 
+    @with_list_lock
     def remove_item_by_name(self, name: str) -> str:
         """Remove an item from the shopping list by name
 
@@ -333,6 +407,7 @@ class ShoppingListToolkit(Toolkit):
                 return f"הפריט '{name}' לא נמצא ברשימת הקניות"
 
             if self._save_data(data):
+                self._record_purchases([removed_item])
                 category = removed_item.get("tag", "אחר") if removed_item else "לא ידוע"
                 logger.info(f"Removed item from shopping list: {name}")
                 return f"✅ הפריט '{name}' הוסר בהצלחה מרשימת הקניות (קטגוריה: {category})"
@@ -343,6 +418,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error removing item {name}: {e}")
             return f"שגיאה בהסרת הפריט: {str(e)}"
 
+    @with_list_lock
     def mark_item_completed(self, name: str) -> str:
         """Mark an item as completed in the shopping list
 
@@ -363,7 +439,7 @@ class ShoppingListToolkit(Toolkit):
                     if item["completed"]:
                         return f"הפריט '{name}' כבר מסומן כהושלם"
 
-                    item["completed"] = True
+                    set_item_completed(item, True)
                     if self._save_data(data):
                         category = item.get("tag", "אחר")
                         logger.info(f"Marked item as completed: {name}")
@@ -377,6 +453,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error marking item completed {name}: {e}")
             return f"שגיאה בסימון הפריט כהושלם: {str(e)}"
 
+    @with_list_lock
     def mark_item_pending(self, name: str) -> str:
         """Mark an item as pending (not completed) in the shopping list
 
@@ -397,7 +474,7 @@ class ShoppingListToolkit(Toolkit):
                     if not item["completed"]:
                         return f"הפריט '{name}' כבר מסומן כממתין"
 
-                    item["completed"] = False
+                    set_item_completed(item, False)
                     if self._save_data(data):
                         category = item.get("tag", "אחר")
                         logger.info(f"Marked item as pending: {name}")
@@ -411,6 +488,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error marking item pending {name}: {e}")
             return f"שגיאה בסימון הפריט כממתין: {str(e)}"
 
+    @with_list_lock
     def update_item_category(self, name: str, new_category: str) -> str:
         """Update the category of an existing item
 
@@ -447,6 +525,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error updating item category {name}: {e}")
             return f"שגיאה בעדכון קטגוריית הפריט: {str(e)}"
 
+    @with_list_lock
     def clear_shopping_list(self) -> str:
         """Clear all items from the shopping list
 
@@ -460,12 +539,14 @@ class ShoppingListToolkit(Toolkit):
             if items_count == 0:
                 return "רשימת הקניות כבר ריקה"
 
+            cleared_items = data["items"]
             data = {
                 "items": [],
                 "last_modified": datetime.now().isoformat()
             }
 
             if self._save_data(data):
+                self._record_purchases(cleared_items)
                 logger.info(f"Cleared shopping list with {items_count} items")
                 return f"✅ רשימת הקניות נוקתה בהצלחה. הוסרו {items_count} פריטים"
             else:
@@ -475,6 +556,7 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error clearing shopping list: {e}")
             return f"שגיאה בניקוי רשימת הקניות: {str(e)}"
 
+    @with_list_lock
     def clear_completed_items(self) -> str:
         """Remove all completed items from the shopping list
 
@@ -483,15 +565,17 @@ class ShoppingListToolkit(Toolkit):
         """
         try:
             data = self._load_data()
-            original_length = len(data["items"])
+            items = data["items"]
+            original_length = len(items)
 
-            data["items"] = [item for item in data["items"] if not item.get("completed", False)]
+            data["items"] = [item for item in items if not item.get("completed", False)]
             removed_count = original_length - len(data["items"])
 
             if removed_count == 0:
                 return "אין פריטים מושלמים להסרה"
 
             if self._save_data(data):
+                self._record_purchases([item for item in items if item.get("completed", False)])
                 logger.info(f"Cleared {removed_count} completed items")
                 return f"✅ הוסרו {removed_count} פריטים מושלמים מרשימת הקניות"
             else:
@@ -524,6 +608,10 @@ class ShoppingListToolkit(Toolkit):
             if not matching_items:
                 return f"לא נמצאו פריטים התואמים לחיפוש: '{query}'"
 
+            if self.output_format == "compact":
+                return "\n".join([f"{len(matching_items)} תוצאות ל'{query}'"]
+                                 + compact_lines(matching_items, COMPACT_MAX_ITEMS))
+
             response = f"נמצאו {len(matching_items)} פריטים התואמים לחיפוש '{query}':\n\n"
 
             # Group by category
@@ -558,8 +646,9 @@ class ShoppingListToolkit(Toolkit):
             data = self._load_data()
             items = data.get("items", [])
             total_items = len(items)
+            archived_items = self._archived_count()
 
-            if total_items == 0:
+            if total_items == 0 and archived_items == 0:
                 return "רשימת הקניות ריקה - אין סטטיסטיקות להציג"
 
             completed_items = len([item for item in items if item.get("completed", False)])
@@ -572,12 +661,18 @@ class ShoppingListToolkit(Toolkit):
                 category = item.get("tag", "אחר")
                 category_counts[category] = category_counts.get(category, 0) + 1
 
+            if self.output_format == "compact":
+                return (f"סה״כ {total_items}, נקנו {completed_items} ✓, ממתינים {pending_items}, "
+                        f"בארכיון {archived_items}\n"
+                        + ", ".join(f"{category} {count}" for category, count in sorted(category_counts.items())))
+
             response = f"""📊 סטטיסטיקות רשימת הקניות:
 
 📝 סה״כ פריטים: {total_items}
 ✅ פריטים מושלמים: {completed_items}
 ⏳ פריטים ממתינים: {pending_items}
 📈 אחוז השלמה: {completion_rate:.1f}%
+🗄️ פריטים שנקנו והועברו לארכיון: {archived_items}
 
 📂 פירוט לפי קטגוריות:"""
 
@@ -592,6 +687,107 @@ class ShoppingListToolkit(Toolkit):
             logger.error(f"Error getting shopping stats: {e}")
             return f"שגיאה בקבלת סטטיסטיקות: {str(e)}"
 
+    def _product_catalog(self):
+        if self._catalog is None:
+            from product_catalog import get_default_catalog
+            self._catalog = get_default_catalog()
+        return self._catalog
+
+    def find_products(self, query: str) -> str:
+        """Look up products in the product catalog by barcode or by the beginning of the name,
+        to get their exact names and categories before adding them
+
+        Args:
+            query (str): Barcode digits or the beginning of a product name
+
+        Returns:
+            str: Matching products with their categories in Hebrew
+        """
+        try:
+            if not query or not query.strip():
+                return "שגיאה: שאילתת החיפוש לא יכולה להיות ריקה"
+
+            products = self._product_catalog().lookup(query.strip(), limit=10)
+            if not products:
+                return f"לא נמצאו מוצרים בקטלוג עבור '{query}'"
+
+            if self.output_format == "compact":
+                return "\n".join(f"{product['name']} ({product['category']})" for product in products)
+
+            response = f"🔎 מוצרים בקטלוג עבור '{query}':"
+            for product in products:
+                barcode = f" - ברקוד {product['barcode']}" if product["barcode"] else ""
+                response += f"\n• {product['name']} ({product['category']}){barcode}"
+            return response
+
+        except Exception as e:
+            logger.error(f"Error looking up products for {query}: {e}")
+            return f"שגיאה בחיפוש בקטלוג: {str(e)}"
+
+    def _purchase_history(self):
+        if self._history is None:
+            from purchase_history import get_default_history
+            self._history = get_default_history()
+        return self._history
+
+    def _record_purchases(self, items: List[Dict]):
+        """Keep the bought items that left the list in the purchase history (a failure only loses history)"""
+        try:
+            self._purchase_history().record(self.list_id, items)
+        except Exception as e:
+            logger.warning(f"Could not record purchases: {e}")
+
+    def get_purchase_suggestions(self) -> str:
+        """Suggest items to add based on past purchases: regular items that are due again and items
+        usually bought together with what is on the list. Items already on the list are not suggested.
+
+        Returns:
+            str: Suggestions in Hebrew
+        """
+        try:
+            names = [item["name"] for item in self._load_data().get("items", [])]
+            suggestions = self._purchase_history().suggestions(self.list_id, names, limit=5)
+            due, together = suggestions["due"], suggestions["bought_with"]
+
+            if not due and not together:
+                return "אין עדיין מספיק היסטוריית קניות להצעות"
+
+            if self.output_format == "compact":
+                lines = []
+                if due:
+                    lines.append("לקנות שוב: " + ", ".join(
+                        f"{s['name']} (כל {s['mean_interval_days']:g} ימים, לפני {s['days_since_last']:g})"
+                        for s in due))
+                if together:
+                    lines.append("נקנים יחד עם הרשימה: " + ", ".join(s["name"] for s in together))
+                return "\n".join(lines)
+
+            response = "💡 הצעות לפי היסטוריית הקניות:"
+            for s in due:
+                response += (f"\n• {s['name']} - בדרך כלל כל {s['mean_interval_days']:g} ימים, "
+                             f"נקנה לאחרונה לפני {s['days_since_last']:g} ימים")
+            if together:
+                response += "\n\n🛒 נקנים בדרך כלל יחד עם מה שברשימה:"
+                for s in together:
+                    response += f"\n• {s['name']}"
+            return response
+
+        except Exception as e:
+            logger.error(f"Error getting purchase suggestions: {e}")
+            return f"שגיאה בקבלת הצעות: {str(e)}"
+
+    def _archived_count(self) -> int:
+        """Number of bought items moved off this list into the archive (0 if the archive can't be read)"""
+        try:
+            if self._archive is None:
+                from item_archive import get_default_archive
+                self._archive = get_default_archive()
+            return self._archive.count(self.list_id)
+        except Exception as e:
+            logger.warning(f"Could not count archived items: {e}")
+            return 0
+
+    @with_list_lock
     def update_item_quantity(self, name: str, new_quantity: str) -> str:
         """Update the quantity of an existing item
 
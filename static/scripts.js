@@ -1,3 +1,21 @@
+// Quiet period after the last user action before queued actions are sent as one batch
+const BATCH_FLUSH_DELAY_MS = 150
+
+// Mutations are retried after network errors; the Idempotency-Key makes the server answer retries
+// of a request it already handled with the original response instead of applying it twice
+const MUTATION_RETRY_ATTEMPTS = 3
+const MUTATION_RETRY_DELAY_MS = 1000
+
+// Voice commands are streamed to /api/voice-stream while the user speaks, so the server can detect the
+// end of speech and start transcribing at once; the recording is posted to /api/voice-command instead
+// when streaming is unavailable or the stream fails
+const VOICE_STREAMING = "WebSocket" in window
+const VOICE_CHUNK_MS = 100
+
+// Name suggestions for the add-item box are fetched once typing pauses, and kept per list version
+const AUTOCOMPLETE_DEBOUNCE_MS = 150
+const AUTOCOMPLETE_CACHE_SIZE = 200
+
 class SmartShoppingListWithTags {
   constructor() {
     this.shoppingList = []
@@ -7,18 +25,38 @@ class SmartShoppingListWithTags {
     this.currentFilter = "all"
     this.isRecording = false
     this.pollInterval = null
+    this.eventSource = null
+    this.eventsConnected = false
+
+    // User actions waiting to be sent together to /api/batch
+    this.pendingOperations = []
+    this.flushTimer = null
+    this.flushInProgress = false
     this.lastModified = null
+    this.listVersion = null
     this.microphoneAvailable = false
 
+    // Household list this fridge shows, e.g. https://fridge.local:8000/?list=cohen
+    this.listId = new URLSearchParams(window.location.search).get("list") || "family"
+
     // Voice recording properties
     this.mediaRecorder = null
     this.audioChunks = []
     this.recordingTimeout = null
+    this.recorderStopped = false
+    this.voiceSocket = null
+    this.streamedChunks = 0
+
+    // Add-item autocomplete: answers by "<list version>:<typed text>", the suggestions shown
+    this.autocompleteCache = new Map()
+    this.autocompleteTimer = null
+    this.suggestions = []
 
     this.initializeElements()
     this.bindEvents()
     this.loadCategories()
     this.startPolling()
+    this.subscribeToChanges()
     this.loadShoppingList()
     this.checkMicrophonePermission()
   }
@@ -61,6 +99,7 @@ class SmartShoppingListWithTags {
     this.itemName = document.getElementById("itemName")
     this.itemQuantity = document.getElementById("itemQuantity")
     this.itemCategory = document.getElementById("itemCategory")
+    this.itemSuggestions = document.getElementById("itemSuggestions")
 
     // Stats modal elements
     this.statsModal = document.getElementById("statsModal")
@@ -130,6 +169,8 @@ class SmartShoppingListWithTags {
       }
     })
 
+    this.itemName?.addEventListener("input", () => this.scheduleAutocomplete())
+
     this.itemQuantity?.addEventListener("keypress", (e) => {
       if (e.key === "Enter") {
         this.saveNewItem()
@@ -144,6 +185,11 @@ class SmartShoppingListWithTags {
     })
   }
 
+  apiUrl(path) {
+    const separator = path.includes("?") ? "&" : "?"
+    return `${path}${separator}list_id=${encodeURIComponent(this.listId)}`
+  }
+
   // ============================================================================
   // VOICE UI VISIBILITY MANAGEMENT
   // ============================================================================
@@ -295,18 +341,26 @@ class SmartShoppingListWithTags {
       })
 
       this.audioChunks = []
+      this.recorderStopped = false
+      this.voiceSocket = this.openVoiceStream()
 
       this.mediaRecorder.ondataavailable = (event) => {
         if (event.data.size > 0) {
           this.audioChunks.push(event.data)
+          if (this.voiceSocket) this.flushVoiceStream(this.voiceSocket)
         }
       }
 
       this.mediaRecorder.onstop = async () => {
         console.log("Recording stopped, processing audio...")
-        await this.processVoiceRecording()
+        this.recorderStopped = true
         // Stop all tracks to release microphone
         stream.getTracks().forEach(track => track.stop())
+        if (this.voiceSocket) {
+          this.finishVoiceStream(this.voiceSocket)
+        } else {
+          await this.processVoiceRecording()
+        }
       }
 
       this.mediaRecorder.onerror = (event) => {
@@ -324,7 +378,7 @@ class SmartShoppingListWithTags {
       }
 
       // Start recording
-      this.mediaRecorder.start(100) // Collect data every 100ms
+      this.mediaRecorder.start(VOICE_CHUNK_MS) // Collect data every 100ms
 
       // Auto-stop after 10 seconds
       this.recordingTimeout = setTimeout(() => {
@@ -403,53 +457,119 @@ class SmartShoppingListWithTags {
       console.log("Sending audio to server...")
 
       // Send to voice command endpoint
-      const response = await fetch("/api/voice-command", {
+      const response = await this.fetchWithRetry(this.apiUrl("/api/voice-command"), {
         method: "POST",
         body: formData,
       })
 
       const result = await response.json()
-      console.log("Voice command result:", result)
+      await this.handleVoiceResult(result)
+
+    } catch (error) {
+      console.error("Error processing voice recording:", error)
+      this.updateSyncStatus("error")
+      this.showNotification("שגיאה בעיבוד הפקודה הקולית")
+    } finally {
+      this.resetVoiceUI()
+    }
+  }
+
+  // Stream the recording over a WebSocket as it is recorded; null if the browser can't
+  openVoiceStream() {
+    if (!VOICE_STREAMING) return null
 
-      if (result.success) {
-        // Show what was heard
-        this.showNotification(`שמעתי: "${result.transcription}"`)
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:"
+    const socket = new WebSocket(`${protocol}//${window.location.host}${this.apiUrl("/api/voice-stream")}`)
+    socket.gotResult = false
+    this.streamedChunks = 0
 
-        // Play TTS response
-        if (result.audio_url) {
-          console.log("Playing TTS response:", result.audio_url)
-          await this.playAudioResponse(result.audio_url)
+    socket.onopen = () => {
+      // Chunks recorded while connecting (including the WebM header) go first
+      this.flushVoiceStream(socket)
+      if (this.recorderStopped) this.finishVoiceStream(socket)
+    }
+
+    socket.onmessage = async (event) => {
+      const message = JSON.parse(event.data)
+      if (message.type === "end_of_speech") {
+        // The server heard the user stop talking; no need to wait for the button or the timeout
+        console.log("Server detected end of speech")
+        this.stopVoiceRecording()
+      } else if (message.type === "result") {
+        socket.gotResult = true
+        try {
+          await this.handleVoiceResult(message)
+        } catch (error) {
+          console.error("Error handling voice result:", error)
+          this.updateSyncStatus("error")
+        } finally {
+          this.resetVoiceUI()
         }
+      }
+    }
 
-        // Refresh the shopping list to show changes
-        await this.loadShoppingList()
-        this.updateSyncStatus("synced")
+    socket.onclose = () => {
+      if (this.voiceSocket === socket) this.voiceSocket = null
+      if (socket.gotResult) return
+      // Streaming failed: upload the recording instead (now, or when the recorder stops)
+      console.warn("Voice stream closed without a result, falling back to upload")
+      if (this.recorderStopped) this.processVoiceRecording()
+    }
 
-        // Show success message
-        setTimeout(() => {
-          this.showNotification("פקודה בוצעה בהצלחה!")
-        }, 1000)
+    return socket
+  }
 
-      } else {
-        console.error("Voice command failed:", result.error)
+  flushVoiceStream(socket) {
+    if (socket.readyState !== WebSocket.OPEN) return
+    while (this.streamedChunks < this.audioChunks.length) {
+      socket.send(this.audioChunks[this.streamedChunks++])
+    }
+  }
 
-        // Show error message
-        this.showNotification(result.response || "לא הצלחתי לעבד את הפקודה")
+  finishVoiceStream(socket) {
+    if (socket.readyState !== WebSocket.OPEN) return // onopen finishes it
+    this.flushVoiceStream(socket)
+    socket.send(JSON.stringify({ type: "end" }))
+    this.updateSyncStatus("syncing")
+    if (this.voiceLabel) {
+      this.voiceLabel.textContent = "מעבד פקודה קולית..."
+    }
+  }
 
-        // Play error TTS if available
-        if (result.audio_url) {
-          await this.playAudioResponse(result.audio_url)
-        }
+  async handleVoiceResult(result) {
+    console.log("Voice command result:", result)
+
+    if (result.success) {
+      // Show what was heard
+      this.showNotification(`שמעתי: "${result.transcription}"`)
 
-        this.updateSyncStatus("error")
+      // Play TTS response
+      if (result.audio_url) {
+        console.log("Playing TTS response:", result.audio_url)
+        await this.playAudioResponse(result.audio_url)
+      }
+
+      // Refresh the shopping list to show changes
+      await this.loadShoppingList()
+      this.updateSyncStatus("synced")
+
+      // Show success message
+      setTimeout(() => {
+        this.showNotification("פקודה בוצעה בהצלחה!")
+      }, 1000)
+
+    } else {
+      console.error("Voice command failed:", result.error)
+
+      // Show error message
+      this.showNotification(result.response || "לא הצלחתי לעבד את הפקודה")
+
+      // Play error TTS if available
+      if (result.audio_url) {
+        await this.playAudioResponse(result.audio_url)
       }
 
-    } catch (error) {
-      console.error("Error processing voice recording:", error)
       this.updateSyncStatus("error")
-      this.showNotification("שגיאה בעיבוד הפקודה הקולית")
-    } finally {
-      this.resetVoiceUI()
     }
   }
 
@@ -673,11 +793,12 @@ class SmartShoppingListWithTags {
   async loadShoppingList() {
     try {
       this.showLoading()
-      const response = await fetch("/api/shopping-list")
+      const response = await fetch(this.apiUrl("/api/shopping-list"))
       const data = await response.json()
 
       this.shoppingList = data.items || []
       this.lastModified = data.last_modified
+      this.listVersion = data.version
       this.renderShoppingList()
       this.updateCategoryCounts() // Make sure counts are updated
       this.updateSyncStatus("synced")
@@ -691,7 +812,7 @@ class SmartShoppingListWithTags {
 
   async loadTagStats() {
     try {
-      const response = await fetch("/api/tag-stats")
+      const response = await fetch(this.apiUrl("/api/tag-stats"))
       const data = await response.json()
       this.tagStats = data.tag_stats || []
       this.updateCategoryCounts()
@@ -741,24 +862,56 @@ class SmartShoppingListWithTags {
 
   startPolling() {
     this.pollInterval = setInterval(async () => {
-      try {
-        const response = await fetch("/api/shopping-list")
-        const data = await response.json()
-
-        if (data.last_modified !== this.lastModified) {
-          this.shoppingList = data.items || []
-          this.lastModified = data.last_modified
-          this.renderShoppingList()
-          this.updateCategoryCounts() // Ensure counts are updated on polling
-          this.updateSyncStatus("synced")
-        }
-      } catch (error) {
-        console.error("Error polling shopping list:", error)
-        this.updateSyncStatus("error")
-      }
+      // Server-sent events push every change; only poll while the stream is down
+      if (this.eventsConnected) return
+      await this.syncShoppingList()
     }, 2000)
   }
 
+  async syncShoppingList() {
+    // Don't overwrite optimistic changes that the server hasn't applied yet
+    if (this.hasPendingOperations()) return
+
+    try {
+      const response = await fetch(this.apiUrl("/api/shopping-list"))
+      const data = await response.json()
+
+      if (data.last_modified !== this.lastModified) {
+        this.shoppingList = data.items || []
+        this.lastModified = data.last_modified
+        this.listVersion = data.version
+        this.renderShoppingList()
+        this.updateCategoryCounts() // Ensure counts are updated on polling
+        this.updateSyncStatus("synced")
+      }
+    } catch (error) {
+      console.error("Error polling shopping list:", error)
+      this.updateSyncStatus("error")
+    }
+  }
+
+  subscribeToChanges() {
+    if (!window.EventSource) return
+
+    this.eventSource = new EventSource(this.apiUrl("/api/events"))
+
+    this.eventSource.onopen = () => {
+      this.eventsConnected = true
+    }
+
+    this.eventSource.addEventListener("change", async (event) => {
+      const change = JSON.parse(event.data)
+      if (change.version !== this.listVersion) {
+        await this.syncShoppingList()
+      }
+    })
+
+    // EventSource reconnects on its own; poll until it does
+    this.eventSource.onerror = () => {
+      this.eventsConnected = false
+    }
+  }
+
   renderShoppingList() {
     if (!this.shoppingListEl) return
 
@@ -791,51 +944,144 @@ class SmartShoppingListWithTags {
     this.filterShoppingList()
   }
 
-  async toggleItem(itemId) {
-    try {
-      this.updateSyncStatus("syncing")
-      const response = await fetch("/api/toggle-item", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ item_id: itemId }),
-      })
+  toggleItem(itemId) {
+    const item = this.shoppingList.find(item => item.id === itemId)
+    if (!item || this.isPendingItem(itemId)) return
 
-      if (response.ok) {
-        await this.loadShoppingList()
-      } else {
-        throw new Error("Failed to toggle item")
-      }
-    } catch (error) {
-      console.error("Error toggling item:", error)
-      this.updateSyncStatus("error")
-    }
+    // Show the change right away; the server applies it with the next batch
+    item.completed = !item.completed
+    this.renderShoppingList()
+    this.queueOperation({ op: "toggle", item_id: itemId, completed: item.completed })
   }
 
-  async deleteItem(itemId) {
+  deleteItem(itemId) {
+    if (this.isPendingItem(itemId)) return
+
     if (!confirm("האם אתה בטוח שברצונך למחוק פריט זה?")) {
       return
     }
 
+    this.shoppingList = this.shoppingList.filter(item => item.id !== itemId)
+    this.renderShoppingList()
+    this.updateCategoryCounts()
+    this.queueOperation({ op: "remove", item_id: itemId })
+  }
+
+  // ============================================================================
+  // ADD-ITEM AUTOCOMPLETE
+  // ============================================================================
+
+  scheduleAutocomplete() {
+    clearTimeout(this.autocompleteTimer)
+    const query = this.itemName?.value.trim() || ""
+    this.applySuggestedCategory(query)
+    if (!query) {
+      this.renderSuggestions([])
+      return
+    }
+    this.autocompleteTimer = setTimeout(() => this.loadSuggestions(query), AUTOCOMPLETE_DEBOUNCE_MS)
+  }
+
+  async loadSuggestions(query) {
+    // A list change may change the answers, so they are cached per list version
+    const key = `${this.listVersion}:${query}`
+    let suggestions = this.autocompleteCache.get(key)
+    if (!suggestions) {
+      try {
+        const response = await fetch(this.apiUrl(`/api/autocomplete?q=${encodeURIComponent(query)}`))
+        if (!response.ok) return
+        suggestions = (await response.json()).suggestions || []
+      } catch (error) {
+        console.error("Error loading suggestions:", error)
+        return
+      }
+      if (this.autocompleteCache.size >= AUTOCOMPLETE_CACHE_SIZE) {
+        this.autocompleteCache.delete(this.autocompleteCache.keys().next().value)
+      }
+      this.autocompleteCache.set(key, suggestions)
+    }
+
+    // Answers arriving after the user typed on are not shown
+    if (this.itemName?.value.trim() === query) {
+      this.renderSuggestions(suggestions)
+    }
+  }
+
+  renderSuggestions(suggestions) {
+    this.suggestions = suggestions
+    if (!this.itemSuggestions) return
+    this.itemSuggestions.replaceChildren(
+      ...suggestions.map((suggestion) => {
+        const option = document.createElement("option")
+        option.value = suggestion.name
+        option.label = suggestion.on_list ? `${suggestion.tag} · כבר ברשימה` : suggestion.tag
+        return option
+      }),
+    )
+  }
+
+  applySuggestedCategory(name) {
+    // Picking a suggestion also picks its category, unless the user already chose one
+    const suggestion = this.suggestions.find((s) => s.name === name)
+    if (!suggestion || !this.itemCategory || this.itemCategory.value !== "אחר") return
+    if ([...this.itemCategory.options].some((option) => option.value === suggestion.tag)) {
+      this.itemCategory.value = suggestion.tag
+    }
+  }
+
+  // ============================================================================
+  // BATCHED MUTATIONS
+  // ============================================================================
+
+  isPendingItem(itemId) {
+    // Items added locally but not yet confirmed by the server
+    return itemId.startsWith("pending-")
+  }
+
+  hasPendingOperations() {
+    return this.pendingOperations.length > 0 || this.flushInProgress
+  }
+
+  queueOperation(operation) {
+    this.pendingOperations.push(operation)
+    this.updateSyncStatus("syncing")
+
+    clearTimeout(this.flushTimer)
+    this.flushTimer = setTimeout(() => this.flushOperations(), BATCH_FLUSH_DELAY_MS)
+  }
+
+  async flushOperations() {
+    this.flushTimer = null
+    if (this.flushInProgress || this.pendingOperations.length === 0) return
+
+    const operations = this.pendingOperations.splice(0, this.pendingOperations.length)
+    this.flushInProgress = true
+
     try {
-      this.updateSyncStatus("syncing")
-      const response = await fetch("/api/remove-item", {
+      const response = await this.fetchWithRetry(this.apiUrl("/api/batch"), {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ item_id: itemId }),
+        body: JSON.stringify({ operations }),
       })
 
-      if (response.ok) {
-        await this.loadShoppingList()
-      } else {
-        throw new Error("Failed to delete item")
+      if (!response.ok) {
+        throw new Error(`Batch failed with status ${response.status}`)
       }
+      console.log(`Applied ${operations.length} queued operations`)
     } catch (error) {
-      console.error("Error deleting item:", error)
+      console.error("Error applying queued operations:", error)
       this.updateSyncStatus("error")
+      this.showNotification("שגיאה בשמירת השינויים")
+    } finally {
+      this.flushInProgress = false
+      if (this.pendingOperations.length > 0) {
+        await this.flushOperations()
+      } else {
+        // Replace optimistic state with what the server stored
+        await this.syncShoppingList()
+      }
     }
   }
 
@@ -846,12 +1092,15 @@ class SmartShoppingListWithTags {
 
     try {
       this.updateSyncStatus("syncing")
-      const response = await fetch("/api/clear-list", {
+      const response = await this.fetchWithRetry(this.apiUrl("/api/clear-list"), {
         method: "POST",
+        headers: this.versionHeaders(),
       })
 
       if (response.ok) {
         await this.loadShoppingList()
+      } else if (response.status === 409) {
+        await this.handleVersionConflict()
       } else {
         throw new Error("Failed to clear list")
       }
@@ -861,6 +1110,39 @@ class SmartShoppingListWithTags {
     }
   }
 
+  newIdempotencyKey() {
+    if (window.crypto?.randomUUID) return window.crypto.randomUUID()
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`
+  }
+
+  async fetchWithRetry(url, options = {}) {
+    // Every attempt carries the same key, so a retry of a request that did reach the server is not applied again
+    const headers = { ...(options.headers || {}), "Idempotency-Key": this.newIdempotencyKey() }
+
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await fetch(url, { ...options, headers })
+      } catch (error) {
+        if (attempt >= MUTATION_RETRY_ATTEMPTS) throw error
+        console.warn(`Request to ${url} failed (attempt ${attempt}), retrying:`, error)
+        await new Promise(resolve => setTimeout(resolve, MUTATION_RETRY_DELAY_MS * attempt))
+      }
+    }
+  }
+
+  versionHeaders() {
+    // Only apply the change if the list is still the version we are showing
+    return this.listVersion === null || this.listVersion === undefined
+      ? {}
+      : { "If-Match": `"${this.listVersion}"` }
+  }
+
+  async handleVersionConflict() {
+    console.log("Shopping list changed on another device, reloading")
+    await this.loadShoppingList()
+    this.showNotification("הרשימה עודכנה במכשיר אחר - נסה שוב")
+  }
+
   openAddModal() {
     if (!this.addModal) return
     this.addModal.classList.add("active")
@@ -868,6 +1150,7 @@ class SmartShoppingListWithTags {
     if (this.itemName) this.itemName.value = ""
     if (this.itemQuantity) this.itemQuantity.value = "1"
     if (this.itemCategory) this.itemCategory.value = "אחר"
+    this.renderSuggestions([])
   }
 
   closeAddModal() {
@@ -887,32 +1170,19 @@ class SmartShoppingListWithTags {
       return
     }
 
-    try {
-      this.updateSyncStatus("syncing")
-      const response = await fetch("/api/add-item", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          name: name,
-          quantity: quantity || "1",
-          tag: tag,
-        }),
-      })
+    this.shoppingList.push({
+      id: `pending-${Date.now()}-${Math.random().toString(36).slice(2)}`,
+      name: name,
+      quantity: quantity || "1",
+      completed: false,
+      tag: tag,
+    })
+    this.renderShoppingList()
+    this.updateCategoryCounts()
+    this.closeAddModal()
+    this.showNotification(`נוסף: ${name} בקטגוריה ${tag}`)
 
-      if (response.ok) {
-        await this.loadShoppingList()
-        this.closeAddModal()
-        this.showNotification(`נוסף: ${name} בקטגוריה ${tag}`)
-      } else {
-        throw new Error("Failed to add item")
-      }
-    } catch (error) {
-      console.error("Error adding item:", error)
-      this.updateSyncStatus("error")
-      alert("שגיאה בהוספת הפריט")
-    }
+    this.queueOperation({ op: "add", name: name, quantity: quantity || "1", tag: tag })
   }
 
   async openStatsModal() {
@@ -0,0 +1,122 @@
+"""Static/dynamic prompt split and prompt cache hits of the agent, per request
+
+The agent's system prompt and tool schemas are the same bytes for every
+request, so once the provider has cached them only the session memory,
+the replayed turns and the command itself are processed anew. The agent
+records the split and the cached input tokens the provider reports on its
+model.response spans; this report reads them from the trace log:
+
+    TRACE_LOG_FILE=traces.jsonl python server.py
+
+    python tools/prompt_cache_report.py traces.jsonl               # last 20 agent requests
+    python tools/prompt_cache_report.py traces.jsonl --last 100 --json cache.json
+    python tools/prompt_cache_report.py --layout                   # the static prefix alone, no traces
+
+A request's hit rate is the share of its input tokens (all model calls)
+served from the cache. More than one prompt hash in the report means the
+static prompt changed between requests (e.g. a restart with new
+instructions), which empties the cache.
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trace_viewer import load_traces  # noqa: E402
+
+PARTS = ("static", "memory", "history", "request")
+
+
+def request_row(trace: Dict) -> Optional[Dict]:
+    """The prompt split and cache use of one traced request, or None if it made no model call"""
+    calls = [span for span in trace["spans"] if span["name"] == "model.response"]
+    if not calls:
+        return None
+    first = (calls[0].get("attributes") or {})
+    attributes = [span.get("attributes") or {} for span in calls]
+    input_tokens = sum(a.get("input_tokens") or 0 for a in attributes)
+    cached_tokens = sum(a.get("cached_tokens") or 0 for a in attributes)
+    row = {
+        "trace_id": trace["trace_id"],
+        "name": trace["name"],
+        "model_calls": len(calls),
+        "prompt_sha": first.get("prompt_sha"),
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "hit_rate": round(cached_tokens / input_tokens, 3) if input_tokens else 0.0,
+    }
+    for part in PARTS:
+        row[part] = first.get(f"prompt_{part}_tokens", 0)
+    return row
+
+
+def render(rows: List[Dict]) -> str:
+    lines = [f"{'trace':<16} {'calls':>5} {'static':>6} {'memory':>6} {'history':>7} {'request':>7} "
+             f"{'dynamic%':>8} {'input':>6} {'cached':>6} {'hit':>5}  prompt"]
+    for row in rows:
+        first_prompt = sum(row[part] for part in PARTS)
+        dynamic = first_prompt - row["static"]
+        lines.append(
+            f"{row['trace_id']:<16} {row['model_calls']:>5} {row['static']:>6} {row['memory']:>6} "
+            f"{row['history']:>7} {row['request']:>7} {dynamic / first_prompt if first_prompt else 0:>8.0%} "
+            f"{row['input_tokens']:>6} {row['cached_tokens']:>6} {row['hit_rate']:>5.0%}  {row['prompt_sha']}"
+        )
+
+    input_tokens = sum(row["input_tokens"] for row in rows)
+    cached_tokens = sum(row["cached_tokens"] for row in rows)
+    hashes = sorted({row["prompt_sha"] for row in rows if row["prompt_sha"]})
+    lines.append("")
+    lines.append(f"{len(rows)} requests  cache hit rate {cached_tokens / input_tokens if input_tokens else 0:.0%} "
+                 f"({cached_tokens} of {input_tokens} input tokens)  "
+                 f"requests with cache hits {sum(1 for row in rows if row['cached_tokens'])}/{len(rows)}")
+    lines.append(f"static prompt hashes: {', '.join(hashes) or '-'}"
+                 + ("  (changed between requests)" if len(hashes) > 1 else ""))
+    return "\n".join(lines)
+
+
+def layout() -> str:
+    """The static prefix as the agent sends it: tool schemas and system prompt"""
+    from agent_prompt import STATIC_PROMPT_SHA, STATIC_PROMPT_TOKENS, tool_schema_tokens
+    from shopping_tool import AGENT_TOOL_OUTPUT, ShoppingListToolkit
+
+    toolkit = ShoppingListToolkit(output_format=AGENT_TOOL_OUTPUT)
+    tools = []
+    for function in toolkit.functions.values():
+        function.process_entrypoint()
+        tools.append({"type": "function", "function": function.to_dict()})
+    schema_tokens = tool_schema_tokens(tools)
+    return (f"system prompt {STATIC_PROMPT_TOKENS} tokens (sha {STATIC_PROMPT_SHA})\n"
+            f"tool schemas  {schema_tokens} tokens ({len(tools)} tools)\n"
+            f"static prefix {STATIC_PROMPT_TOKENS + schema_tokens} tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_file", nargs="?", help="JSON lines file written with TRACE_LOG_FILE")
+    parser.add_argument("--last", type=int, default=20, help="Report the last N requests that called the model")
+    parser.add_argument("--json", help="Write the rows to this file")
+    parser.add_argument("--layout", action="store_true", help="Show the size of the static prefix and exit")
+    args = parser.parse_args()
+
+    if args.layout:
+        print(layout())
+        return
+    if not args.trace_file:
+        parser.error("trace_file is required unless --layout is given")
+
+    rows = [row for row in map(request_row, load_traces(args.trace_file)) if row is not None][-args.last:]
+    if not rows:
+        print("No traced requests with agent model calls")
+        return
+    print(render(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Waterfall viewer for request traces written with TRACE_LOG_FILE
+
+Shows the nested spans of traced requests as a text waterfall, or exports
+them in the Chrome trace event format for chrome://tracing, Perfetto or the
+devtools Performance panel.
+
+    TRACE_LOG_FILE=traces.jsonl python server.py
+
+    python tools/trace_viewer.py traces.jsonl                      # last request
+    python tools/trace_viewer.py traces.jsonl --last 5 --path /api/voice-command
+    python tools/trace_viewer.py traces.jsonl --slowest 3
+    python tools/trace_viewer.py traces.jsonl --trace-id 3f2a9c0d1e4b5a6f
+    python tools/trace_viewer.py traces.jsonl --chrome traces.json  # open in chrome://tracing
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+
+def load_traces(path: str) -> List[Dict]:
+    """Read the trace log, skipping lines that are not complete JSON"""
+    traces = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                traces.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # A line still being written by a running server
+    return traces
+
+
+def span_depths(spans: List[Dict]) -> Dict[int, int]:
+    """Get the nesting depth of every span"""
+    parents = {span["id"]: span.get("parent") for span in spans}
+    depths = {}
+    for span_id in parents:
+        depth, parent = 0, parents[span_id]
+        while parent is not None and parent in parents:
+            depth += 1
+            parent = parents[parent]
+        depths[span_id] = depth
+    return depths
+
+
+def ordered_spans(spans: List[Dict]) -> List[Dict]:
+    """Order spans depth-first (children under their parent), each level by start time"""
+    children: Dict = {}
+    ids = {span["id"] for span in spans}
+    for span in spans:
+        parent = span.get("parent") if span.get("parent") in ids else None
+        children.setdefault(parent, []).append(span)
+
+    ordered = []
+
+    def visit(parent):
+        for child in sorted(children.get(parent, []), key=lambda span: span["start_ms"]):
+            ordered.append(child)
+            visit(child["id"])
+
+    visit(None)
+    return ordered
+
+
+def render_waterfall(trace: Dict, width: int = 60) -> str:
+    """Render one trace as a text waterfall"""
+    total = max(trace["duration_ms"], 0.001)
+    spans = ordered_spans(trace["spans"])
+    depths = span_depths(trace["spans"])
+    label_width = max([len("  " * depths[span["id"]] + span["name"]) for span in spans] + [len("total")])
+
+    lines = [f"{trace['name']}  status={trace.get('status')}  {trace['duration_ms']:.1f}ms  "
+             f"trace={trace['trace_id']}"]
+    lines.append(f"{'total':<{label_width}} |{'█' * width}| {total:9.1f}ms")
+
+    for span in spans:
+        start = int(span["start_ms"] / total * width)
+        length = max(1, round(span["duration_ms"] / total * width))
+        start = min(start, width - 1)
+        length = min(length, width - start)
+        bar = " " * start + "█" * length + " " * (width - start - length)
+        label = "  " * depths[span["id"]] + span["name"]
+
+        details = ""
+        attributes = span.get("attributes") or {}
+        if attributes:
+            details = "  " + " ".join(f"{key}={value}" for key, value in attributes.items()
+                                      if not isinstance(value, (dict, list)))
+        lines.append(f"{label:<{label_width}} |{bar}| {span['duration_ms']:9.1f}ms{details}")
+    return "\n".join(lines)
+
+
+def to_chrome_trace(traces: List[Dict]) -> Dict:
+    """Convert traces to Chrome trace events, one row per request"""
+    events = []
+    for row, trace in enumerate(traces):
+        base_us = trace["started_at"] * 1_000_000
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": row,
+                       "args": {"name": f"{trace['name']} {trace['trace_id']}"}})
+        events.append({"name": trace["name"], "ph": "X", "pid": 1, "tid": row, "ts": base_us,
+                       "dur": trace["duration_ms"] * 1000, "args": {"status": trace.get("status")}})
+        for span in trace["spans"]:
+            events.append({
+                "name": span["name"],
+                "cat": span.get("timing", "span"),
+                "ph": "X",
+                "pid": 1,
+                "tid": row,
+                "ts": base_us + span["start_ms"] * 1000,
+                "dur": span["duration_ms"] * 1000,
+                "args": span.get("attributes") or {},
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_file", help="JSON lines file written with TRACE_LOG_FILE")
+    parser.add_argument("--trace-id", help="Show only this trace")
+    parser.add_argument("--path", help="Only requests to this path, e.g. /api/voice-command")
+    parser.add_argument("--last", type=int, default=1, help="Show the last N requests")
+    parser.add_argument("--slowest", type=int, help="Show the N slowest requests instead")
+    parser.add_argument("--width", type=int, default=60, help="Width of the waterfall bars")
+    parser.add_argument("--chrome", help="Write the selected traces as a Chrome trace to this file")
+    args = parser.parse_args()
+
+    traces = load_traces(args.trace_file)
+    if args.trace_id:
+        traces = [trace for trace in traces if trace["trace_id"] == args.trace_id]
+    if args.path:
+        traces = [trace for trace in traces if trace["name"].split(" ", 1)[-1] == args.path]
+
+    if args.slowest:
+        traces = sorted(traces, key=lambda trace: trace["duration_ms"], reverse=True)[:args.slowest]
+    elif not args.trace_id:
+        traces = traces[-args.last:]
+
+    if not traces:
+        print("No matching traces", file=sys.stderr)
+        sys.exit(1)
+
+    if args.chrome:
+        with open(args.chrome, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(traces), f, ensure_ascii=False)
+        print(f"Wrote {len(traces)} traces to {args.chrome}")
+        return
+
+    print("\n\n".join(render_waterfall(trace, args.width) for trace in traces))
+
+
+if __name__ == "__main__":
+    main()
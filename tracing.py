@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Opt-in trace log: when set, every traced request is appended to this file as one JSON line
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE")
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+_current_span_id: ContextVar[Optional[int]] = ContextVar("current_span_id", default=None)
+_trace_log_lock = threading.Lock()
+
+
+class RequestTrace:
+    """Nested spans of one request
+
+    Spans can be recorded from the event loop and from worker threads
+    (asyncio.to_thread copies the context, so agent tool calls land in the
+    trace of the request that started the agent).
+    """
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._next_span_id = 0
+
+    def new_span_id(self) -> int:
+        with self._lock:
+            self._next_span_id += 1
+            return self._next_span_id
+
+    def add_span(self, span_id: int, name: str, start: float, end: float, parent_id: Optional[int] = None,
+                 timing: Optional[str] = None, attributes: Optional[Dict] = None):
+        """Record a finished span; start and end are time.perf_counter() values"""
+        span = {
+            "id": span_id,
+            "parent": parent_id,
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+        }
+        if timing:
+            span["timing"] = timing
+        if attributes:
+            span["attributes"] = attributes
+        with self._lock:
+            self.spans.append(span)
+
+    def timing_totals(self) -> Dict[str, float]:
+        """Sum span durations (ms) per Server-Timing metric, in order of first appearance"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        for span in spans:
+            if "timing" in span:
+                totals[span["timing"]] = totals.get(span["timing"], 0.0) + span["duration_ms"]
+        return totals
+
+    def server_timing(self, total_ms: float) -> str:
+        """Format the Server-Timing header value, e.g. storage-load;dur=0.4, tts;dur=812.5, total;dur=1530.2"""
+        metrics = [f"{name};dur={duration:.1f}" for name, duration in self.timing_totals().items()]
+        metrics.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(metrics)
+
+    def to_record(self, total_ms: float, status: Optional[int] = None) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(total_ms, 3),
+            "status": status,
+            "spans": spans,
+        }
+
+
+def start_trace(name: str) -> RequestTrace:
+    """Start collecting spans for the current request (and tasks/threads it starts)"""
+    trace = RequestTrace(name)
+    _current_trace.set(trace)
+    _current_span_id.set(None)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, timing: Optional[str] = None, **attributes):
+    """Time a block as a span of the current request; a no-op outside traced requests
+
+    Args:
+        name: Span name shown in the waterfall, e.g. "storage.save"
+        timing: Server-Timing metric the duration counts towards, e.g. "storage-save"
+        attributes: Extra details stored with the span
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    span_id = trace.new_span_id()
+    parent_id = _current_span_id.get()
+    token = _current_span_id.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _current_span_id.reset(token)
+        trace.add_span(span_id, name, start, end, parent_id, timing, attributes or None)
+
+
+def record_span(name: str, start: float, end: float, timing: Optional[str] = None, **attributes):
+    """Record a span that was timed elsewhere (perf_counter start/end) under the current span"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.add_span(trace.new_span_id(), name, start, end, _current_span_id.get(), timing, attributes or None)
+
+
+def write_trace(trace: RequestTrace, total_ms: float, status: Optional[int] = None,
+                log_file: Optional[str] = TRACE_LOG_FILE):
+    """Append a finished trace to the trace log, if one is configured"""
+    if not log_file:
+        return
+    line = json.dumps(trace.to_record(total_ms, status), ensure_ascii=False, default=str)
+    try:
+        with _trace_log_lock:
+            with open(log_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        logger.error(f"Error writing trace log {log_file}: {e}")
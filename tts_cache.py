@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import uuid
+from typing import Optional
+
+from metrics import TTS_CACHE_LOOKUPS_TOTAL
+
+# Synthesized speech kept by text, so repeated answers and fixed phrases are never synthesized twice
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "static2/audio/cache")
+TTS_CACHE_URL = "/static/audio/cache"
+TTS_CACHE_MAX_FILES = int(os.getenv("TTS_CACHE_MAX_FILES", "500"))
+
+
+class TTSCache:
+    """MP3 files on disk keyed by the spoken text, least recently used dropped first"""
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_files: int = TTS_CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max(1, max_files)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, text: str) -> str:
+        digest = hashlib.sha1(text.strip().encode("utf-8")).hexdigest()[:20]
+        return f"tts_{digest}.mp3"
+
+    def url(self, filename: str) -> str:
+        return f"{TTS_CACHE_URL}/{filename}"
+
+    def contains(self, text: str) -> bool:
+        """Whether text is cached, without counting a lookup"""
+        return os.path.exists(os.path.join(self.directory, self.filename(text)))
+
+    def get(self, text: str) -> Optional[str]:
+        """Filename of the cached speech for text, or None"""
+        filename = self.filename(text)
+        path = os.path.join(self.directory, filename)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            TTS_CACHE_LOOKUPS_TOTAL.inc(result="miss")
+            return None
+        self.hits += 1
+        TTS_CACHE_LOOKUPS_TOTAL.inc(result="hit")
+        return filename
+
+    def stats(self) -> dict:
+        try:
+            files = sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(".mp3"))
+        except FileNotFoundError:
+            files = 0
+        lookups = self.hits + self.misses
+        return {
+            "files": files,
+            "max_files": self.max_files,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    async def synthesize(self, synthesizer, text: str) -> str:
+        """Synthesize text into the cache and return its filename
+
+        The MP3 is written under a temporary name and renamed when complete, so
+        a cancelled synthesis never leaves a truncated file behind a cache hit.
+        """
+        filename = self.filename(text)
+        path = os.path.join(self.directory, filename)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            await synthesizer.synthesize(text, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        self._prune()
+        return filename
+
+    def _prune(self):
+        with self._lock:
+            try:
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".mp3")]
+            except FileNotFoundError:
+                return
+            if len(entries) <= self.max_files:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_files]:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional
+
+from deadlines import STAGE_BUDGETS
+from edge_tts_pool import TTS_POOL_SIZE, EdgeTTSConnectionPool
+from list_store import DEFAULT_LIST_ID, ShoppingListStore, get_default_store
+
+logger = logging.getLogger(__name__)
+
+# Which implementation serves each voice pipeline stage; "stub" runs offline with fixed latency
+STT_BACKEND = os.getenv("STT_BACKEND", "openai")  # openai | stub
+AGENT_BACKEND = os.getenv("AGENT_BACKEND", "agent")  # agent | stub
+TTS_BACKEND = os.getenv("TTS_BACKEND", "edge")  # edge | stub
+
+# Simulated latency of the stub backends, in milliseconds
+STUB_STT_LATENCY_MS = float(os.getenv("STUB_STT_LATENCY_MS", "400"))
+STUB_AGENT_LATENCY_MS = float(os.getenv("STUB_AGENT_LATENCY_MS", "600"))
+STUB_TTS_LATENCY_MS = float(os.getenv("STUB_TTS_LATENCY_MS", "300"))
+
+HEBREW_VOICE = "he-IL-HilaNeural"  # Female Hebrew voice; "he-IL-AvriNeural" for male
+
+# Commands the stub transcriber returns for audio that is not UTF-8 text
+STUB_COMMANDS = [
+    "הוסף חלב",
+    "תוסיף לחם",
+    "הוסף עגבניות",
+    "תראה לי את הרשימה",
+    "הוסף בננות",
+    "מה יש ברשימה",
+]
+
+
+class Transcriber:
+    """Speech-to-text backend"""
+
+    async def transcribe(self, audio_path: str) -> str:
+        """Transcribe a Hebrew audio file"""
+        raise NotImplementedError
+
+
+class AgentBackend:
+    """Runs a transcribed command against a household list and returns the spoken reply"""
+
+    async def run(self, command: str, list_id: str = DEFAULT_LIST_ID) -> str:
+        """Process a command; raises ImportError if the backend is not installed, and its errors otherwise"""
+        raise NotImplementedError
+
+
+class Synthesizer:
+    """Text-to-speech backend"""
+
+    async def synthesize(self, text: str, audio_path: str):
+        """Write Hebrew speech for text to an MP3 file"""
+        raise NotImplementedError
+
+    async def keep_warm(self):
+        """Keep connections to the service ready for the next reply (runs for the server's lifetime)"""
+
+    async def close(self):
+        """Release connections to the service"""
+
+    def stats(self) -> dict:
+        """Connection reuse statistics"""
+        return {}
+
+
+class OpenAITranscriber(Transcriber):
+    """Whisper transcription through the OpenAI API"""
+
+    def __init__(self, model: str = "whisper-1"):
+        self.model = model
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            # A cancelled transcription keeps running in its thread; the request timeout ends it
+            self._client = OpenAI(timeout=STAGE_BUDGETS["transcription"], max_retries=1)
+        return self._client
+
+    async def transcribe(self, audio_path: str) -> str:
+        # The OpenAI client blocks; keep the event loop free for other fridges
+        return await asyncio.to_thread(self._transcribe, audio_path)
+
+    def _transcribe(self, audio_path: str) -> str:
+        with open(audio_path, "rb") as audio_file:
+            transcription = self.client.audio.transcriptions.create(
+                model=self.model,
+                file=audio_file,
+                language="he"  # Hebrew language
+            )
+        return transcription.text
+
+
+class SmartAgentBackend(AgentBackend):
+    """The agno SmartShoppingAgent with the OpenAI model"""
+
+    def __init__(self, store: Optional[ShoppingListStore] = None):
+        self.store = store
+
+    async def run(self, command: str, list_id: str = DEFAULT_LIST_ID) -> str:
+        from shopping_agent import SmartShoppingAgent
+        agent = SmartShoppingAgent(list_id=list_id, store=self.store)
+        # Run the blocking agent in a worker thread; toolkit writes are serialized by the list lock.
+        # Model errors propagate so the caller falls back and counts them against the agent's circuit
+        return await asyncio.to_thread(agent.process_voice_command, command, raise_errors=True)
+
+
+class EdgeTTSSynthesizer(Synthesizer):
+    """Microsoft Edge neural voices through edge-tts, over warm pooled connections"""
+
+    def __init__(self, voice: str = HEBREW_VOICE, pool_size: int = TTS_POOL_SIZE):
+        self.voice = voice
+        self.pool = EdgeTTSConnectionPool(voice, pool_size)
+
+    async def synthesize(self, text: str, audio_path: str):
+        if self.pool.accepts(text):
+            try:
+                return await self.pool.synthesize(text, audio_path)
+            except (ImportError, AttributeError) as e:
+                # The pool relies on edge-tts protocol helpers; an edge-tts release without them disables it
+                logger.warning(f"TTS connection pool unavailable with this edge-tts version ({e!r}), disabling it")
+                self.pool.size = 0
+            except Exception as e:
+                # The pool speaks the protocol through edge-tts internals; any other failure costs only
+                # this reply a fresh connection through the public API
+                logger.warning(f"TTS connection pool failed ({e!r}), synthesizing this reply without it")
+
+        import edge_tts
+        communicate = edge_tts.Communicate(text, self.voice)
+        await communicate.save(audio_path)
+
+    async def keep_warm(self):
+        await self.pool.keep_warm()
+
+    async def close(self):
+        await self.pool.close()
+
+    def stats(self) -> dict:
+        return self.pool.stats()
+
+
+class StubTranscriber(Transcriber):
+    """Deterministic offline transcriber for load tests
+
+    Audio that is UTF-8 text is "transcribed" to that text, so a load
+    generator can choose the command; any other audio maps to one of
+    STUB_COMMANDS by its hash.
+    """
+
+    def __init__(self, latency_ms: float = STUB_STT_LATENCY_MS):
+        self.latency_ms = latency_ms
+
+    async def transcribe(self, audio_path: str) -> str:
+        await asyncio.sleep(self.latency_ms / 1000)
+        with open(audio_path, "rb") as f:
+            content = f.read()
+        try:
+            text = content.decode("utf-8").strip()
+            if text:
+                return text
+        except UnicodeDecodeError:
+            pass
+        digest = hashlib.sha1(content).digest()
+        return STUB_COMMANDS[digest[0] % len(STUB_COMMANDS)]
+
+
+class StubAgentBackend(AgentBackend):
+    """Deterministic offline agent: keyword parsing applied through the real toolkit
+
+    Stands in for the model round-trips only; list reads and writes go
+    through ShoppingListToolkit and the store exactly as the agent's tool
+    calls would.
+    """
+
+    ADD_WORDS = ["הוסף", "תוסיף", "להוסיף"]
+    FILLER_WORDS = ADD_WORDS + ["לרשימה", "את", "לי"]
+
+    def __init__(self, store: Optional[ShoppingListStore] = None, latency_ms: float = STUB_AGENT_LATENCY_MS):
+        self.store = store or get_default_store()
+        self.latency_ms = latency_ms
+
+    async def run(self, command: str, list_id: str = DEFAULT_LIST_ID) -> str:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return await asyncio.to_thread(self._run_tools, command, list_id)
+
+    def _run_tools(self, command: str, list_id: str) -> str:
+        from shopping_tool import ShoppingListToolkit
+        toolkit = ShoppingListToolkit(list_id=list_id, store=self.store)
+
+        if any(word in command for word in self.ADD_WORDS):
+            item_name = " ".join(word for word in command.split() if word not in self.FILLER_WORDS)
+            if not item_name:
+                return "לא הבנתי איזה פריט להוסיף"
+            result = toolkit.add_item_with_smart_category(item_name, "1", "אחר")
+            return f"הוספתי {item_name}" if "✅" in result else result
+
+        stats = toolkit.get_shopping_stats()
+        return stats.splitlines()[0] if stats else "הרשימה ריקה"
+
+
+class StubSynthesizer(Synthesizer):
+    """Offline synthesizer that writes a tiny placeholder MP3 after a fixed delay"""
+
+    # MPEG-1 Layer III frame header followed by silence
+    PLACEHOLDER_MP3 = b"\xff\xfb\x90\x00" + b"\x00" * 413
+
+    def __init__(self, latency_ms: float = STUB_TTS_LATENCY_MS):
+        self.latency_ms = latency_ms
+
+    async def synthesize(self, text: str, audio_path: str):
+        await asyncio.sleep(self.latency_ms / 1000)
+        with open(audio_path, "wb") as f:
+            f.write(self.PLACEHOLDER_MP3)
+
+
+def create_transcriber(backend: str = STT_BACKEND) -> Transcriber:
+    if backend == "stub":
+        logger.info(f"Using stub transcriber ({STUB_STT_LATENCY_MS:.0f}ms)")
+        return StubTranscriber()
+    return OpenAITranscriber()
+
+
+def create_agent_backend(store: Optional[ShoppingListStore] = None, backend: str = AGENT_BACKEND) -> AgentBackend:
+    if backend == "stub":
+        logger.info(f"Using stub agent ({STUB_AGENT_LATENCY_MS:.0f}ms)")
+        return StubAgentBackend(store)
+    return SmartAgentBackend(store)
+
+
+def create_synthesizer(backend: str = TTS_BACKEND) -> Synthesizer:
+    if backend == "stub":
+        logger.info(f"Using stub synthesizer ({STUB_TTS_LATENCY_MS:.0f}ms)")
+        return StubSynthesizer()
+    return EdgeTTSSynthesizer()
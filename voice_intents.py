@@ -0,0 +1,122 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from list_store import CATEGORIES
+from metrics import VOICE_ANSWER_CACHE_LOOKUPS_TOTAL
+
+# Answers to read-only voice questions kept per (list, intent) for the list version they were given at
+VOICE_ANSWER_CACHE = os.getenv("VOICE_ANSWER_CACHE", "on")  # on | off
+VOICE_ANSWER_CACHE_SIZE = int(os.getenv("VOICE_ANSWER_CACHE_SIZE", "512"))
+
+# A command with any of these words (also after ו/ש) changes the list, whatever else it says
+MUTATION_WORDS = {"הוסף", "תוסיף", "להוסיף", "תכניס", "שים", "תשים", "מחק", "תמחק", "למחוק", "הסר", "תסיר",
+                  "להסיר", "תוריד", "סמן", "תסמן", "קניתי", "עדכן", "תעדכן", "נקה", "תנקה", "תשנה", "שנה", "תעביר"}
+
+# Words that do not change what is asked ("תגיד לי בבקשה מה יש ברשימה")
+FILLER_WORDS = {"בבקשה", "תגיד", "תגידי", "תגידו", "לי", "לנו", "אפשר", "נו", "רגע", "אממ", "אה", "היי", "שלום",
+                "את", "כל", "עכשיו", "כרגע", "שלי", "שלנו"}
+
+NIQQUD = re.compile(r"[\u0591-\u05C7]")
+PUNCTUATION = re.compile(r"[^\w\s]")
+
+LIST = r"ה?רשימה|ה?רשימת ה?קניות"
+INTENT_PATTERNS = [
+    ("count", re.compile(rf"^כמה (פריטים|דברים|מוצרים)( יש)?( ב({LIST}))?$|^כמה (דברים )?יש ב({LIST})$")),
+    ("pending", re.compile(r"^מה (עוד )?(לא קנינו|נשאר( לקנות)?|צריך לקנות|חסר|עוד לא נקנה)$")),
+    ("list", re.compile(rf"^(מה (יש )?(ב|על )?({LIST})|(תראה|תקריא|הראה|הקרא) ({LIST})|({LIST}))$")),
+]
+
+# "מה יש בירקות": a category by its full name or its first word ("חלב", "בשר", "חטיפים")
+CATEGORY_NAMES: Dict[str, str] = {}
+for _category in CATEGORIES:
+    if _category != "אחר":
+        CATEGORY_NAMES[_category] = _category
+        CATEGORY_NAMES.setdefault(_category.split()[0], _category)
+CATEGORY_PATTERN = re.compile(
+    r"^מה (יש |צריך |צריך לקנות |נשאר )?(ב|מ)ה?(" + "|".join(sorted(map(re.escape, CATEGORY_NAMES), key=len,
+                                                                   reverse=True)) + r")( ברשימה)?$"
+)
+
+
+def normalize_command(text: str) -> str:
+    """Lower-case words without niqqud, punctuation or filler words, single-spaced"""
+    text = PUNCTUATION.sub(" ", NIQQUD.sub("", text.lower()))
+    return " ".join(word for word in text.split() if word not in FILLER_WORDS)
+
+
+def read_only_intent(text: str) -> Optional[str]:
+    """The read-only question a voice command asks ("list", "count", "pending", "category:<name>"), or None
+
+    Only whole-command matches count, so anything that might also change
+    the list (or is phrased unlike the known questions) goes to the agent.
+    """
+    normalized = normalize_command(text)
+    words = normalized.split()
+    if not words or any(word in MUTATION_WORDS or word[1:] in MUTATION_WORDS for word in words):
+        return None
+    for intent, pattern in INTENT_PATTERNS:
+        if pattern.match(normalized):
+            return intent
+    match = CATEGORY_PATTERN.match(normalized)
+    if match:
+        return f"category:{CATEGORY_NAMES[match.group(3)]}"
+    return None
+
+
+class VoiceAnswerCache:
+    """Final answers to read-only voice questions, keyed on (list, intent) and valid for one list version
+
+    An entry records the list version the answer was given at; any change
+    of the list bumps its version, so a lookup at a newer version misses
+    (also for changes made by other workers), and local saves drop the
+    list's entries right away. Least recently used entries go first.
+    """
+
+    def __init__(self, max_entries: int = VOICE_ANSWER_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, list_id: str, intent: str, version: int) -> Optional[str]:
+        """The answer given to intent at this list version, or None"""
+        with self._lock:
+            entry = self._entries.get((list_id, intent))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                VOICE_ANSWER_CACHE_LOOKUPS_TOTAL.inc(result="miss")
+                return None
+            self._entries.move_to_end((list_id, intent))
+            self.hits += 1
+        VOICE_ANSWER_CACHE_LOOKUPS_TOTAL.inc(result="hit")
+        return entry[1]
+
+    def put(self, list_id: str, intent: str, version: int, answer: str):
+        with self._lock:
+            self._entries[(list_id, intent)] = (version, answer)
+            self._entries.move_to_end((list_id, intent))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, list_id: str, version: Optional[int] = None):
+        """Drop a list's answers; a store listener, so called after every local save"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == list_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }